@@ -1,4 +1,5 @@
 import eventlet
+import eventlet.tpool
 import time
 import json
 import threading
@@ -9,7 +10,12 @@ import numpy as np
 import os
 from LOBOROBOT import LOBOROBOT
 from camera import Camera
+from video_source import open_source
 from slam import SLAM
+from navigator import Navigator
+from stream_quality import AdaptiveStream
+from recorder import VideoRecorder
+from video_channel import VideoChannel
 from imu import MPU6050  # Import the MPU6050 class
 
 
@@ -22,108 +28,125 @@ socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet',
                    ping_timeout=10, ping_interval=5,
                    max_http_buffer_size=5*1024*1024)  # 增加缓冲区大小
 
-# Initialize hardware components
-try:
-    robot = LOBOROBOT()
-    print("机器人控制器初始化成功")
-except Exception as e:
-    print(f"警告: 机器人控制器初始化失败 - {e}")
-    print("使用模拟控制器...")
-    # 创建一个模拟的机器人控制器
-    class DummyRobot:
-        def __init__(self):
-            print("模拟机器人控制器已初始化")
-            
-        def t_stop(self, *args):
-            print("模拟: 停止")
-            
-        def t_up(self, speed, *args):
-            print(f"模拟: 前进，速度={speed}")
-            
-        def t_down(self, speed, *args):
-            print(f"模拟: 后退，速度={speed}")
-            
-        def turnLeft(self, speed, *args):
-            print(f"模拟: 左转，速度={speed}")
-            
-        def turnRight(self, speed, *args):
-            print(f"模拟: 右转，速度={speed}")
-            
-        def set_servo_angle(self, channel, angle):
-            print(f"模拟: 设置舵机，通道={channel}，角度={angle}")
-            
-        def get_adc_value(self, channel):
-            # 返回模拟的ADC值，模拟满电状态
-            return 850  # 模拟值，大约对应8V电压
-    
-    robot = DummyRobot()
-
-# 降低分辨率到320x240，提高传输性能
-try:
-    camera = Camera(camera_id=0, width=320, height=240, robot=robot, jpeg_quality=60)
-    print("摄像头初始化成功")
-except Exception as e:
-    print(f"警告: 摄像头初始化失败 - {e}")
-    # 创建一个模拟的摄像头
-    from camera import Camera
-    class DummyCamera(Camera):
-        def __init__(self, **kwargs):
-            super().__init__(**kwargs)
-            print("模拟摄像头已初始化")
-            self.frame = None
-            
-        def start(self):
-            self.running = True
-            self.thread = threading.Thread(target=self._dummy_capture)
-            self.thread.daemon = True
-            self.thread.start()
-            print("模拟摄像头启动")
-            
-        def _dummy_capture(self):
-            # 创建一个带有文字的黑色图像作为模拟视频
-            while self.running:
-                frame = np.zeros((240, 320, 3), dtype=np.uint8)
-                cv2.putText(frame, "Camera Unavailable", (40, 120), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
-                cv2.putText(frame, "Using Simulation", (60, 150), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 165, 255), 2)
-                
-                with self.lock:
-                    self.frame = frame
-                    
-                time.sleep(0.1)
-    
-    camera = DummyCamera(camera_id=0, width=320, height=240, robot=robot, jpeg_quality=60)
-
-try:
-    slam = SLAM(camera=camera, use_imu=True)  # Enable IMU integration with SLAM
-    print("SLAM初始化成功")
-except Exception as e:
-    print(f"警告: SLAM初始化失败 - {e}")
-    # 如果需要，可以创建一个模拟的SLAM系统
-
-# Global variables for control
-control_lock = threading.Lock()
-current_speed = 0
-current_direction = 'stop'
-current_gimbal_h = 80  # Initial horizontal angle
-current_gimbal_v = 40  # Initial vertical angle
-
-# Ensure data directory exists
-os.makedirs('static/data', exist_ok=True)
-
-# Start camera and SLAM
-try:
-    camera.start()
-    print("摄像头已启动")
-except Exception as e:
-    print(f"启动摄像头失败: {e}")
-
-try:
-    slam.start()
-    print("SLAM系统已启动")
-except Exception as e:
-    print(f"启动SLAM系统失败: {e}")
+# spawn 启动的工作进程（SLAM 前端、JPEG 编码）会以 __mp_main__ 导入本文件，
+# 只有主进程初始化硬件、SLAM 和各服务
+if __name__ != '__mp_main__':
+    # Initialize hardware components
+    try:
+        robot = LOBOROBOT()
+        print("机器人控制器初始化成功")
+    except Exception as e:
+        print(f"警告: 机器人控制器初始化失败 - {e}")
+        print("使用模拟控制器...")
+        # 创建一个模拟的机器人控制器
+        class DummyRobot:
+            def __init__(self):
+                print("模拟机器人控制器已初始化")
+
+            def t_stop(self, *args):
+                print("模拟: 停止")
+
+            def t_up(self, speed, *args):
+                print(f"模拟: 前进，速度={speed}")
+
+            def t_down(self, speed, *args):
+                print(f"模拟: 后退，速度={speed}")
+
+            def turnLeft(self, speed, *args):
+                print(f"模拟: 左转，速度={speed}")
+
+            def turnRight(self, speed, *args):
+                print(f"模拟: 右转，速度={speed}")
+
+            def set_servo_angle(self, channel, angle):
+                print(f"模拟: 设置舵机，通道={channel}，角度={angle}")
+
+            def get_adc_value(self, channel):
+                # 返回模拟的ADC值，模拟满电状态
+                return 850  # 模拟值，大约对应8V电压
+
+        robot = DummyRobot()
+
+    # 降低分辨率到320x240，提高传输性能
+    # 设置 SMARTCAR_REPLAY 为视频文件、图片目录或 .raw 帧文件时，用回放源代替摄像头
+    replay_path = os.environ.get('SMARTCAR_REPLAY')
+    try:
+        camera = Camera(camera_id=0, width=320, height=240, robot=robot, jpeg_quality=60,
+                        encode_workers=2,
+                        source=open_source(replay_path) if replay_path else None)
+        print("摄像头初始化成功")
+    except Exception as e:
+        print(f"警告: 摄像头初始化失败 - {e}")
+        # 创建一个模拟的摄像头
+        from camera import Camera
+        class DummyCamera(Camera):
+            def __init__(self, **kwargs):
+                super().__init__(**kwargs)
+                print("模拟摄像头已初始化")
+                self.frame = None
+
+            def start(self):
+                self.running = True
+                self.thread = threading.Thread(target=self._dummy_capture)
+                self.thread.daemon = True
+                self.thread.start()
+                print("模拟摄像头启动")
+
+            def _dummy_capture(self):
+                # 创建一个带有文字的黑色图像作为模拟视频
+                while self.running:
+                    frame = np.zeros((240, 320, 3), dtype=np.uint8)
+                    cv2.putText(frame, "Camera Unavailable", (40, 120), 
+                               cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+                    cv2.putText(frame, "Using Simulation", (60, 150), 
+                               cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 165, 255), 2)
+
+                    self._publish_frame(frame)
+
+                    time.sleep(0.1)
+
+        camera = DummyCamera(camera_id=0, width=320, height=240, robot=robot, jpeg_quality=60)
+
+    try:
+        # KLT 光流跟踪只在关键帧上运行 ORB，比逐帧匹配快得多（见 bench_slam.py）
+        # 设置 SMARTCAR_SLAM_FRONTEND=process 时 SLAM 前端在独立进程中运行，不与服务器争用 GIL
+        slam = SLAM(camera=camera, use_imu=True, tracking='klt',
+                    frontend=os.environ.get('SMARTCAR_SLAM_FRONTEND', 'thread'))  # Enable IMU integration with SLAM
+        print("SLAM初始化成功")
+    except Exception as e:
+        print(f"警告: SLAM初始化失败 - {e}")
+        # 如果需要，可以创建一个模拟的SLAM系统
+
+    # 录像在独立的写线程中进行，不影响采集
+    recorder = VideoRecorder(camera, output_dir='recordings', segment_minutes=5)
+
+    # Socket.IO 二进制视频通道（带帧头和基于信用的流控），作为 MJPEG 的替代
+    video_channel = VideoChannel(socketio, camera, slam)
+
+    # Global variables for control
+    control_lock = threading.Lock()
+    # 在 SLAM 占据栅格上规划路径并自动驾驶到目标点，摇杆操作会立即取消
+    navigator = Navigator(slam, robot, control_lock)
+    current_speed = 0
+    current_direction = 'stop'
+    current_gimbal_h = 80  # Initial horizontal angle
+    current_gimbal_v = 40  # Initial vertical angle
+
+    # Ensure data directory exists
+    os.makedirs('static/data', exist_ok=True)
+
+    # Start camera and SLAM
+    try:
+        camera.start()
+        print("摄像头已启动")
+    except Exception as e:
+        print(f"启动摄像头失败: {e}")
+
+    try:
+        slam.start()
+        print("SLAM系统已启动")
+    except Exception as e:
+        print(f"启动SLAM系统失败: {e}")
 
 @app.route('/')
 def index():
@@ -133,33 +156,153 @@ def index():
 @app.route('/video_feed')
 def video_feed():
     """Video streaming route"""
+    # 生成器在请求上下文之外运行，先取出客户端地址
+    address = request.remote_addr
+    
     def generate():
-        last_frame_time = 0
-        frame_interval = 1/10  # 限制最大10fps的输出，减轻网络负担
+        last_frame_id = 0
+        # 每个连接根据自身发送耗时在画质/帧率档位之间自适应切换
+        stream = AdaptiveStream()
+        client = camera.metrics.open_client('mjpeg', address)
         
-        while True:
-            # 控制帧率
-            current_time = time.time()
-            if current_time - last_frame_time < frame_interval:
-                time.sleep(0.01)  # 短暂休眠以减少CPU使用
-                continue
+        try:
+            while True:
+                tier = stream.tier
+                # 在原生线程中等待新帧，避免阻塞eventlet主循环；有新帧时立即唤醒
+                frame_id, frame = eventlet.tpool.execute(
+                    camera.wait_for_jpeg, last_frame_id, tier.quality, 1.0, tier.size)
+                if frame is None:
+                    continue
                 
-            frame = camera.get_frame()
-            if frame is not None:
+                last_frame_id = frame_id
+                sent_time = time.time()
                 yield (b'--frame\r\n'
                        b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-                last_frame_time = time.time()
-            else:
-                time.sleep(0.1)
+                # 生成器恢复时，上一帧已写入socket，耗时即为该客户端的发送背压
+                send_time = time.time() - sent_time
+                stream.record_send(send_time)
+                camera.metrics.record('send', send_time)
+                capture_time = camera.get_capture_time(frame_id)
+                if capture_time is not None:
+                    camera.metrics.record('end_to_end', time.monotonic() - capture_time)
+                client.frame_sent(frame_id, tier.name)
+                
+                # 控制帧率
+                remaining = stream.interval - (time.time() - sent_time)
+                if remaining > 0:
+                    eventlet.sleep(remaining)
+        finally:
+            camera.metrics.close_client(client)
     
     return Response(generate(),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
+@app.route('/video_stats')
+def video_stats():
+    """Return video pipeline latency histograms and per-client delivery stats"""
+    stats = camera.metrics.snapshot()
+    stats['camera'] = {
+        'frame_id': camera.frame_id,
+        'ring_dropped': camera.ring.dropped,
+        'encodes': camera.encode_count,
+        'decodes': camera.decode_count,
+        'capture_mode': camera.capture_mode,
+    }
+    return jsonify(stats)
+
+@app.route('/slam_stats')
+def slam_stats():
+    """Return SLAM scheduler rate, CPU budget use and frontend counters"""
+    return jsonify(slam.get_stats())
+
 @app.route('/map_data')
 def map_data():
     """Return the current map data as JSON"""
     return jsonify(slam.get_map_data())
 
+@app.route('/map_delta')
+def map_delta():
+    """Return map points and trajectory added or refined since the client's cursor"""
+    epoch = request.args.get('epoch', type=int)
+    return jsonify(slam.get_map_delta(epoch,
+                                      request.args.get('points', 0, type=int),
+                                      request.args.get('trajectory', 0, type=int),
+                                      request.args.get('revision', 0, type=int),
+                                      request.args.get('trajectory_epoch', 0, type=int)))
+
+@app.route('/map_binary')
+def map_binary():
+    """Return map rows past the client's cursor as little-endian float32 (see slam.MAP_HEADER)"""
+    # ETag 为地图版本，地图未变化时返回 304，不重新打包
+    etag = '%d.%d.%d.%d.%d' % slam.map_version()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    # points_only=1 leaves out the trajectory, for clients that use /trajectory
+    trajectory_from = None if request.args.get('points_only', 0, type=int) \
+        else request.args.get('trajectory', 0, type=int)
+    version, body = slam.export_map_binary(request.args.get('epoch', type=int),
+                                           request.args.get('points', 0, type=int),
+                                           trajectory_from,
+                                           request.args.get('revision', 0, type=int),
+                                           request.args.get('trajectory_epoch', 0, type=int))
+    response = Response(body, mimetype='application/octet-stream')
+    response.set_etag('%d.%d.%d.%d.%d' % version)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/trajectory')
+def trajectory():
+    """Return the trajectory simplified to a tolerance and/or point budget (see slam.TRAJECTORY_HEADER)"""
+    etag = '%d.%d.%d' % slam.trajectory_version()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    version, body = slam.export_trajectory(request.args.get('tolerance', type=float),
+                                           request.args.get('budget', type=int))
+    response = Response(body, mimetype='application/octet-stream')
+    response.set_etag('%d.%d.%d' % version)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/occupancy_grid')
+def occupancy_grid():
+    """Return the occupancy grid as a uint8 raster (see occupancy_grid.GRID_HEADER)"""
+    etag = str(slam.grid.version)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    version, body = slam.grid.export_raster()
+    response = Response(body, mimetype='application/octet-stream')
+    response.set_etag(str(version))
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/navigation/goal', methods=['POST'])
+def navigation_goal():
+    """Start driving to a goal position in map units"""
+    data = request.get_json(silent=True) or {}
+    try:
+        x, y = float(data['x']), float(data['y'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'x and y are required'}), 400
+    navigator.set_goal(x, y)
+    return jsonify({'status': 'success', 'goal': [x, y]})
+
+@app.route('/navigation/cancel', methods=['POST'])
+def navigation_cancel():
+    """Stop navigating"""
+    navigator.cancel()
+    return jsonify({'status': 'success'})
+
+@app.route('/navigation/status')
+def navigation_status():
+    """Return the navigation state, planned path and replanning cost"""
+    return jsonify(navigator.get_status())
+
 @app.route('/position')
 def position():
     """Return the current position and orientation as JSON"""
@@ -209,7 +352,8 @@ def imu_status():
 @app.route('/reset_slam', methods=['POST'])
 def reset_slam():
     """Reset SLAM system"""
-    slam.reset()
+    # 等待 SLAM 锁，放到线程池里执行，不阻塞 eventlet
+    eventlet.tpool.execute(slam.reset)
     return jsonify({'status': 'success'})
 
 @app.route('/reset_gimbal', methods=['POST'])
@@ -221,6 +365,52 @@ def reset_gimbal():
     current_gimbal_v = 40
     return jsonify({'status': 'success'})
 
+@app.route('/recording/start', methods=['POST'])
+def start_recording():
+    """Start recording the camera stream to segmented files"""
+    data = request.get_json(silent=True) or {}
+    recorder.start(segment_minutes=data.get('segment_minutes'))
+    return jsonify(recorder.status())
+
+@app.route('/recording/stop', methods=['POST'])
+def stop_recording():
+    """Stop recording"""
+    # 停止时需要等待写线程把队列写完，放到原生线程中避免阻塞eventlet
+    eventlet.tpool.execute(recorder.stop)
+    return jsonify(recorder.status())
+
+@app.route('/recording/status')
+def recording_status():
+    """Return the recorder state"""
+    return jsonify(recorder.status())
+
+@socketio.on('recording_control')
+def handle_recording_control(data):
+    """Start or stop recording from the web interface"""
+    action = data.get('action')
+    if action == 'start':
+        recorder.start(segment_minutes=data.get('segment_minutes'))
+    elif action == 'stop':
+        # 停止时需要等待写线程把队列写完，放到原生线程中避免阻塞eventlet
+        eventlet.tpool.execute(recorder.stop)
+    emit('recording_status', recorder.status(), broadcast=True)
+
+@socketio.on('video_subscribe')
+def handle_video_subscribe(data=None):
+    """Start pushing binary video frames to this client"""
+    data = data or {}
+    video_channel.subscribe(request.sid, data.get('credits'), data.get('tier'))
+
+@socketio.on('video_unsubscribe')
+def handle_video_unsubscribe():
+    """Stop pushing video frames to this client"""
+    video_channel.unsubscribe(request.sid)
+
+@socketio.on('video_ack')
+def handle_video_ack(data):
+    """Client has displayed a frame, give its credit back"""
+    video_channel.ack(request.sid, data.get('frame_id'))
+
 # 保持连接的心跳检测
 @socketio.on('ping')
 def handle_ping():
@@ -242,6 +432,7 @@ def handle_connect():
 def handle_disconnect():
     """Handle client disconnection"""
     print('Client disconnected')
+    video_channel.unsubscribe(request.sid)
     # Stop the car when client disconnects
     with control_lock:
         robot.t_stop(0)
@@ -251,6 +442,10 @@ def handle_car_control(data):
     """Handle car movement control from joystick"""
     global current_speed, current_direction
     
+    # 手动操作优先于自动导航
+    if navigator.active:
+        navigator.cancel()
+    
     # Extract joystick data
     x = data.get('x', 0)  # -1 (left) to 1 (right)
     y = data.get('y', 0)  # -1 (down) to 1 (up)
@@ -419,6 +614,8 @@ if __name__ == '__main__':
     finally:
         # Clean up resources
         print("关闭服务器并清理资源...")
+        navigator.cancel()
+        recorder.stop()
         camera.stop()
         slam.stop()
         robot.t_stop(0) 
\ No newline at end of file
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Loop Closure Benchmark
+
+This script measures loop closure candidate search as the number of
+keyframes grows: the bag-of-words inverted index (keyframe_database.
+KeyframeDatabase) against brute-force Hamming matching of the frame's
+descriptors with every stored keyframe (keyframe_index.KeyframeIndex,
+as relocalization does). Keyframes are synthetic places of random ORB-
+like descriptors; each query revisits one of them with bit noise and
+some unrelated features, and recall is the share of queries whose best
+candidate is the revisited keyframe.
+
+It then times a pose graph optimization (pose_graph.optimize) of a
+drifting square loop of keyframes closed by one loop edge.
+
+Usage: python bench_loop.py [features per keyframe]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from keyframe_database import KeyframeDatabase
+from keyframe_index import KeyframeIndex
+from pose_graph import optimize, relative, wrap
+from slam import Keyframe
+from vocabulary import Vocabulary
+
+
+def places(count, features, rng):
+    """count keyframes of random 256-bit descriptors"""
+    return [rng.integers(0, 256, (features, 32), dtype=np.uint8) for _ in range(count)]
+
+
+def revisit(des, rng, flip=0.05, new=0.3):
+    """A later view of a place: some bits flipped, a share of the features replaced"""
+    bits = np.unpackbits(des, axis=1)
+    bits ^= (rng.random(bits.shape) < flip).astype(np.uint8)
+    noisy = np.packbits(bits, axis=1)
+    replaced = rng.random(len(noisy)) < new
+    noisy[replaced] = rng.integers(0, 256, (int(replaced.sum()), 32), dtype=np.uint8)
+    return noisy
+
+
+def bench_search(keyframes, vocabulary, rng, queries=20):
+    """Returns (database ms/query, recall, brute-force ms/query, recall, database build ms)"""
+    start = time.perf_counter()
+    database = KeyframeDatabase(vocabulary)
+    for des in keyframes:
+        database.add(des)
+    build_ms = (time.perf_counter() - start) * 1000
+    index = KeyframeIndex([Keyframe(i, None, None, des) for i, des in enumerate(keyframes)],
+                          features_per_keyframe=len(keyframes[0]))
+
+    targets = rng.integers(0, len(keyframes), queries)
+    views = [revisit(keyframes[t], rng) for t in targets]
+    results = []
+    for search in (lambda des: database.query(des, 1), lambda des: index.query(des, 1)):
+        hits = 0
+        start = time.perf_counter()
+        for target, des in zip(targets, views):
+            best = search(des)
+            hits += bool(best) and best[0][0] == target
+        results.append(((time.perf_counter() - start) * 1000 / queries, hits / queries))
+    return results[0] + results[1] + (build_ms,)
+
+
+def bench_pose_graph(count, rng):
+    """Optimize a square loop of count keyframes with odometry noise, returns (ms, error before, after)"""
+    side = count // 4
+    truth = []
+    for k, (x, y) in enumerate([(0, 0), (10, 0), (10, 10), (0, 10)]):
+        angle = k * np.pi / 2
+        truth += [(x + np.cos(angle) * 10 * t / side, y + np.sin(angle) * 10 * t / side, angle)
+                  for t in range(side)]
+    truth = np.array(truth)
+    n = len(truth)
+    odometry = np.array([relative(truth[k], truth[k + 1]) for k in range(n - 1)])
+    odometry += rng.normal(0, [0.01, 0.01, 0.005], odometry.shape)
+    poses = [truth[0]]
+    for dx, dy, da in odometry:
+        x, y, a = poses[-1]
+        poses.append((x + np.cos(a) * dx - np.sin(a) * dy, y + np.sin(a) * dx + np.cos(a) * dy, wrap(a + da)))
+    poses = np.array(poses)
+    i = np.r_[np.arange(n - 1), 0]
+    j = np.r_[np.arange(1, n), n - 1]
+    z = np.vstack([odometry, relative(truth[0], truth[-1])])
+    start = time.perf_counter()
+    corrected = optimize(poses, i, j, z)
+    elapsed = (time.perf_counter() - start) * 1000
+    error = lambda p: np.hypot(*(p[:, :2] - truth[:, :2]).T).max()
+    return elapsed, error(poses), error(corrected)
+
+
+def main():
+    features = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    rng = np.random.default_rng(0)
+    start = time.perf_counter()
+    vocabulary = Vocabulary.train(places(100, features, rng), branching=10, depth=4, iterations=5)
+    print(f"Vocabulary: {len(vocabulary)} words, trained in {time.perf_counter() - start:.1f}s")
+    print()
+
+    print(f"{'keyframes':>9} {'BoW ms':>8} {'recall':>7} {'brute ms':>9} {'recall':>7} {'speedup':>8} {'build ms':>9}")
+    for count in (100, 1000, 5000):
+        keyframes = places(count, features, rng)
+        bow_ms, bow_recall, brute_ms, brute_recall, build_ms = bench_search(keyframes, vocabulary, rng)
+        print(f"{count:>9} {bow_ms:>8.2f} {bow_recall:>7.2f} {brute_ms:>9.2f} {brute_recall:>7.2f} "
+              f"{brute_ms / bow_ms:>7.1f}x {build_ms:>9.0f}")
+    print()
+
+    print(f"{'poses':>6} {'optimize':>10} {'error before':>13} {'after':>7}")
+    for count in (100, 1000, 4000):
+        ms, before, after = bench_pose_graph(count, rng)
+        print(f"{count:>6} {ms:>8.0f}ms {before:>13.3f} {after:>7.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Map Point Store Benchmark
+
+This script measures the voxel-hashed map point store (map_store.VoxelMap)
+at 10^5 and 10^6 points: insert throughput in keyframe-sized batches, the
+share of points merged into existing voxels, memory per voxel, nearest
+neighbour and radius query throughput, and the cost of one eviction pass.
+Points are scattered through a room-sized volume, with a fraction
+re-observed near earlier points as revisited surfaces would be.
+
+It then times occupancy grid (occupancy_grid.OccupancyGrid) updates for
+ray batches from a SLAM keyframe's handful of landmarks up to a full
+360-ray scan, and the uint8 raster export.
+
+Usage: python bench_map.py [voxel size]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from map_store import VoxelMap
+from occupancy_grid import OccupancyGrid
+
+
+def room_points(count, rng, size=(20.0, 20.0, 3.0), revisit=0.3):
+    """count points in a room, a revisit share of them jittered copies of earlier ones"""
+    points = rng.uniform(0, 1, (count, 3)) * size
+    repeats = rng.random(count) < revisit
+    repeats[0] = False
+    earlier = (rng.random(count) * np.arange(count)).astype(np.int64)
+    points[repeats] = points[earlier[repeats]] + rng.normal(0, 0.01, (int(repeats.sum()), 3))
+    return points.astype(np.float32)
+
+
+def bench_insert(points, voxel_size, batch):
+    """Insert points in batches, returns (points/s, store)"""
+    store = VoxelMap(voxel_size=voxel_size, capacity=len(points))
+    start = time.perf_counter()
+    for i in range(0, len(points), batch):
+        store.extend(points[i:i + batch])
+    elapsed = time.perf_counter() - start
+    return len(points) / elapsed, store
+
+
+def bench_nearest(store, queries, max_distance):
+    """Batched nearest-neighbour queries, returns (queries/s, hit share)"""
+    start = time.perf_counter()
+    rows, _ = store.nearest(queries, max_distance)
+    elapsed = time.perf_counter() - start
+    return len(queries) / elapsed, np.mean(rows >= 0)
+
+
+def bench_radius(store, queries, radius):
+    """One radius query per call, returns (queries/s, mean points found)"""
+    found = 0
+    start = time.perf_counter()
+    for point in queries:
+        found += len(store.radius(point, radius))
+    elapsed = time.perf_counter() - start
+    return len(queries) / elapsed, found / len(queries)
+
+
+def bench_evict(points, voxel_size):
+    """Time one eviction pass down from a full store, returns ms"""
+    store = VoxelMap(voxel_size=voxel_size, capacity=len(points))
+    store.extend(points)
+    store.capacity = len(store) - 1
+    start = time.perf_counter()
+    store.extend(points[-1:] + 100)
+    return (time.perf_counter() - start) * 1000
+
+
+def bench_grid(rays, rng, updates=200, reach=3.0):
+    """Random ray batches cast from poses along a straight path, returns (ms/update, grid)"""
+    grid = OccupancyGrid()
+    poses = np.stack([np.linspace(0, 20, updates), np.zeros(updates)], axis=1)
+    angles = rng.uniform(0, 2 * np.pi, (updates, rays))
+    ranges = rng.uniform(0.5, reach, (updates, rays))
+    start = time.perf_counter()
+    for pose, a, r in zip(poses, angles, ranges):
+        grid.update(pose, pose + np.stack([np.cos(a), np.sin(a)], axis=1) * r[:, None])
+    elapsed = time.perf_counter() - start
+    return elapsed / updates * 1000, grid
+
+
+def main():
+    voxel_size = float(sys.argv[1]) if len(sys.argv) > 1 else 0.05
+    rng = np.random.default_rng(0)
+    print(f"Voxel size: {voxel_size}")
+    print()
+
+    print(f"{'points':>8} {'batch':>6} {'insert/s':>10} {'voxels':>8} {'merged':>7} {'B/voxel':>8} "
+          f"{'nearest/s':>10} {'hit':>5} {'radius/s':>9} {'found':>6} {'evict':>8}")
+    for count in (10 ** 5, 10 ** 6):
+        points = room_points(count, rng)
+        queries = room_points(10000, rng)
+        for batch in (500, 5000):
+            rate, store = bench_insert(points, voxel_size, batch)
+            merged = 1 - len(store) / count
+            per_voxel = store.nbytes / len(store)
+            nearest_rate, hit = bench_nearest(store, queries, 4 * voxel_size)
+            radius_rate, found = bench_radius(store, queries[:1000], 2 * voxel_size)
+            evict_ms = bench_evict(points, voxel_size)
+            print(f"{count:>8} {batch:>6} {rate:>10.0f} {len(store):>8} {merged:>6.1%} {per_voxel:>8.1f} "
+                  f"{nearest_rate:>10.0f} {hit:>5.2f} {radius_rate:>9.0f} {found:>6.1f} {evict_ms:>6.1f}ms")
+    print()
+
+    print(f"{'rays':>6} {'ms/update':>10} {'tiles':>6} {'raster ms':>10} {'bytes':>8}")
+    for rays in (5, 64, 360):
+        ms, grid = bench_grid(rays, rng)
+        start = time.perf_counter()
+        _, body = grid.export_raster()
+        raster_ms = (time.perf_counter() - start) * 1000
+        print(f"{rays:>6} {ms:>10.2f} {len(grid):>6} {raster_ms:>10.2f} {len(body):>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Vision Pipeline Benchmark
+
+This script replays a recording through Camera, SLAM and one MJPEG viewer
+and reports how many frames per second each stage gets through. Without
+arguments it generates a synthetic panning recording; pass a video file,
+an image directory or a .raw frame file to replay real footage instead.
+
+Usage: python bench_pipeline.py [recording] [--realtime]
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from camera import Camera
+from slam import SLAM
+from video_source import open_source, write_raw_frames
+
+
+class BenchRobot:
+    """Stand-in for LOBOROBOT so Camera can be created without hardware"""
+
+    def set_servo_angle(self, channel, angle):
+        pass
+
+
+def synthetic_frames(count=150, width=320, height=240):
+    """Yield a textured scene panning slowly to the right"""
+    rng = np.random.default_rng(0)
+    scene = rng.integers(0, 255, (height // 8, (width + count * 2 + 7) // 8, 3), dtype=np.uint8)
+    scene = np.kron(scene, np.ones((8, 8, 1), dtype=np.uint8))
+    for i in range(count):
+        yield scene[:, i * 2:i * 2 + width]
+
+
+def viewer(camera, stop_event, delivered):
+    """Pull JPEG frames like a /video_feed generator, without rate limiting"""
+    last_frame_id = 0
+    while not stop_event.is_set():
+        frame_id, frame = camera.wait_for_jpeg(last_frame_id, timeout=0.5)
+        if frame is None:
+            continue
+        last_frame_id = frame_id
+        delivered[0] += 1
+
+
+def run(path, pacing, duration, workdir):
+    camera = Camera(width=320, height=240, robot=BenchRobot(), source=open_source(path, pacing=pacing))
+    slam = SLAM(camera=camera, use_imu=False, map_dir=os.path.join(workdir, 'map'))
+
+    camera.start()
+    slam.start()
+    stop_event = threading.Event()
+    delivered = [0]
+    thread = threading.Thread(target=viewer, args=(camera, stop_event, delivered))
+    thread.daemon = True
+    thread.start()
+
+    time.sleep(duration)
+    stop_event.set()
+    slam.stop()
+    camera.stop()
+    thread.join()
+
+    return {
+        'captured': camera.frame_id / duration,
+        'slam': slam.frames_processed / duration,
+        'streamed': delivered[0] / duration,
+        'encodes': camera.encode_count / duration,
+    }
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    pacing = 'realtime' if '--realtime' in sys.argv else 'fast'
+
+    print("Vision Pipeline Benchmark")
+    print("=========================")
+    with tempfile.TemporaryDirectory() as workdir:
+        if args:
+            path = args[0]
+        else:
+            path = os.path.join(workdir, 'synthetic.raw')
+            write_raw_frames(path, synthetic_frames())
+        print(f"Source: {path} ({pacing} pacing)")
+
+        stats = run(path, pacing, 5, workdir)
+        for name, value in stats.items():
+            print(f"{name:>10}: {value:7.1f} frames/s")
+
+
+if __name__ == '__main__':
+    main()
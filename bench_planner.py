@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Path Planner Benchmark
+
+This script measures incremental replanning with D* Lite
+(path_planner.DStarLite) against planning from scratch on every step.
+On random obstacle grids of growing size, a robot follows the planned
+path two cells per step while new obstacles appear: some on the path
+just ahead (forcing a detour) and the rest anywhere on the grid, at
+several change rates. It reports the initial search and the mean time
+and vertex expansions per step for both strategies, and checks that
+they agree on the path cost.
+
+Usage: python bench_planner.py [steps]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from path_planner import DStarLite
+
+
+def random_grid(size, rng, density=0.2, block=4):
+    """size x size grid of random square obstacles covering about density of it"""
+    blocked = np.zeros((size, size), dtype=bool)
+    for _ in range(int(density * size * size / (block * block))):
+        x, y = rng.integers(0, size - block, 2)
+        blocked[y:y + block, x:x + block] = True
+    return blocked
+
+
+def run(size, changes, steps, rng):
+    """Returns (initial ms, incremental ms/step, expansions/step, scratch ms/step, expansions/step)"""
+    start, goal = (2, 2), (size - 3, size - 3)
+    initial = float('inf')
+    while initial == float('inf'):
+        blocked = random_grid(size, rng)
+        for x, y in (start, goal):
+            blocked[y - 2:y + 3, x - 2:x + 3] = False
+        planner = DStarLite(blocked, start, goal)
+        t0 = time.perf_counter()
+        # 随机地图可能不连通，换一张
+        if planner.compute() < float('inf'):
+            initial = time.perf_counter() - t0
+
+    incremental = scratch = 0.0
+    inc_expansions = scratch_expansions = 0
+    done = 0
+    for _ in range(steps):
+        path = planner.path()
+        if len(path) < 8:
+            break  # 到达目标附近，或新障碍把路完全堵死
+        start = path[2]
+        planner.move_start(start)
+
+        # 一个障碍出现在前方路径上，其余随机分布
+        new = blocked.copy()
+        x, y = path[6]
+        new[y, x] = True
+        cells = rng.integers(0, size, (changes - 1, 2))
+        new[cells[:, 1], cells[:, 0]] = ~new[cells[:, 1], cells[:, 0]]
+        new[goal[1], goal[0]] = False
+        new[start[1], start[0]] = False
+        changed = np.argwhere(new != blocked)[:, ::-1]
+        blocked = new
+
+        expansions = planner.expansions
+        t0 = time.perf_counter()
+        planner.update_cells(changed, blocked)
+        cost = planner.compute()
+        incremental += time.perf_counter() - t0
+        inc_expansions += planner.expansions - expansions
+
+        fresh = DStarLite(blocked, start, goal)
+        t0 = time.perf_counter()
+        fresh_cost = fresh.compute()
+        scratch += time.perf_counter() - t0
+        scratch_expansions += fresh.expansions
+        if cost != fresh_cost and abs(cost - fresh_cost) > 1e-6:
+            raise AssertionError(f"costs differ: {cost} vs {fresh_cost}")
+        done += 1
+
+    done = max(done, 1)
+    return (initial * 1000, incremental / done * 1000, inc_expansions / done,
+            scratch / done * 1000, scratch_expansions / done)
+
+
+def main():
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    rng = np.random.default_rng(0)
+    print(f"{'grid':>7} {'changes':>8} {'initial':>9} {'D* Lite':>9} {'exp':>7} "
+          f"{'scratch':>9} {'exp':>7} {'speedup':>8}")
+    for size in (50, 100, 200):
+        for changes in (1, 10, 100):
+            initial, inc, inc_exp, full, full_exp = run(size, changes, steps, rng)
+            print(f"{size:>4}^2 {changes:>8} {initial:>7.1f}ms {inc:>7.2f}ms {inc_exp:>7.0f} "
+                  f"{full:>7.2f}ms {full_exp:>7.0f} {full / inc:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+SLAM Frontend Benchmark
+
+This script measures the SLAM feature-matching backends on a synthetic
+panning sequence (or on a recording passed on the command line) and
+reports milliseconds per frame and inlier counts for each, so the
+fastest backend for the Pi can be picked with SLAM(matcher=...). It then
+runs the full SLAM frontend in both tracking modes (ORB on every frame vs
+KLT optical flow between ORB keyframes) and compares frames per second,
+and finally compares the in-thread and separate-process frontends while
+another thread keeps the interpreter busy, as the web server does.
+
+Usage: python bench_slam.py [recording]
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from bench_pipeline import synthetic_frames
+from feature_matcher import MATCHERS, create_matcher, estimate_motion, keypoint_coords
+from slam import SLAM
+from video_source import open_source
+
+
+def load_frames(path, limit=150):
+    """Read up to limit grayscale frames from a recording"""
+    source = open_source(path, pacing='fast', loop=False)
+    frames = []
+    while len(frames) < limit:
+        ret, frame = source.read()
+        if not ret:
+            break
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+    source.release()
+    return frames
+
+
+def bench_matcher(name, features):
+    """Match every consecutive frame pair, returns (ms/frame, mean matches, mean inliers, mean dx)"""
+    matcher = create_matcher(name)
+    elapsed = 0.0
+    matches = []
+    inliers = []
+    shifts = []
+    for (prev_pts, prev_des), (pts, des) in zip(features, features[1:]):
+        start = time.perf_counter()
+        prev_idx, curr_idx = matcher.match(prev_des, des, prev_pts, pts)
+        M, inlier_mask = estimate_motion(prev_pts[prev_idx], pts[curr_idx])
+        elapsed += time.perf_counter() - start
+        matches.append(len(prev_idx))
+        inliers.append(int(inlier_mask.sum()))
+        if M is not None:
+            shifts.append(M[0, 2])
+    pairs = len(features) - 1
+    return (elapsed / pairs * 1000, np.mean(matches), np.mean(inliers),
+            np.mean(shifts) if shifts else float('nan'))
+
+
+def bench_tracking(mode, frames, workdir):
+    """Run SLAM._process_frame over frames, returns (frames/s, ORB runs, keyframes, final x)"""
+    slam = SLAM(use_imu=False, tracking=mode, map_dir=os.path.join(workdir, f"map_{mode}"))
+    start = time.perf_counter()
+    for gray in frames:
+        slam._process_frame(gray)
+    elapsed = time.perf_counter() - start
+    return (len(frames) / elapsed, slam.features_detected, len(slam.keyframes),
+            slam.get_position()['position'][0])
+
+
+def bench_frontend(mode, frames, workdir, tracking='orb'):
+    """SLAM frames/s and control-loop lateness with a busy Python thread alongside
+
+    Returns (frames/s, p50 lateness ms, p99 lateness ms). The control loop
+    sleeps 5 ms at a time like a joystick handler waiting for input; how
+    late it wakes up shows how much the SLAM work competes for the GIL.
+    """
+    slam = SLAM(use_imu=False, tracking=tracking, frontend=mode,
+                map_dir=os.path.join(workdir, f"map_{mode}"))
+    stop = threading.Event()
+    lateness = []
+
+    def busy():
+        # 模拟服务器中的纯 Python 工作（JSON、事件循环等）
+        while not stop.is_set():
+            sum(i * i for i in range(1000))
+
+    def control():
+        while not stop.is_set():
+            start = time.perf_counter()
+            time.sleep(0.005)
+            lateness.append(time.perf_counter() - start - 0.005)
+
+    threads = [threading.Thread(target=busy), threading.Thread(target=control)]
+    for t in threads:
+        t.start()
+    start = time.perf_counter()
+    for gray in frames:
+        slam._process_frame(gray)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for t in threads:
+        t.join()
+    slam.stop()
+    lateness_ms = np.array(lateness) * 1000
+    return len(frames) / elapsed, np.percentile(lateness_ms, 50), np.percentile(lateness_ms, 99)
+
+
+def main():
+    print("SLAM Frontend Benchmark")
+    print("=======================")
+    if len(sys.argv) > 1:
+        frames = load_frames(sys.argv[1])
+        print(f"Source: {sys.argv[1]}, {len(frames)} frames")
+    else:
+        frames = [cv2.cvtColor(f, cv2.COLOR_BGR2GRAY) for f in synthetic_frames()]
+        print(f"Source: synthetic pan, 2 px/frame to the left, {len(frames)} frames")
+
+    orb = cv2.ORB_create()
+    start = time.perf_counter()
+    features = []
+    for gray in frames:
+        kp, des = orb.detectAndCompute(gray, None)
+        features.append((keypoint_coords(kp), des))
+    detect_ms = (time.perf_counter() - start) / len(frames) * 1000
+    print(f"ORB detect+compute: {detect_ms:.2f} ms/frame")
+    print()
+
+    print(f"{'backend':>8} {'ms/frame':>9} {'matches':>8} {'inliers':>8} {'mean dx':>8}")
+    for name in MATCHERS:
+        ms, matches, inliers, dx = bench_matcher(name, features)
+        print(f"{name:>8} {ms:>9.2f} {matches:>8.1f} {inliers:>8.1f} {dx:>8.2f}")
+    print()
+
+    print(f"{'tracking':>8} {'frames/s':>9} {'ORB runs':>9} {'keyframes':>9} {'final x':>8}")
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for mode in SLAM.TRACKING_MODES:
+            fps, detections, keyframes, x = bench_tracking(mode, frames, workdir)
+            results[mode] = fps
+            print(f"{mode:>8} {fps:>9.1f} {detections:>9} {keyframes:>9} {x:>8.3f}")
+    print(f"KLT speedup: {results['klt'] / results['orb']:.2f}x")
+    print()
+
+    print("With a busy Python thread and a 5 ms control loop:")
+    print(f"{'frontend':>8} {'frames/s':>9} {'ctl p50':>8} {'ctl p99':>8}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for mode in SLAM.FRONTEND_MODES:
+            fps, p50, p99 = bench_frontend(mode, frames, workdir)
+            print(f"{mode:>8} {fps:>9.1f} {p50:>6.2f}ms {p99:>6.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Video Streaming Benchmark
+
+This script measures how the MJPEG streaming path behaves as the number of
+viewers grows. A synthetic 15 fps frame source feeds a Camera instance and
+each simulated viewer pulls frames the same way the /video_feed route does.
+It can be run on any Linux box, no camera or robot hardware is needed.
+"""
+
+import os
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from camera import Camera
+from stream_quality import QUALITY_TIERS
+from video_source import JpegDirectorySource
+
+
+class BenchRobot:
+    """Stand-in for LOBOROBOT so Camera can be created without hardware"""
+
+    def set_servo_angle(self, channel, angle):
+        pass
+
+
+def synthetic_capture(camera, stop_event, fps=15):
+    """Publish moving noise frames at a fixed rate"""
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 255, (camera.height, camera.width, 3), dtype=np.uint8)
+    interval = 1 / fps
+    shift = 0
+    while not stop_event.is_set():
+        camera._publish_frame(np.roll(base, shift, axis=1))
+        shift += 4
+        time.sleep(interval)
+
+
+def viewer(camera, stop_event, delivered, fps=10):
+    """Pull JPEG frames like a /video_feed generator"""
+    interval = 1 / fps
+    last_frame_id = 0
+    while not stop_event.is_set():
+        frame_id, frame = camera.wait_for_jpeg(last_frame_id, timeout=0.5)
+        if frame is None:
+            continue
+        last_frame_id = frame_id
+        delivered[0] += 1
+        time.sleep(interval)
+
+
+def run(num_viewers, duration, width=320, height=240, workers=1, mode='thread'):
+    camera = Camera(width=width, height=height, robot=BenchRobot(), jpeg_quality=60,
+                    frame_size=None, encode_workers=workers, encode_mode=mode)
+    camera.running = True
+    stop_event = threading.Event()
+    threads = [threading.Thread(target=synthetic_capture, args=(camera, stop_event))]
+    counters = []
+    for _ in range(num_viewers):
+        delivered = [0]
+        counters.append(delivered)
+        threads.append(threading.Thread(target=viewer, args=(camera, stop_event, delivered)))
+
+    for t in threads:
+        t.daemon = True
+        t.start()
+    time.sleep(duration)
+    stop_event.set()
+    camera.running = False
+    for t in threads:
+        t.join()
+    camera.encoder.shutdown()
+    if camera.ring.shared:
+        camera.ring.close()
+
+    return camera.encode_count / duration, sum(c[0] for c in counters) / duration
+
+
+def run_passthrough(capture_mode, directory, duration, width=640, height=480):
+    """Stream a JPEG directory through Camera at every quality tier"""
+    camera = Camera(width=width, height=height, robot=BenchRobot(), capture_mode=capture_mode,
+                    frame_size=None, source=JpegDirectorySource(directory))
+    camera.start()
+    stop_event = threading.Event()
+    threads = []
+    counters = []
+    for tier in QUALITY_TIERS:
+        delivered = [0]
+        counters.append(delivered)
+        threads.append(threading.Thread(target=tier_viewer, args=(camera, stop_event, delivered, tier)))
+    for t in threads:
+        t.daemon = True
+        t.start()
+    time.sleep(duration)
+    stop_event.set()
+    camera.stop()
+    for t in threads:
+        t.join()
+
+    return (camera.encode_count / duration, camera.decode_count / duration,
+            sum(c[0] for c in counters) / duration)
+
+
+def tier_viewer(camera, stop_event, delivered, tier):
+    """Pull frames for one quality tier as fast as they are published"""
+    last_frame_id = 0
+    while not stop_event.is_set():
+        frame_id, frame = camera.wait_for_jpeg(last_frame_id, tier.quality, 0.5, tier.size)
+        if frame is None:
+            continue
+        last_frame_id = frame_id
+        delivered[0] += 1
+
+
+def main():
+    print("Video Streaming Benchmark")
+    print("=========================")
+    print(f"{'viewers':>8} {'encodes/s':>10} {'frames out/s':>13}")
+    for num_viewers in (1, 2, 4, 8):
+        encodes, delivered = run(num_viewers, duration=3)
+        print(f"{num_viewers:>8} {encodes:>10.1f} {delivered:>13.1f}")
+
+    print()
+    print("Encoder pool, 4 viewers")
+    print(f"{'size':>10} {'mode':>8} {'workers':>8} {'encodes/s':>10} {'frames out/s':>13}")
+    for width, height in ((640, 480), (1280, 720)):
+        for mode, workers in (('thread', 1), ('thread', 2), ('process', 2)):
+            encodes, delivered = run(4, 3, width, height, workers, mode)
+            print(f"{width}x{height:<4} {mode:>8} {workers:>8} {encodes:>10.1f} {delivered:>13.1f}")
+
+    print()
+    print("Capture mode, 640x480 JPEG directory source, one viewer per tier")
+    print(f"{'mode':>8} {'encodes/s':>10} {'decodes/s':>10} {'frames out/s':>13}")
+    with tempfile.TemporaryDirectory() as directory:
+        rng = np.random.default_rng(0)
+        base = rng.integers(0, 255, (480, 640, 3), dtype=np.uint8)
+        for i in range(30):
+            cv2.imwrite(os.path.join(directory, f"{i:04d}.jpg"), np.roll(base, i * 4, axis=1))
+        for capture_mode in Camera.CAPTURE_MODES:
+            encodes, decodes, delivered = run_passthrough(capture_mode, directory, 3)
+            print(f"{capture_mode:>8} {encodes:>10.1f} {decodes:>10.1f} {delivered:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
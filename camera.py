@@ -1,19 +1,67 @@
 import cv2
 import threading
 import time
+import numpy as np
+from contextlib import contextmanager
 from LOBOROBOT import LOBOROBOT
+from frame_ring import FrameRing
+from collections import OrderedDict
+from concurrent.futures import Future
+from jpeg_encoder import JpegEncoderPool, decode_jpeg
+from video_metrics import VideoMetrics
 
 class Camera:
-    def __init__(self, camera_id=0, width=640, height=480, robot=None, jpeg_quality=70):
+    # 'bgr': OpenCV decodes every frame to BGR pixels
+    # 'mjpeg': keep the camera's compressed MJPEG frames, forward them to the
+    #          video stream as-is and decode only when pixels are requested
+    CAPTURE_MODES = ('bgr', 'mjpeg')
+    
+    def __init__(self, camera_id=0, width=640, height=480, robot=None, jpeg_quality=70, ring_size=4,
+                 frame_size=(320, 240), encode_workers=1, encode_mode='thread',
+                 capture_mode='bgr', source=None):
+        if capture_mode not in self.CAPTURE_MODES:
+            raise ValueError(f"Unknown capture mode: {capture_mode}")
         self.camera_id = camera_id
         self.width = width
         self.height = height
+        # 采集分辨率高于此尺寸时缩放到此尺寸，None 表示保持原始分辨率（MJPEG模式不缩放）
+        self.frame_size = frame_size
+        self.capture_mode = capture_mode
+        # 可替代 cv2.VideoCapture 的帧源（例如 JpegDirectorySource），None 表示打开 camera_id
+        self.source = source
         self.camera = None
+        # 当前帧；MJPEG模式下是压缩数据（一维uint8数组）
         self.frame = None
+        # 帧序号，每采集一帧递增，用于判断编码缓存是否过期
+        self.frame_id = 0
+        # 当前帧的采集时间戳（秒）；回放源为确定性的媒体时间
+        self.frame_time = None
+        # 最近若干帧的单调时钟采集时刻，用于统计端到端延迟
+        self._capture_times = OrderedDict()
+        # 视频链路各阶段的延迟直方图和各客户端统计
+        self.metrics = VideoMetrics()
+        # 预分配的帧缓冲环，采集直接写入，读者借用而不复制
+        # 进程编码模式下缓冲放在共享内存中，供编码进程直接读取
+        self.ring = FrameRing(ring_size, shared=(encode_mode == 'process' and capture_mode == 'bgr'))
         self.running = False
         self.lock = threading.Lock()
+        # 新帧发布时唤醒等待的消费者（视频流、SLAM），替代轮询
+        self.frame_ready = threading.Condition(self.lock)
         # JPEG压缩质量（0-100），降低可提高传输速度
         self.jpeg_quality = jpeg_quality
+        # 编码缓存: (quality, size) -> (frame_id, Future[jpeg bytes])，同一帧每档只编码一次
+        self._jpeg_cache = {}
+        # MJPEG直通时最近一帧的字节: (frame_id, bytes)
+        self._passthrough = (0, None)
+        self.encode_count = 0
+        # JPEG编码在独立的线程池/进程池中进行，不占用eventlet主循环
+        self.encoder = JpegEncoderPool(encode_workers, encode_mode)
+        # MJPEG模式下按需解码的像素缓存: (gray, reduce) -> (frame_id, pixels)
+        self._decoded = {}
+        self._decode_lock = threading.Lock()
+        self.decode_count = 0
+        # 新帧回调（如录像），在采集线程中调用，必须立即返回不能阻塞
+        self.frame_listeners = []
         # 帧率控制
         self.last_frame_time = 0
         self.frame_interval = 1/15  # 目标15fps
@@ -38,7 +86,11 @@ class Camera:
         if self.running:
             return
         
-        self.camera = cv2.VideoCapture(self.camera_id)
+        self.camera = self.source if self.source is not None else cv2.VideoCapture(self.camera_id)
+        if self.capture_mode == 'mjpeg':
+            # 请求摄像头输出MJPEG，并让OpenCV直接返回压缩数据而不解码
+            self.camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+            self.camera.set(cv2.CAP_PROP_CONVERT_RGB, 0)
         self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
         self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
         # 设置更低的帧率以减少CPU使用
@@ -55,25 +107,55 @@ class Camera:
     def stop(self):
         """Stop the camera capture thread"""
         self.running = False
+        with self.frame_ready:
+            self.frame_ready.notify_all()
         if self.thread:
             self.thread.join()
         if self.camera:
             self.camera.release()
+        self.encoder.shutdown()
+        if self.ring.shared:
+            with self.lock:
+                self.ring.close()
     
     def _capture_loop(self):
         """Camera capture loop running in a separate thread"""
+        raw = None  # 需要缩放时复用的原始帧缓冲
         while self.running:
-            ret, frame = self.camera.read()
+            with self.lock:
+                index, buf = self.ring.claim()
+            
+            if index is None:
+                # 所有缓冲都被读者占用，读取后丢弃这一帧，保持设备队列不积压
+                self.camera.grab()
+                continue
+            
+            # 通过调整大小来减少处理负担
+            if self.capture_mode == 'bgr' and self.frame_size is not None and self.width > self.frame_size[0]:  # 如果原设置分辨率较高，则降低
+                ret, raw = self.camera.read(raw)
+                capture_time = time.monotonic()
+                if ret:
+                    frame = cv2.resize(raw, self.frame_size, dst=buf)
+                    self.metrics.record('resize', time.monotonic() - capture_time)
+            else:
+                ret, frame = self.camera.read(buf)
+                capture_time = time.monotonic()
+            
             if not ret:
                 time.sleep(0.1)
                 continue
             
-            # 通过调整大小来减少处理负担
-            if self.width > 320:  # 如果原设置分辨率较高，则降低
-                frame = cv2.resize(frame, (320, 240))
+            if self.capture_mode == 'mjpeg' and frame.ndim != 1:
+                # 后端不支持输出压缩数据，退回普通模式
+                print("Camera backend returned decoded frames, MJPEG passthrough disabled")
+                self.capture_mode = 'bgr'
             
-            with self.lock:
-                self.frame = frame
+            # 回放源提供确定性的时间戳，实时摄像头使用单调时钟
+            self._commit_frame(index, frame, getattr(self.camera, 'timestamp', None), capture_time)
+            
+            # 回放源自行控制节奏（实时或尽快），不再额外限速
+            if getattr(self.camera, 'paces_itself', False):
+                continue
             
             # 控制帧率，避免CPU过高负载
             processing_time = time.time() - self.last_frame_time
@@ -81,21 +163,229 @@ class Camera:
                 time.sleep(self.frame_interval - processing_time)
             self.last_frame_time = time.time()
     
-    def get_frame(self):
-        """Get the current frame as JPEG bytes"""
+    def _commit_frame(self, index, frame, timestamp=None, capture_time=None):
+        """Publish the frame written into ring slot index"""
+        if capture_time is None:
+            capture_time = time.monotonic()
+        if timestamp is None:
+            timestamp = capture_time
+        with self.frame_ready:
+            self.frame_id += 1
+            self.ring.commit(index, frame, self.frame_id, timestamp)
+            self.frame = frame
+            self.frame_time = timestamp
+            self._capture_times[self.frame_id] = capture_time
+            if len(self._capture_times) > 64:
+                self._capture_times.popitem(last=False)
+            self.frame_ready.notify_all()
+            frame_id = self.frame_id
+        
+        for listener in self.frame_listeners:
+            try:
+                listener(frame_id, frame, timestamp)
+            except Exception as e:
+                print(f"Frame listener error: {e}")
+    
+    def add_frame_listener(self, listener):
+        """Call listener(frame_id, frame, timestamp) for every new frame
+        
+        Listeners run on the capture thread and must not block; the frame
+        buffer is reused afterwards, so copy it if it has to be kept.
+        """
+        self.frame_listeners = self.frame_listeners + [listener]
+    
+    def remove_frame_listener(self, listener):
+        self.frame_listeners = [l for l in self.frame_listeners if l != listener]
+    
+    def _publish_frame(self, frame):
+        """Copy an externally produced frame into the ring and publish it"""
         with self.lock:
-            if self.frame is None:
+            index, buf = self.ring.claim()
+        if index is None:
+            return
+        if buf is None or buf.shape != frame.shape or buf.dtype != frame.dtype:
+            buf = np.empty_like(frame)
+        np.copyto(buf, frame)
+        self._commit_frame(index, buf)
+    
+    def _acquire_slot(self, after_id=0, timeout=None):
+        """Wait for a frame newer than after_id and borrow its raw ring slot"""
+        with self.frame_ready:
+            self.frame_ready.wait_for(
+                lambda: self.frame_id > after_id or not self.running, timeout)
+            if self.frame_id <= after_id or self.frame is None:
+                return None, None
+            return self.ring.acquire_latest()
+    
+    @contextmanager
+    def _borrow_slot(self, after_id=0, timeout=None):
+        frame_id, buf = self._acquire_slot(after_id, timeout)
+        try:
+            yield frame_id, buf
+        finally:
+            if frame_id is not None:
+                self.release_frame(frame_id)
+    
+    def acquire_frame(self, after_id=0, timeout=None, gray=False):
+        """Block until a frame newer than after_id is available and borrow it
+        
+        Returns (frame_id, frame), or (None, None) on timeout or when the
+        camera stops. The frame is a view of a ring buffer, not a copy: it
+        stays valid until release_frame(frame_id) is called and must not be
+        modified. Frame IDs increase monotonically, so a consumer that passes
+        back the last ID it saw never gets the same frame twice.
+        
+        With gray=True a single-channel image is returned. In MJPEG mode the
+        pixels are decoded here, on demand, and shared between consumers.
+        """
+        frame_id, buf = self._acquire_slot(after_id, timeout)
+        if frame_id is None:
+            return None, None
+        try:
+            if buf.ndim == 1:
+                frame = self._decode(frame_id, buf, gray)
+            elif gray:
+                frame = cv2.cvtColor(buf, cv2.COLOR_BGR2GRAY)
+            else:
+                frame = buf
+        except Exception:
+            self.release_frame(frame_id)
+            raise
+        if frame is None:
+            self.release_frame(frame_id)
+            return None, None
+        return frame_id, frame
+    
+    def get_frame_time(self, frame_id):
+        """Capture timestamp of a frame that is still held in the ring"""
+        with self.lock:
+            return self.ring.timestamp(frame_id)
+    
+    def get_capture_time(self, frame_id):
+        """Monotonic clock time at which a recent frame was captured"""
+        with self.lock:
+            return self._capture_times.get(frame_id)
+    
+    def release_frame(self, frame_id):
+        """Give a frame borrowed with acquire_frame back to the ring"""
+        with self.lock:
+            self.ring.release(frame_id)
+    
+    @contextmanager
+    def borrow_frame(self, after_id=0, timeout=None, gray=False):
+        """Context manager form of acquire_frame/release_frame"""
+        frame_id, frame = self.acquire_frame(after_id, timeout, gray)
+        try:
+            yield frame_id, frame
+        finally:
+            if frame_id is not None:
+                self.release_frame(frame_id)
+    
+    def _decode(self, frame_id, buf, gray=False, reduce=1):
+        """Decode a compressed frame once and share the pixels"""
+        key = (gray, reduce)
+        with self._decode_lock:
+            cached = self._decoded.get(key)
+            if cached is not None and cached[0] == frame_id:
+                return cached[1]
+            pixels = decode_jpeg(buf, gray, reduce)
+            if pixels is not None:
+                self._decoded[key] = (frame_id, pixels)
+                self.decode_count += 1
+            return pixels
+    
+    def get_frame(self, quality=None, size=None):
+        """Get the current frame as JPEG bytes
+        
+        The encoded bytes are cached per quality/size setting, so every viewer
+        asking for the same frame shares a single cv2.imencode call.
+        """
+        with self._borrow_slot(timeout=0) as (frame_id, frame):
+            if frame is None:
                 return None
+            return self._encode(frame_id, frame, quality, size)
+    
+    def wait_for_jpeg(self, after_id=0, quality=None, timeout=None, size=None):
+        """Block until a newer frame exists and return (frame_id, jpeg bytes)"""
+        with self._borrow_slot(after_id, timeout) as (frame_id, frame):
+            if frame is None:
+                return None, None
+            return frame_id, self._encode(frame_id, frame, quality, size)
+    
+    def _encode(self, frame_id, frame, quality=None, size=None):
+        """Encode a borrowed frame as JPEG, reusing the cached result when possible
+        
+        The first viewer to ask for a (frame, quality, size) combination
+        queues it on the encoder pool; later viewers wait on the same Future.
+        The job keeps its own reference on the ring slot until it finishes.
+        Only the cache lookup and the slot reference take self.lock: handing
+        a frame to a process pool pickles it and can block, and capture
+        must not wait on that.
+        """
+        reduce = 1
+        if frame.ndim == 1:
+            # MJPEG直通：不需要缩小时直接转发摄像头的压缩数据，不解码也不重新编码
+            if size is None or size[0] >= self.width:
+                cached_id, data = self._passthrough
+                if cached_id != frame_id:
+                    data = frame.tobytes()
+                    # 不要用旧帧覆盖更新的缓存
+                    if frame_id > self._passthrough[0]:
+                        self._passthrough = (frame_id, data)
+                return data
+            # 需要缩小时利用libjpeg的降采样解码减少转码开销
+            while reduce < 8 and self.width // (reduce * 2) >= size[0]:
+                reduce *= 2
+        elif size is not None and frame.shape[1] <= size[0]:
+            size = None  # 不放大，与原尺寸共用缓存
+        if quality is None:
+            quality = self.jpeg_quality
+        key = (quality, size)
+        
+        with self.lock:
+            cached = self._jpeg_cache.get(key)
+            new_job = cached is None or cached[0] != frame_id
+            if new_job:
+                self.ring.retain(frame_id)
+                shm_name = self.ring.shm_name(frame_id)
+                # 先缓存一个占位 Future，其他观众等待它；编码任务在锁外提交
+                future = Future()
+                self.encode_count += 1
+                # 不要用旧帧覆盖更新的缓存
+                if cached is None or cached[0] < frame_id:
+                    self._jpeg_cache[key] = (frame_id, future)
+            else:
+                future = cached[1]
+        
+        if new_job:
+            submitted = time.monotonic()
             
-            # 设置JPEG编码参数，降低质量以提高传输速度
-            encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), self.jpeg_quality]
-            
-            # Encode frame as JPEG with lower quality
-            ret, jpeg = cv2.imencode('.jpg', self.frame, encode_params)
-            if not ret:
-                return None
+            def job_done(f):
+                self.release_frame(frame_id)
+                if f.cancelled():
+                    future.cancel()
+                elif f.exception() is not None:
+                    future.set_exception(f.exception())
+                else:
+                    _, started, finished = f.result()
+                    self.metrics.record('encode_wait', started - submitted)
+                    self.metrics.record('encode', finished - started)
+                    future.set_result(f.result())
             
-            return jpeg.tobytes()
+            try:
+                job = self.encoder.submit(frame, quality, shm_name, size, reduce)
+            except Exception as e:
+                self.release_frame(frame_id)
+                future.set_exception(e)
+            else:
+                # 回调会获取 self.lock，必须在锁外注册
+                job.add_done_callback(job_done)
+        
+        try:
+            return future.result()[0]
+        except Exception as e:
+            print(f"JPEG encoding failed: {e}")
+            return None
     
     def set_gimbal_position(self, horizontal_angle, vertical_angle):
         """Set the gimbal position with angle constraints"""
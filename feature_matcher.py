@@ -0,0 +1,156 @@
+from abc import ABC, abstractmethod
+
+import cv2
+import numpy as np
+
+_EMPTY = np.empty(0, dtype=np.int32)
+
+
+class FeatureMatcher(ABC):
+    """Matches binary (ORB) descriptors between two frames
+
+    match() returns two index arrays (query_idx, train_idx) so callers can
+    gather matched points with NumPy fancy indexing instead of Python loops.
+    Matches pass Lowe's ratio test: the best candidate must be clearly
+    closer than the second best. Matcher objects are meant to be created
+    once and reused for every frame.
+    """
+
+    name = None
+
+    def __init__(self, ratio=0.8, max_distance=64):
+        self.ratio = ratio
+        # ORB 描述子为256位，汉明距离超过此值的匹配直接丢弃
+        self.max_distance = max_distance
+
+    def match(self, query_des, train_des, query_pts=None, train_pts=None):
+        if query_des is None or train_des is None or len(query_des) < 2 or len(train_des) < 2:
+            return _EMPTY, _EMPTY
+        return self._match(query_des, train_des, query_pts, train_pts)
+
+    @abstractmethod
+    def _match(self, query_des, train_des, query_pts, train_pts):
+        """Match two descriptor sets of at least 2 rows, returns (query_idx, train_idx)"""
+
+    def _ratio_test(self, knn):
+        """Filter cv2 knnMatch output, returns (query_idx, train_idx)"""
+        query_idx = []
+        train_idx = []
+        for pair in knn:
+            if len(pair) < 2:
+                # LSH may find a single candidate; accept it only if it is close
+                if len(pair) == 1 and pair[0].distance < self.max_distance / 2:
+                    query_idx.append(pair[0].queryIdx)
+                    train_idx.append(pair[0].trainIdx)
+                continue
+            best, second = pair
+            if best.distance < self.ratio * second.distance and best.distance <= self.max_distance:
+                query_idx.append(best.queryIdx)
+                train_idx.append(best.trainIdx)
+        return np.asarray(query_idx, dtype=np.int32), np.asarray(train_idx, dtype=np.int32)
+
+
+class BruteForceMatcher(FeatureMatcher):
+    """Exhaustive Hamming matching with a persistent cv2.BFMatcher"""
+
+    name = 'bf'
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+
+    def _match(self, query_des, train_des, query_pts, train_pts):
+        return self._ratio_test(self.matcher.knnMatch(query_des, train_des, k=2))
+
+
+class FlannLshMatcher(FeatureMatcher):
+    """Approximate matching with FLANN's locality-sensitive hashing index"""
+
+    name = 'flann'
+    FLANN_INDEX_LSH = 6
+
+    def __init__(self, table_number=6, key_size=12, multi_probe_level=1, checks=32, **kwargs):
+        super().__init__(**kwargs)
+        index_params = dict(algorithm=self.FLANN_INDEX_LSH, table_number=table_number,
+                            key_size=key_size, multi_probe_level=multi_probe_level)
+        self.matcher = cv2.FlannBasedMatcher(index_params, dict(checks=checks))
+
+    def _match(self, query_des, train_des, query_pts, train_pts):
+        return self._ratio_test(self.matcher.knnMatch(query_des, train_des, k=2))
+
+
+class GridMatcher(FeatureMatcher):
+    """Matches only against keypoints in the same or neighbouring grid cells
+
+    Between consecutive frames features move a few pixels, so each query
+    descriptor is compared with the train descriptors in its 3x3 cell
+    neighbourhood rather than with the whole frame. Each cell is one
+    vectorized cv2.batchDistance call.
+    """
+
+    name = 'grid'
+
+    def __init__(self, cell_size=40, **kwargs):
+        super().__init__(**kwargs)
+        self.cell_size = cell_size
+
+    def _match(self, query_des, train_des, query_pts, train_pts):
+        if query_pts is None or train_pts is None:
+            raise ValueError("GridMatcher needs keypoint positions")
+
+        query_cells = (query_pts // self.cell_size).astype(np.int32)
+        train_cells = (train_pts // self.cell_size).astype(np.int32)
+        cols = int(max(query_cells[:, 0].max(), train_cells[:, 0].max())) + 1
+        query_keys = query_cells[:, 1] * cols + query_cells[:, 0]
+        train_cx = train_cells[:, 0]
+        train_cy = train_cells[:, 1]
+
+        query_idx = []
+        train_idx = []
+        for key in np.unique(query_keys):
+            q = np.flatnonzero(query_keys == key)
+            cy, cx = divmod(int(key), cols)
+            t = np.flatnonzero((np.abs(train_cx - cx) <= 1) & (np.abs(train_cy - cy) <= 1))
+            if len(t) < 2:
+                continue
+            dist, nn = cv2.batchDistance(query_des[q], train_des[t], cv2.CV_32S,
+                                         normType=cv2.NORM_HAMMING, K=2)
+            keep = (dist[:, 0] < self.ratio * dist[:, 1]) & (dist[:, 0] <= self.max_distance)
+            query_idx.append(q[keep])
+            train_idx.append(t[nn[keep, 0]])
+
+        if not query_idx:
+            return _EMPTY, _EMPTY
+        return (np.concatenate(query_idx).astype(np.int32),
+                np.concatenate(train_idx).astype(np.int32))
+
+
+MATCHERS = {cls.name: cls for cls in (BruteForceMatcher, FlannLshMatcher, GridMatcher)}
+
+
+def create_matcher(name='bf', **kwargs):
+    """Create a matcher backend by name: 'bf', 'flann' or 'grid'"""
+    if name not in MATCHERS:
+        raise ValueError(f"Unknown matcher backend: {name}")
+    return MATCHERS[name](**kwargs)
+
+
+def keypoint_coords(keypoints):
+    """Keypoint positions as an (N, 2) float32 array"""
+    if not keypoints:
+        return np.empty((0, 2), dtype=np.float32)
+    return cv2.KeyPoint_convert(keypoints)
+
+
+def estimate_motion(prev_pts, curr_pts, threshold=3.0):
+    """Fit a similarity transform with RANSAC over all matches
+
+    Returns (M, inlier mask); M is None if no model was found.
+    """
+    if len(prev_pts) < 4:
+        return None, np.zeros(len(prev_pts), dtype=bool)
+    M, inliers = cv2.estimateAffinePartial2D(prev_pts, curr_pts, method=cv2.RANSAC,
+                                             ransacReprojThreshold=threshold)
+    if M is None:
+        return None, np.zeros(len(prev_pts), dtype=bool)
+    return M, inliers.ravel().astype(bool)
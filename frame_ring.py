@@ -0,0 +1,127 @@
+import numpy as np
+from multiprocessing import shared_memory
+
+
+class FrameRing:
+    """Fixed-size ring of reusable frame buffers
+
+    The capture thread writes each new frame into a slot that no reader is
+    holding, so buffers are allocated once and then reused for the whole
+    session. Readers borrow the newest slot by reference (no copy) and give
+    it back with release(); a borrowed slot is never overwritten.
+
+    With shared=True the buffers live in multiprocessing shared memory, so
+    worker processes can read a slot by name without any copy.
+
+    The ring does no locking of its own, callers serialize access with the
+    owning Camera's lock.
+    """
+
+    def __init__(self, size=4, shared=False):
+        if size < 2:
+            raise ValueError("FrameRing needs at least 2 slots")
+        self.size = size
+        self.shared = shared
+        self.shm = [None] * size
+        self._retired = []
+        self.buffers = [None] * size
+        self.frame_ids = [0] * size
+        self.timestamps = [None] * size
+        self.refcounts = [0] * size
+        self.latest = -1
+        # 所有槽都被读者占用时丢弃的帧数
+        self.dropped = 0
+
+    def claim(self):
+        """Pick a slot for the next frame
+
+        Returns (index, buffer), where buffer may be None before the slot
+        has been filled for the first time. Returns (None, None) when every
+        slot other than the newest one is borrowed.
+        """
+        best = None
+        for i in range(self.size):
+            if i == self.latest or self.refcounts[i] > 0:
+                continue
+            if best is None or self.frame_ids[i] < self.frame_ids[best]:
+                best = i
+        if best is None:
+            self.dropped += 1
+            return None, None
+        return best, self.buffers[best]
+
+    def commit(self, index, frame, frame_id, timestamp=None):
+        """Publish the frame written into slot index as the newest one"""
+        # cv2 only reallocates when the shape changes, e.g. the first frame
+        if frame is not self.buffers[index]:
+            if self.shared:
+                frame = self._move_to_shared(index, frame)
+            self.buffers[index] = frame
+        self.frame_ids[index] = frame_id
+        self.timestamps[index] = timestamp
+        self.latest = index
+
+    def acquire_latest(self):
+        """Borrow the newest frame, returns (frame_id, buffer)"""
+        if self.latest < 0:
+            return None, None
+        self.refcounts[self.latest] += 1
+        return self.frame_ids[self.latest], self.buffers[self.latest]
+
+    def retain(self, frame_id):
+        """Take another reference on an already borrowed frame"""
+        for i in range(self.size):
+            if self.frame_ids[i] == frame_id and self.refcounts[i] > 0:
+                self.refcounts[i] += 1
+                return True
+        return False
+
+    def timestamp(self, frame_id):
+        """Capture timestamp of frame_id, if it is still in the ring"""
+        for i in range(self.size):
+            if self.frame_ids[i] == frame_id:
+                return self.timestamps[i]
+        return None
+
+    def shm_name(self, frame_id):
+        """Name of the shared memory block holding frame_id, if any"""
+        for i in range(self.size):
+            if self.frame_ids[i] == frame_id and self.shm[i] is not None:
+                return self.shm[i].name
+        return None
+
+    def _move_to_shared(self, index, frame):
+        """(Re)allocate slot index in shared memory and copy frame into it"""
+        old = self.shm[index]
+        if old is not None:
+            # Readers may still hold views of the old block, so only drop its
+            # name here and let the mapping go away with the last view
+            old.unlink()
+            self._retired.append(old)
+        shm = shared_memory.SharedMemory(create=True, size=max(frame.nbytes, 1))
+        buf = np.ndarray(frame.shape, dtype=frame.dtype, buffer=shm.buf)
+        np.copyto(buf, frame)
+        self.shm[index] = shm
+        return buf
+
+    def close(self):
+        """Free shared memory blocks"""
+        self.buffers = [None] * self.size
+        for i, shm in enumerate(self.shm):
+            if shm is not None:
+                shm.unlink()
+                self._retired.append(shm)
+                self.shm[i] = None
+        for shm in self._retired:
+            try:
+                shm.close()
+            except BufferError:
+                pass  # still referenced, the OS frees it with the last view
+        self._retired = []
+
+    def release(self, frame_id):
+        """Return a borrowed frame to the ring"""
+        for i in range(self.size):
+            if self.frame_ids[i] == frame_id and self.refcounts[i] > 0:
+                self.refcounts[i] -= 1
+                return
@@ -0,0 +1,114 @@
+import multiprocessing
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+# Shared memory blocks attached by a worker process, keyed by name, least
+# recently used first. A ring slot that is reallocated gets a new name and
+# its old block is never used again, so only the newest few are kept.
+_attached = OrderedDict()
+_MAX_ATTACHED = 16
+
+# libjpeg can decode straight to 1/2, 1/4 or 1/8 scale for a fraction of the cost
+_REDUCED_COLOR = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                  4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+_REDUCED_GRAYSCALE = {1: cv2.IMREAD_GRAYSCALE, 2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+                      4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+
+
+def decode_jpeg(buf, gray=False, reduce=1):
+    """Decode a compressed frame (1-D uint8 array) to BGR or grayscale pixels"""
+    flags = (_REDUCED_GRAYSCALE if gray else _REDUCED_COLOR)[reduce]
+    return cv2.imdecode(buf, flags)
+
+
+def _encode_array(frame, quality, size=None, reduce=1):
+    """Encode a frame, optionally downscaled to size, returns JPEG bytes or None
+
+    A 1-D frame is an already compressed MJPEG buffer; it is decoded (at
+    1/reduce scale) first, i.e. transcoded.
+    """
+    if frame.ndim == 1:
+        frame = decode_jpeg(frame, reduce=reduce)
+        if frame is None:
+            return None
+    if size is not None and frame.shape[1] > size[0]:
+        frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    ret, jpeg = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    if not ret:
+        return None
+    return jpeg.tobytes()
+
+
+def _encode_shared(shm_name, shape, dtype, quality, size=None, reduce=1):
+    """Worker-process entry point: encode a frame that lives in shared memory"""
+    shm = _attached.get(shm_name)
+    if shm is None:
+        shm = shared_memory.SharedMemory(name=shm_name)
+        _attached[shm_name] = shm
+        while len(_attached) > _MAX_ATTACHED:
+            # 关闭最久未用的映射，父进程已 unlink 的块随之释放
+            _, stale = _attached.popitem(last=False)
+            try:
+                stale.close()
+            except BufferError:
+                pass
+    else:
+        _attached.move_to_end(shm_name)
+    frame = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    return _encode_array(frame, quality, size, reduce)
+
+
+def _timed(func, *args):
+    """Run func, returns (result, started, finished) on the monotonic clock"""
+    started = time.monotonic()
+    result = func(*args)
+    return result, started, time.monotonic()
+
+
+class JpegEncoderPool:
+    """JPEG encoding stage that runs off the eventlet hub
+
+    mode='thread' uses native threads; cv2.imencode releases the GIL, so
+    encoding overlaps with Python work elsewhere and frames are passed by
+    reference. mode='process' uses worker processes that read frames from
+    shared memory, which keeps even the Python-side overhead out of the
+    server process. submit() returns a Future resolving to
+    (jpeg bytes, started, finished), the timestamps being taken from the
+    monotonic clock (system-wide on Linux, so valid across processes).
+    """
+
+    MODES = ('thread', 'process')
+
+    def __init__(self, workers=1, mode='thread'):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown encoder mode: {mode}")
+        self.workers = workers
+        self.mode = mode
+        if mode == 'process':
+            # 相机与 SLAM 线程已在运行，fork 出的进程可能继承被占用的锁，用 spawn 启动
+            self.executor = ProcessPoolExecutor(max_workers=workers,
+                                                mp_context=multiprocessing.get_context('spawn'))
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers,
+                                               thread_name_prefix='jpeg-encoder')
+
+    def submit(self, frame, quality, shm_name=None, size=None, reduce=1):
+        """Queue a frame for encoding, downscaled to size (w, h) if given
+
+        In process mode a frame backed by the shared memory block shm_name
+        (see FrameRing(shared=True)) is read in place by the worker; other
+        frames, such as small compressed MJPEG buffers, are sent pickled.
+        """
+        if self.mode == 'process' and shm_name is not None:
+            return self.executor.submit(_timed, _encode_shared, shm_name, frame.shape,
+                                        frame.dtype.str, quality, size, reduce)
+        return self.executor.submit(_timed, _encode_array, frame, quality, size, reduce)
+
+    def shutdown(self):
+        """Stop the workers"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,63 @@
+import numpy as np
+
+
+class KeyframeDatabase:
+    """Inverted index from vocabulary words to the keyframes that contain them
+
+    Each keyframe is stored as its bag of words (see Vocabulary.bow).
+    A query only visits the posting lists of the words in the query, so
+    its cost depends on how many keyframes share those words rather than
+    on comparing descriptors with every stored keyframe. The score of a
+    keyframe is the L1 similarity of the two normalized bags,
+    1 - |a - b| / 2, which for non-negative weights is the sum over
+    shared words of min(a, b) and so accumulates word by word.
+    """
+
+    def __init__(self, vocabulary):
+        self.vocabulary = vocabulary
+        # 词 -> (关键帧序号列表, 权重列表)
+        self.postings = {}
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, des):
+        """Store a keyframe's descriptors, returns its entry id (ids count up from 0)"""
+        entry = self.size
+        words, weights = self.vocabulary.bow(des)
+        for word, weight in zip(words.tolist(), weights.tolist()):
+            posting = self.postings.get(word)
+            if posting is None:
+                posting = self.postings[word] = ([], [])
+            posting[0].append(entry)
+            posting[1].append(weight)
+        self.size += 1
+        return entry
+
+    def query(self, des, top=3, before=None, min_score=0.0):
+        """Best scoring entries for a frame's descriptors, as [(entry, score)]
+
+        Only entries with an id below before are considered, so a caller
+        can leave out the most recent keyframes.
+        """
+        words, weights = self.vocabulary.bow(des)
+        limit = self.size if before is None else min(before, self.size)
+        if limit <= 0 or not len(words):
+            return []
+        entries = []
+        scores = []
+        for word, weight in zip(words.tolist(), weights.tolist()):
+            posting = self.postings.get(word)
+            if posting is None:
+                continue
+            entries.append(posting[0])
+            scores.append(np.minimum(posting[1], weight))
+        if not entries:
+            return []
+        entries = np.concatenate([np.asarray(e, dtype=np.int64) for e in entries])
+        scores = np.concatenate(scores)
+        keep = entries < limit
+        total = np.bincount(entries[keep], weights=scores[keep], minlength=limit)
+        best = np.argsort(-total, kind='stable')[:top]
+        return [(int(i), float(total[i])) for i in best if total[i] > min_score]
@@ -0,0 +1,45 @@
+import cv2
+import numpy as np
+
+
+class KeyframeIndex:
+    """Finds the stored keyframes that share the most features with a frame
+
+    Each keyframe's strongest descriptors are added to one brute-force
+    Hamming matcher as a separate train set, so a match's imgIdx names
+    its keyframe without copying the (possibly memory-mapped)
+    descriptors. A query matches every descriptor of the frame to its
+    nearest stored descriptor and lets the match vote for that keyframe.
+    No ratio test is applied here: neighbouring keyframes see the same
+    features, so the two best candidates are often equally good;
+    geometric verification against the winning keyframes is left to the
+    caller.
+    """
+
+    def __init__(self, keyframes, features_per_keyframe=100, max_distance=64):
+        """keyframes is a sequence of objects with a des attribute (N, 32) uint8
+
+        Descriptors are expected strongest first, as the frontend stores them.
+        """
+        self.max_distance = max_distance
+        self.matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+        # 匹配器中的训练集序号 -> 关键帧序号
+        self.owners = np.array([i for i, kf in enumerate(keyframes)
+                                if kf.des is not None and len(kf.des)], dtype=np.int32)
+        if len(self.owners):
+            self.matcher.add([keyframes[i].des[:features_per_keyframe] for i in self.owners])
+        self.size = len(keyframes)
+
+    def __len__(self):
+        return self.size
+
+    def query(self, des, top=3):
+        """Best candidate keyframes for a frame's descriptors, as [(index, votes)]"""
+        if not len(self.owners) or des is None or len(des) == 0:
+            return []
+        matches = self.matcher.match(des)
+        img_idx = np.fromiter((m.imgIdx for m in matches if m.distance <= self.max_distance),
+                              dtype=np.int32)
+        votes = np.bincount(self.owners[img_idx], minlength=self.size)
+        best = np.argsort(-votes, kind='stable')[:top]
+        return [(int(i), int(votes[i])) for i in best if votes[i] > 0]
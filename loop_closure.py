@@ -0,0 +1,173 @@
+import queue
+import threading
+import time
+
+import numpy as np
+
+from feature_matcher import create_matcher, estimate_motion
+from keyframe_database import KeyframeDatabase
+from pose_graph import optimize, relative, wrap
+
+
+class LoopCloser:
+    """Detects revisited places and corrects the keyframe poses in a background thread
+
+    SLAM hands over every keyframe with add_keyframe() and goes on
+    tracking. The thread keeps a pose graph: an odometry edge from each
+    keyframe to the one before it, as measured when it was added, plus an
+    edge for every loop found. For a new keyframe it asks a
+    KeyframeDatabase (bag of words) for the most similar keyframes older
+    than min_gap keyframes, matches descriptors with the best few and
+    accepts the first one whose matches fit a similarity transform with
+    at least min_inliers inliers. The transform is turned into a relative
+    pose the same way relocalization does. A loop the current poses
+    already agree with (within min_correction map units and
+    min_rotation degrees) only adds its edge; otherwise the graph is
+    re-optimized (pose_graph.optimize) and the corrected poses handed to
+    SLAM.correct_poses(), which starts a new trajectory epoch. Revisiting a
+    place thus corrects the map once rather than on every keyframe.
+
+    Keyframes loaded from a saved map are indexed but not searched for
+    loops. reset() drops the graph; work queued before it is discarded.
+    """
+
+    def __init__(self, slam, vocabulary, min_gap=30, candidates=3, min_score=0.05,
+                 min_inliers=30, loop_weight=1.0, min_correction=0.05, min_rotation=2.0):
+        self.slam = slam
+        self.vocabulary = vocabulary
+        self.min_gap = min_gap
+        self.candidates = candidates
+        self.min_score = min_score
+        self.min_inliers = min_inliers
+        self.loop_weight = loop_weight
+        self.min_correction = min_correction
+        self.min_rotation = min_rotation
+        self.matcher = create_matcher('bf')
+
+        self.queue = queue.Queue()
+        self.running = False
+        self.thread = None
+        self.generation = 0
+        self._clear()
+
+        self.loops = 0
+        self.corrections = 0
+        self.last_loop = None
+        self.optimize_ms = 0.0
+
+    def _clear(self):
+        self.database = KeyframeDatabase(self.vocabulary)
+        # 位姿图的边：(i, j, 相对位姿, 权重)
+        self.edges = []
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+
+    def reset(self):
+        """Forget all keyframes; call with the SLAM lock held, as keyframes are cleared"""
+        self.generation += 1
+
+    def add_keyframe(self, index, previous, keyframe, detect=True):
+        """Queue keyframe number index; previous is the pose of keyframe index - 1 when it was added
+
+        Call with the SLAM lock held so index and generation agree.
+        """
+        self.queue.put((self.generation, index, previous, keyframe, detect))
+
+    def _run(self):
+        generation = self.generation
+        while self.running:
+            try:
+                item_generation, index, previous, keyframe, detect = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if item_generation != self.generation:
+                continue
+            if item_generation != generation:
+                # SLAM 已重置，从空的位姿图重新开始
+                generation = item_generation
+                self._clear()
+            try:
+                self._add(generation, index, previous, keyframe, detect)
+            except Exception as e:
+                print(f"Loop closure error: {e}")
+
+    def _add(self, generation, index, previous, keyframe, detect):
+        if index != len(self.database):
+            print(f"Loop closure out of step at keyframe {index}, skipping")
+            return
+        if previous is not None:
+            self.edges.append((index - 1, index, relative(_radians(previous), _radians(keyframe.pose)), 1.0))
+        candidates = []
+        if detect and keyframe.des is not None and len(keyframe.des):
+            candidates = self.database.query(keyframe.des, self.candidates,
+                                             before=index - self.min_gap, min_score=self.min_score)
+        self.database.add(keyframe.des)
+
+        for candidate, score in candidates:
+            z = self._verify(candidate, keyframe)
+            if z is None:
+                continue
+            self.edges.append((candidate, index, z, self.loop_weight))
+            self.loops += 1
+            self.last_loop = (candidate, index)
+            with self.slam.lock:
+                if generation != self.generation or index >= len(self.slam.keyframes):
+                    return
+                error = relative(_radians(self.slam.keyframes[candidate].pose),
+                                 _radians(self.slam.keyframes[index].pose)) - z
+            if np.hypot(error[0], error[1]) > self.min_correction \
+                    or abs(wrap(error[2])) > np.radians(self.min_rotation):
+                print(f"Loop closure: keyframe {index} matches keyframe {candidate} (score {score:.3f})")
+                self._optimize(generation, index + 1)
+            break
+
+    def _verify(self, candidate, keyframe):
+        """Relative pose from keyframe candidate to keyframe, or None if the features disagree"""
+        with self.slam.lock:
+            if candidate >= len(self.slam.keyframes):
+                return None
+            old = self.slam.keyframes[candidate]
+            scale = self.slam.scale
+            motion_scale = self.slam.motion_scale
+        old_idx, idx = self.matcher.match(old.des, keyframe.des)
+        if len(old_idx) < self.min_inliers:
+            return None
+        M, inlier_mask = estimate_motion(old.pts[old_idx], keyframe.pts[idx])
+        if M is None or inlier_mask.sum() < self.min_inliers:
+            return None
+        # 与重定位相同：关键帧位姿加上从它到当前帧的图像运动
+        dx, dy = M[0, 2] / scale * motion_scale, M[1, 2] / scale * motion_scale
+        da = np.arctan2(M[1, 0], M[0, 0])
+        return np.array([dx * np.cos(da) - dy * np.sin(da), dx * np.sin(da) + dy * np.cos(da), wrap(da)])
+
+    def _optimize(self, generation, count):
+        """Optimize the first count keyframe poses and hand them to SLAM"""
+        with self.slam.lock:
+            if generation != self.generation or len(self.slam.keyframes) < count:
+                return
+            poses = np.array([_radians(kf.pose) for kf in self.slam.keyframes[:count]])
+        i, j, z, weights = (np.array(column) for column in zip(*self.edges))
+        start = time.perf_counter()
+        corrected = optimize(poses, i, j, z, weights)
+        self.optimize_ms = (time.perf_counter() - start) * 1000
+        moved = np.hypot(*(corrected[:, :2] - poses[:, :2]).T).max()
+        if self.slam.correct_poses(corrected, generation):
+            self.corrections += 1
+            print(f"Pose graph: {count} keyframes, {len(self.edges)} edges, "
+                  f"{self.optimize_ms:.0f} ms, largest correction {moved:.3f}")
+
+
+def _radians(pose):
+    """(x, y, yaw radians) of a keyframe pose (x, y, z, yaw degrees)"""
+    return (pose[0], pose[1], np.radians(pose[3]))
@@ -0,0 +1,294 @@
+import os
+import struct
+import zlib
+from collections import namedtuple
+
+import numpy as np
+
+# ORB descriptors are 256 bits
+DESCRIPTOR_SIZE = 32
+
+# Keyframes in array form, as stored on disk:
+#   poses   float32 (4, K) rows x, y, z, yaw
+#   counts  uint32 (K,) number of features of each keyframe
+#   pts     float32 (F, 2) keypoint positions of all keyframes, in order
+#   des     uint8 (F, DESCRIPTOR_SIZE) their ORB descriptors
+KeyframeRows = namedtuple('KeyframeRows', ['poses', 'counts', 'pts', 'des'])
+
+# Snapshot file, little-endian:
+#   4s magic, u16 version, u16 header length, u32 epoch,
+#   u32 trajectory count, u32 point count, u32 keyframe count,
+#   u32 keyframe feature count,
+# followed by the trajectory as float32 (4, N) rows t, x, y, z, the points
+# as float32 (3, M) rows x, y, z (the same layout as ArrayStore) and the
+# keyframes as KeyframeRows: poses, counts, pts, des. Every section is a
+# multiple of 4 bytes, so the file can be memory-mapped as is
+SNAPSHOT_HEADER = struct.Struct('<4sHHIIIII')
+SNAPSHOT_MAGIC = b'SMAP'
+SNAPSHOT_VERSION = 2
+
+# Journal record: u32 payload length, u32 CRC-32 of the payload. A batch
+# payload is u32 epoch, then the first sequence number and count of the
+# new trajectory rows, points and keyframes (u32 each), then u32 keyframe
+# feature count, followed by the new rows in the snapshot layout. Points
+# refined in place since the last batch may follow: u32 count, their
+# sequence numbers as u32 and their new values as float32 (3, count).
+# After a loop closure the earlier poses follow that (the update count
+# then present even if 0): u32 trajectory count T, u32 keyframe count K,
+# the first T trajectory rows as float32 (4, T) and the first K keyframe
+# poses as float32 (4, K), replacing those loaded so far
+RECORD_HEADER = struct.Struct('<II')
+BATCH_HEADER = struct.Struct('<IIIIIIII')
+UPDATE_HEADER = struct.Struct('<I')
+POSES_HEADER = struct.Struct('<II')
+
+
+def empty_keyframes():
+    return KeyframeRows(np.empty((4, 0), dtype=np.float32), np.empty(0, dtype=np.uint32),
+                        np.empty((0, 2), dtype=np.float32),
+                        np.empty((0, DESCRIPTOR_SIZE), dtype=np.uint8))
+
+
+def _sections(data, offset, n_traj, n_points, n_keyframes, n_features):
+    """Slice the trajectory, points and KeyframeRows out of a byte buffer
+
+    Returns (trajectory, points, keyframes, end offset); the arrays are
+    views of data, not copies.
+    """
+    def take(dtype, shape):
+        nonlocal offset
+        count = int(np.prod(shape))
+        array = np.frombuffer(data, dtype=dtype, count=count, offset=offset).reshape(shape)
+        offset += array.nbytes
+        return array
+
+    trajectory = take('<f4', (4, n_traj))
+    points = take('<f4', (3, n_points))
+    keyframes = KeyframeRows(take('<f4', (4, n_keyframes)), take('<u4', (n_keyframes,)),
+                             take('<f4', (n_features, 2)), take('u1', (n_features, DESCRIPTOR_SIZE)))
+    return trajectory, points, keyframes, offset
+
+
+def _section_bytes(trajectory, points, keyframes):
+    return b''.join(np.ascontiguousarray(a, dtype=dtype).tobytes() for a, dtype in (
+        (trajectory, '<f4'), (points, '<f4'), (keyframes.poses, '<f4'), (keyframes.counts, '<u4'),
+        (keyframes.pts, '<f4'), (keyframes.des, 'u1')))
+
+
+def _trim_keyframes(keyframes, skip):
+    """Drop the first skip keyframes and their features"""
+    if skip == 0:
+        return keyframes
+    features = int(keyframes.counts[:skip].sum())
+    return KeyframeRows(keyframes.poses[:, skip:], keyframes.counts[skip:],
+                        keyframes.pts[features:], keyframes.des[features:])
+
+
+class MapJournal:
+    """Crash-safe map persistence: a snapshot plus an append-only journal
+
+    New trajectory rows, map points and keyframes are appended to the
+    journal as one checksummed record per batch, so saving costs in
+    proportion to the new data. Once the journal outgrows the snapshot
+    (and min_compact_bytes) the whole map is written to a temporary file
+    and atomically renamed over the snapshot, then the journal is
+    truncated.
+
+    On load the snapshot is memory-mapped rather than read, so keyframe
+    descriptors are only paged in when used. Records that start inside
+    rows the snapshot already covers are trimmed and their point updates
+    and loop-closure poses ignored, so a crash between the rename and the truncate is harmless; a torn or corrupt record at the
+    end of the journal is dropped, losing at most the last batch.
+    """
+
+    def __init__(self, directory, min_compact_bytes=64 * 1024):
+        self.directory = directory
+        self.snapshot_path = os.path.join(directory, 'map.snapshot')
+        self.journal_path = os.path.join(directory, 'map.journal')
+        self.min_compact_bytes = min_compact_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(self.journal_path, 'ab')
+        self.journal_bytes = self._file.tell()
+        self.snapshot_bytes = os.path.getsize(self.snapshot_path) if os.path.exists(self.snapshot_path) else 0
+
+    def append(self, epoch, trajectory_start, trajectory, points_start, points,
+               keyframes_start=0, keyframes=None, updated_rows=None, updated_points=None,
+               earlier_trajectory=None, earlier_poses=None):
+        """Append one batch of new rows; returns True when compaction is due
+
+        trajectory is a (4, n) and points a (3, m) float32 array, keyframes
+        a KeyframeRows. updated_rows are the sequence numbers of earlier
+        points whose values changed to the (3, u) updated_points. After a
+        loop closure earlier_trajectory (4, T) and earlier_poses (4, K)
+        replace the first T trajectory rows and K keyframe poses.
+        """
+        if keyframes is None:
+            keyframes = empty_keyframes()
+        payload = (BATCH_HEADER.pack(epoch, trajectory_start, trajectory.shape[1],
+                                     points_start, points.shape[1],
+                                     keyframes_start, len(keyframes.counts), len(keyframes.des))
+                   + _section_bytes(trajectory, points, keyframes))
+        if updated_rows is None:
+            updated_rows = np.empty(0, dtype=np.uint32)
+            updated_points = np.empty((3, 0), dtype=np.float32)
+        if len(updated_rows) or earlier_trajectory is not None:
+            payload += (UPDATE_HEADER.pack(len(updated_rows))
+                        + np.ascontiguousarray(updated_rows, dtype='<u4').tobytes()
+                        + np.ascontiguousarray(updated_points, dtype='<f4').tobytes())
+        if earlier_trajectory is not None:
+            payload += (POSES_HEADER.pack(earlier_trajectory.shape[1], earlier_poses.shape[1])
+                        + np.ascontiguousarray(earlier_trajectory, dtype='<f4').tobytes()
+                        + np.ascontiguousarray(earlier_poses, dtype='<f4').tobytes())
+        self._file.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.journal_bytes += RECORD_HEADER.size + len(payload)
+        return self.journal_bytes >= max(self.min_compact_bytes, self.snapshot_bytes)
+
+    def compact(self, epoch, trajectory, points, keyframes=None):
+        """Replace the snapshot with the full map and empty the journal"""
+        if keyframes is None:
+            keyframes = empty_keyframes()
+        header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, SNAPSHOT_HEADER.size,
+                                      epoch, trajectory.shape[1], points.shape[1],
+                                      len(keyframes.counts), len(keyframes.des))
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            f.write(_section_bytes(trajectory, points, keyframes))
+            f.flush()
+            os.fsync(f.fileno())
+        # 已映射旧快照的视图仍指向旧文件，替换不影响它们
+        os.replace(tmp_path, self.snapshot_path)
+        self._sync_directory()
+        self.snapshot_bytes = os.path.getsize(self.snapshot_path)
+
+        # 快照已包含日志中的全部数据，此后截断日志；两步之间崩溃也不会重复加载
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.journal_bytes = 0
+
+    def load(self):
+        """Read the saved map
+
+        Returns (epoch, trajectory (4, N), points (3, M), list of
+        KeyframeRows). The keyframes are returned in pieces, the first
+        backed by the memory-mapped snapshot, so their descriptors are not
+        copied into memory.
+        """
+        epoch, trajectory, points, keyframes = self._load_snapshot()
+        trajectory = [trajectory]
+        points = [points]
+        keyframes = [keyframes]
+        n_traj = snapshot_trajectory = trajectory[0].shape[1]
+        n_points = snapshot_points = points[0].shape[1]
+        n_keyframes = snapshot_keyframes = len(keyframes[0].counts)
+        updates = []
+        rewrites = []
+
+        with open(self.journal_path, 'rb') as f:
+            data = f.read()
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(data):
+            length, crc = RECORD_HEADER.unpack_from(data, offset)
+            payload = data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break  # 写到一半的记录
+            offset += RECORD_HEADER.size + length
+
+            if len(payload) < BATCH_HEADER.size:
+                continue
+            rec_epoch, t_start, t_count, p_start, p_count, k_start, k_count, f_count = \
+                BATCH_HEADER.unpack_from(payload)
+            rows_end = BATCH_HEADER.size + 4 * (4 * t_count + 3 * p_count + 5 * k_count + 2 * f_count) \
+                + DESCRIPTOR_SIZE * f_count
+            u_count = rt_count = rk_count = 0
+            poses_start = end = rows_end
+            if len(payload) >= rows_end + UPDATE_HEADER.size:
+                u_count, = UPDATE_HEADER.unpack_from(payload, rows_end)
+                poses_start = end = rows_end + UPDATE_HEADER.size + 16 * u_count
+            if len(payload) >= poses_start + POSES_HEADER.size:
+                rt_count, rk_count = POSES_HEADER.unpack_from(payload, poses_start)
+                end = poses_start + POSES_HEADER.size + 16 * (rt_count + rk_count)
+            if (rec_epoch != epoch or t_start > n_traj or p_start > n_points or k_start > n_keyframes
+                    or rt_count > t_start or rk_count > k_start or len(payload) != end):
+                continue
+            t_rows, p_rows, k_rows, _ = _sections(payload, BATCH_HEADER.size,
+                                                  t_count, p_count, k_count, f_count)
+            if u_count and p_start >= snapshot_points:
+                # 快照之前的记录中的更新已包含在快照里
+                offset_rows = rows_end + UPDATE_HEADER.size
+                updates.append((np.frombuffer(payload, '<u4', u_count, offset_rows),
+                                np.frombuffer(payload, '<f4', 3 * u_count,
+                                              offset_rows + 4 * u_count).reshape(3, u_count)))
+            if end > poses_start and t_start >= snapshot_trajectory and k_start >= snapshot_keyframes:
+                # 回环校正后的位姿，同样只取快照之后的记录
+                offset_rows = poses_start + POSES_HEADER.size
+                rewrites.append((np.frombuffer(payload, '<f4', 4 * rt_count, offset_rows).reshape(4, rt_count),
+                                 np.frombuffer(payload, '<f4', 4 * rk_count,
+                                               offset_rows + 16 * rt_count).reshape(4, rk_count)))
+            # 跳过快照中已有的行
+            trajectory.append(t_rows[:, n_traj - t_start:])
+            points.append(p_rows[:, n_points - p_start:])
+            keyframes.append(_trim_keyframes(k_rows, n_keyframes - k_start))
+            n_traj = max(n_traj, t_start + t_count)
+            n_points = max(n_points, p_start + p_count)
+            n_keyframes = max(n_keyframes, k_start + k_count)
+
+        if offset < len(data):
+            # 丢弃损坏的尾部，之后的追加从完整记录之后开始
+            print(f"Map journal: dropping {len(data) - offset} bytes of incomplete records")
+            self._file.truncate(offset)
+            self.journal_bytes = offset
+        points = np.concatenate(points, axis=1)
+        for rows, values in updates:
+            # 按记录顺序覆盖被合并细化过的点
+            known = rows < points.shape[1]
+            points[:, rows[known]] = values[:, known]
+        trajectory = np.concatenate(trajectory, axis=1)
+        keyframes = [k for k in keyframes if len(k.counts)]
+        if rewrites:
+            # 位姿复制到一个数组中改写，再按原来的分段切回；描述子仍不复制
+            poses = np.concatenate([k.poses for k in keyframes], axis=1) if keyframes \
+                else np.empty((4, 0), dtype=np.float32)
+            for trajectory_rows, keyframe_poses in rewrites:
+                trajectory[:, :trajectory_rows.shape[1]] = trajectory_rows
+                poses[:, :keyframe_poses.shape[1]] = keyframe_poses
+            ends = np.cumsum([len(k.counts) for k in keyframes])
+            keyframes = [k._replace(poses=poses[:, end - len(k.counts):end]) for k, end in zip(keyframes, ends)]
+        return epoch, trajectory, points, keyframes
+
+    def _load_snapshot(self):
+        empty = (0, np.empty((4, 0), dtype=np.float32), np.empty((3, 0), dtype=np.float32),
+                 empty_keyframes())
+        if not os.path.exists(self.snapshot_path) or os.path.getsize(self.snapshot_path) < SNAPSHOT_HEADER.size:
+            return empty
+        data = np.memmap(self.snapshot_path, dtype=np.uint8, mode='r')
+        magic, version, header_size, epoch, n_traj, n_points, n_keyframes, n_features = \
+            SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            print(f"Map snapshot {self.snapshot_path} has an unknown format, ignoring it")
+            return empty
+        try:
+            trajectory, points, keyframes, _ = _sections(data, header_size, n_traj, n_points,
+                                                         n_keyframes, n_features)
+        except ValueError:
+            print(f"Map snapshot {self.snapshot_path} is truncated, ignoring it")
+            return empty
+        return epoch, trajectory, points, keyframes
+
+    def _sync_directory(self):
+        # 目录项也要落盘，rename 才算持久
+        try:
+            fd = os.open(self.directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def close(self):
+        self._file.close()
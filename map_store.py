@@ -0,0 +1,323 @@
+import numpy as np
+
+
+class ArrayStore:
+    """Growable float32 struct-of-arrays table
+
+    Each field is one contiguous float32 row of a (fields, capacity)
+    block. Appends are amortized O(1): a full block is copied into one
+    twice its size. Stored rows are never written again and clear() swaps
+    in a fresh block, so view() can hand out an O(1) read-only view that
+    stays valid and unchanged while appends continue.
+    """
+
+    def __init__(self, fields, capacity=256):
+        self.fields = tuple(fields)
+        self._index = {name: i for i, name in enumerate(self.fields)}
+        self._initial_capacity = capacity
+        self._data = np.empty((len(self.fields), capacity), dtype=np.float32)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        return self._data.nbytes
+
+    def append(self, *values):
+        """Append one row, one value per field"""
+        if self.count == self._data.shape[1]:
+            self._grow(self.count + 1)
+        self._data[:, self.count] = values
+        self.count += 1
+
+    def extend(self, rows):
+        """Append an (n, fields) array of rows"""
+        rows = np.asarray(rows, dtype=np.float32).reshape(-1, len(self.fields))
+        end = self.count + len(rows)
+        if end > self._data.shape[1]:
+            self._grow(end)
+        self._data[:, self.count:end] = rows.T
+        self.count = end
+
+    def _grow(self, needed):
+        data = np.empty((len(self.fields), max(needed, 2 * self._data.shape[1])), dtype=np.float32)
+        data[:, :self.count] = self._data[:, :self.count]
+        self._data = data
+
+    def view(self):
+        """(fields, count) read-only view of the stored rows"""
+        view = self._data[:, :self.count]
+        view.flags.writeable = False
+        return view
+
+    def column(self, name):
+        return self.view()[self._index[name]]
+
+    def last(self):
+        """The newest row as a tuple, or None when empty"""
+        if self.count == 0:
+            return None
+        return tuple(self._data[:, self.count - 1].tolist())
+
+    def clear(self):
+        # 换新的内存块，已发出的视图仍然有效
+        self._data = np.empty((len(self.fields), self._initial_capacity), dtype=np.float32)
+        self.count = 0
+
+
+# 体素坐标每轴 21 位，打包成一个 int64 键
+_AXIS_BITS = 21
+_AXIS_OFFSET = 1 << (_AXIS_BITS - 1)
+_EMPTY_KEY = -1
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+class VoxelMap:
+    """Map points merged per voxel, with a vectorized voxel hash
+
+    Space is cut into cubes of voxel_size; each occupied voxel holds one
+    point, the running mean of everything inserted into it. Voxels are
+    found through an open-addressing hash table (linear probing over
+    NumPy arrays, kept at most half full), so inserts and queries run as
+    batched array operations; a voxel costs 28 bytes plus its share of
+    the table.
+
+    Like ArrayStore, rows are numbered in the order their voxels were
+    created and view() is O(1), but merges refine existing rows in place.
+    tick counts insert batches and every row remembers the batch that
+    last changed it, so a reader that noted tick can ask changed() for
+    the rows refined since. When more than capacity voxels are occupied, voxels not updated in
+    the last max_age batches and then those farthest from the newest
+    batch are evicted down to evict_to * capacity. Eviction renumbers
+    the rows into fresh blocks and increments generation, so readers
+    holding row numbers know to start over.
+    """
+
+    fields = ('x', 'y', 'z')
+
+    def __init__(self, voxel_size=0.05, capacity=200000, max_age=None, evict_to=0.9, initial=256):
+        self.voxel_size = voxel_size
+        self.capacity = capacity
+        self.max_age = max_age
+        self.evict_to = evict_to
+        self._initial = initial
+        self.generation = 0
+        self.tick = 0
+        self.count = 0
+        self._allocate(initial)
+        self._alloc_table(2 * initial)
+
+    def _allocate(self, size):
+        """Swap in fresh row blocks of the given size, keeping the first count rows"""
+        for name, dtype, rows in (('_pos', np.float32, 3), ('_weight', np.uint32, None),
+                                  ('_seen', np.uint32, None), ('_keys', np.int64, None)):
+            data = np.empty((rows, size) if rows else size, dtype=dtype)
+            old = getattr(self, name, None)
+            if old is not None:
+                data[..., :self.count] = old[..., :self.count]
+            setattr(self, name, data)
+
+    def _alloc_table(self, size):
+        self._bits = int(size - 1).bit_length()
+        self._table_keys = np.full(1 << self._bits, _EMPTY_KEY, dtype=np.int64)
+        self._table_slots = np.empty(1 << self._bits, dtype=np.int32)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        return (self._pos.nbytes + self._weight.nbytes + self._seen.nbytes + self._keys.nbytes
+                + self._table_keys.nbytes + self._table_slots.nbytes)
+
+    def _voxel_keys(self, points):
+        cells = np.floor(points / self.voxel_size).astype(np.int64) + _AXIS_OFFSET
+        np.clip(cells, 0, (1 << _AXIS_BITS) - 1, out=cells)
+        return (cells[:, 0] << (2 * _AXIS_BITS)) | (cells[:, 1] << _AXIS_BITS) | cells[:, 2]
+
+    def _hash(self, keys):
+        return ((keys.astype(np.uint64) * _HASH_MULTIPLIER) >> np.uint64(64 - self._bits)).astype(np.int64)
+
+    def _lookup(self, keys):
+        """Row of each voxel key, -1 where the voxel is empty"""
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        buckets = self._hash(keys)
+        pending = np.arange(len(keys))
+        mask = (1 << self._bits) - 1
+        while len(pending):
+            b = buckets[pending]
+            found = self._table_keys[b]
+            hit = found == keys[pending]
+            rows[pending[hit]] = self._table_slots[b[hit]]
+            # 遇到空桶说明键不存在，否则继续线性探测
+            probe = ~hit & (found != _EMPTY_KEY)
+            pending = pending[probe]
+            buckets[pending] = (b[probe] + 1) & mask
+        return rows
+
+    def _insert(self, keys, rows):
+        """Add keys that are not in the table yet (and unique) pointing at rows"""
+        buckets = self._hash(keys)
+        pending = np.arange(len(keys))
+        mask = (1 << self._bits) - 1
+        while len(pending):
+            b = buckets[pending]
+            free = self._table_keys[b] == _EMPTY_KEY
+            # 多个键探测到同一个空桶时只有第一个写入，其余继续探测
+            _, first = np.unique(b[free], return_index=True)
+            winners = pending[free][first]
+            self._table_keys[buckets[winners]] = keys[winners]
+            self._table_slots[buckets[winners]] = rows[winners]
+            placed = np.zeros(len(keys), dtype=bool)
+            placed[winners] = True
+            pending = pending[~placed[pending]]
+            buckets[pending] = (buckets[pending] + 1) & mask
+
+    def _rebuild_table(self, size):
+        self._alloc_table(size)
+        self._insert(self._keys[:self.count], np.arange(self.count))
+
+    def append(self, *values):
+        """Insert one (x, y, z) point"""
+        self.extend(np.asarray(values, dtype=np.float32).reshape(1, 3))
+
+    def extend(self, rows):
+        """Insert an (n, 3) array of points, merging those that share a voxel"""
+        rows = np.asarray(rows, dtype=np.float32).reshape(-1, 3)
+        if not len(rows):
+            return
+        self.tick += 1
+        keys, inverse, counts = np.unique(self._voxel_keys(rows), return_inverse=True, return_counts=True)
+        inverse = inverse.ravel()
+        sums = np.stack([np.bincount(inverse, weights=rows[:, i], minlength=len(keys)) for i in range(3)])
+        slots = self._lookup(keys)
+
+        # 已有体素：更新滑动平均位置
+        old = slots >= 0
+        s = slots[old]
+        w = self._weight[s].astype(np.float64)
+        self._pos[:, s] = (self._pos[:, s] * w + sums[:, old]) / (w + counts[old])
+        self._weight[s] += counts[old].astype(np.uint32)
+        self._seen[s] = self.tick
+
+        # 新体素按创建顺序追加
+        new = ~old
+        n_new = int(new.sum())
+        if n_new:
+            end = self.count + n_new
+            if end > len(self._keys):
+                self._allocate(max(end, 2 * len(self._keys)))
+            self._pos[:, self.count:end] = sums[:, new] / counts[new]
+            self._weight[self.count:end] = counts[new]
+            self._seen[self.count:end] = self.tick
+            self._keys[self.count:end] = keys[new]
+            if 2 * end > len(self._table_keys):
+                self.count = end
+                self._rebuild_table(2 * end)
+            else:
+                self._insert(keys[new], np.arange(self.count, end))
+                self.count = end
+
+        if self.count > self.capacity:
+            self._evict(rows.mean(axis=0))
+
+    def _evict(self, center):
+        """Drop stale and then distant voxels down to evict_to * capacity"""
+        keep_count = int(self.evict_to * self.capacity)
+        score = np.linalg.norm(self._pos[:, :self.count] - center[:, None], axis=0)
+        if self.max_age is not None:
+            score[self.tick - self._seen[:self.count] > self.max_age] = np.inf
+        keep = np.sort(np.argpartition(score, keep_count)[:keep_count])
+
+        # 花式索引生成新的内存块，已发出的视图仍然有效
+        self._pos, self._weight, self._seen, self._keys = (
+            self._pos[:, keep], self._weight[keep], self._seen[keep], self._keys[keep])
+        self.count = keep_count
+        self._allocate(len(self._keys) + max(keep_count // 2, self._initial))
+        self._rebuild_table(len(self._table_keys))
+        self.generation += 1
+
+    def view(self):
+        """(3, count) read-only view of the voxel points"""
+        view = self._pos[:, :self.count]
+        view.flags.writeable = False
+        return view
+
+    def column(self, name):
+        return self.view()[self.fields.index(name)]
+
+    def changed(self, since, end=None):
+        """Rows below end (default all) changed by insert batches after tick since"""
+        end = self.count if end is None else min(end, self.count)
+        return np.flatnonzero(self._seen[:end] > since)
+
+    def clear(self):
+        # 换新的内存块，已发出的视图仍然有效
+        self.count = 0
+        self._allocate(self._initial)
+        self._alloc_table(2 * self._initial)
+        self.generation += 1
+
+    def _neighbour_rows(self, cell, reach):
+        """Rows of the occupied voxels within reach cells of a cell (Chebyshev distance)"""
+        span = np.arange(-reach, reach + 1)
+        offsets = np.stack(np.meshgrid(span, span, span, indexing='ij'), axis=-1).reshape(-1, 3)
+        cells = cell + offsets
+        keys = (cells[:, 0] << (2 * _AXIS_BITS)) | (cells[:, 1] << _AXIS_BITS) | cells[:, 2]
+        rows = self._lookup(keys)
+        return rows[rows >= 0]
+
+    def _cell(self, point):
+        cell = np.floor(np.asarray(point, dtype=np.float64) / self.voxel_size).astype(np.int64)
+        return cell + _AXIS_OFFSET
+
+    def radius(self, point, radius):
+        """Rows of the points within radius of point, nearest first"""
+        rows = self._neighbour_rows(self._cell(point), int(np.ceil(radius / self.voxel_size)))
+        dist = np.linalg.norm(self._pos[:, rows] - np.asarray(point, dtype=np.float32)[:, None], axis=0)
+        order = np.argsort(dist[dist <= radius])
+        return rows[dist <= radius][order]
+
+    def nearest(self, points, max_distance):
+        """Nearest stored point to each of an (n, 3) array of points
+
+        Returns (rows, distances); -1 and inf where nothing lies within
+        max_distance. Searches growing shells of voxels around each
+        point and stops once the best match is closer than any voxel
+        further out could be.
+        """
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 3)
+        best_rows = np.full(len(points), -1, dtype=np.int64)
+        best_dist = np.full(len(points), np.inf)
+        if not self.count:
+            return best_rows, best_dist
+        cells = np.floor(points / self.voxel_size).astype(np.int64) + _AXIS_OFFSET
+        pending = np.arange(len(points))
+        max_reach = int(np.ceil(max_distance / self.voxel_size))
+        for reach in range(max_reach + 1):
+            span = np.arange(-reach, reach + 1)
+            offsets = np.stack(np.meshgrid(span, span, span, indexing='ij'), axis=-1).reshape(-1, 3)
+            # 只查第 reach 层（Chebyshev 距离恰为 reach 的体素）
+            offsets = offsets[np.abs(offsets).max(axis=1) == reach]
+            shell = cells[pending, None, :] + offsets[None]
+            keys = (shell[..., 0] << (2 * _AXIS_BITS)) | (shell[..., 1] << _AXIS_BITS) | shell[..., 2]
+            rows = self._lookup(keys.ravel()).reshape(keys.shape)
+            found = rows >= 0
+            dist = np.full(rows.shape, np.inf)
+            query = pending[np.nonzero(found)[0]]
+            dist[found] = np.linalg.norm(self._pos[:, rows[found]].T - points[query], axis=1)
+            nearest = dist.argmin(axis=1)
+            d = dist[np.arange(len(pending)), nearest]
+            better = d < best_dist[pending]
+            best_dist[pending[better]] = d[better]
+            best_rows[pending[better]] = rows[np.arange(len(pending)), nearest][better]
+            # 更外层的体素距离至少为 reach * voxel_size
+            pending = pending[best_dist[pending] > reach * self.voxel_size]
+            if not len(pending):
+                break
+        too_far = best_dist > max_distance
+        best_rows[too_far] = -1
+        best_dist[too_far] = np.inf
+        return best_rows, best_dist
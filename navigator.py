@@ -0,0 +1,270 @@
+import math
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from path_planner import DStarLite, INF
+
+
+class Navigator:
+    """Drives the car to a goal position over the SLAM occupancy grid
+
+    One control thread, started with the first goal, runs at rate Hz
+    while a goal is active and owns the planner. Each step it reads the
+    SLAM pose and, when the grid changed, rebuilds the planning window: occupied
+    cells inflated by robot_radius and max-pooled into planning cells of
+    cell_factor x cell_factor grid cells. Cells that changed are handed
+    to a DStarLite planner, which repairs the path instead of searching
+    again. The car turns in place towards the path point lookahead map
+    units ahead and drives forward once it faces it within
+    heading_tolerance degrees.
+
+    Motor commands go through control_lock, the same lock the joystick
+    handler uses, and are only sent when they change.
+    """
+
+    def __init__(self, slam, robot, control_lock=None, speed=20, turn_speed=15, rate=5.0,
+                 cell_factor=2, robot_radius=0.15, margin=1.0, lookahead=0.3,
+                 goal_tolerance=0.15, heading_tolerance=20.0, occupied_threshold=166):
+        self.slam = slam
+        self.robot = robot
+        self.control_lock = control_lock or threading.Lock()
+        self.speed = speed
+        self.turn_speed = turn_speed
+        self.interval = 1 / rate
+        self.cell_factor = cell_factor
+        self.robot_radius = robot_radius
+        self.margin = margin
+        self.lookahead = lookahead
+        self.goal_tolerance = goal_tolerance
+        self.heading_tolerance = heading_tolerance
+        # 栅格值 >= 166（占据概率约 0.65）视为障碍
+        self.occupied_threshold = occupied_threshold
+
+        self.lock = threading.Lock()
+        self.active = False
+        self.state = 'idle'
+        self.goal = None
+        self.command = 'stop'
+        self.path = []
+        self.replans = 0
+        self.plan_ms = 0.0
+        self.expansions = 0
+        self._run_id = 0
+        self._thread = None
+        # set_goal() 和 cancel() 唤醒控制线程
+        self._wake = threading.Event()
+        # 以下规划状态只由控制线程访问
+        self._planner = None
+        self._window = None
+        self._grid_version = None
+
+    @property
+    def cell_size(self):
+        return self.slam.grid.resolution * self.cell_factor
+
+    def set_goal(self, x, y):
+        """Start driving to (x, y) in map units, replacing any current goal"""
+        with self.lock:
+            self.goal = (float(x), float(y))
+            self.state = 'planning'
+            self._run_id += 1
+            run_id = self._run_id
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+        with self.control_lock:
+            # 期间被取消或换了新目标时不再激活
+            if self._run_id == run_id:
+                self.active = True
+        self._wake.set()
+
+    def cancel(self, state='cancelled', run_id=None):
+        """Stop navigating and stop the motors
+
+        With run_id, only if that goal is still the current one.
+        """
+        with self.lock:
+            if run_id is not None and run_id != self._run_id:
+                return
+            self._run_id += 1
+            run_id = self._run_id
+            if self.state in ('planning', 'driving', 'blocked'):
+                self.state = state
+        with self.control_lock:
+            # 期间设置了新目标，不要停掉它
+            if self._run_id != run_id:
+                return
+            self.active = False
+            self.robot.t_stop(0)
+            # 加锁顺序固定为 control_lock 在外、lock 在内
+            with self.lock:
+                self.command = 'stop'
+        self._wake.set()
+
+    def _run(self):
+        current = None
+        while True:
+            self._wake.clear()
+            if not self.active:
+                self._wake.wait()
+                continue
+            with self.lock:
+                run_id, goal = self._run_id, self.goal
+            if run_id != current:
+                # 新目标：从头规划
+                current = run_id
+                self._planner = None
+                print(f"Navigation started, goal {goal}")
+            start = time.monotonic()
+            try:
+                self._step(run_id, goal)
+            except Exception as e:
+                print(f"Navigation error: {e}")
+                self.cancel('error', run_id)
+            self._wake.wait(max(0.0, self.interval - (time.monotonic() - start)))
+
+    def _step(self, run_id, goal):
+        position = self.slam.get_position()
+        x, y = position['position'][:2]
+        yaw = position['orientation'][2]
+        if math.hypot(goal[0] - x, goal[1] - y) <= self.goal_tolerance:
+            print("Navigation goal reached")
+            self.cancel('reached', run_id)
+            return
+
+        start = self._cell(x, y)
+        if self._planner is None or not self._in_window(start):
+            self._new_plan(start, goal)
+        else:
+            self._update_plan(start)
+
+        planner = self._planner
+        expansions = planner.expansions
+        t0 = time.perf_counter()
+        cost = planner.compute()
+        self.plan_ms = (time.perf_counter() - t0) * 1000
+        self.expansions = planner.expansions - expansions
+        if cost == INF:
+            # 暂时无路可走，停车等待地图更新
+            with self.lock:
+                if self._run_id != run_id:
+                    return
+                self.state = 'blocked'
+                self.path = []
+            self._drive('stop', run_id)
+            return
+
+        path = planner.path()
+        points = [self._center(cell) for cell in path]
+        with self.lock:
+            if self._run_id != run_id:
+                return
+            self.state = 'driving'
+            self.path = points
+
+        ahead = min(len(points) - 1, max(1, int(round(self.lookahead / self.cell_size))))
+        tx, ty = points[ahead] if len(points) > 1 else goal
+        heading = math.degrees(math.atan2(ty - y, tx - x))
+        error = (heading - yaw + 180) % 360 - 180
+        if error > self.heading_tolerance:
+            self._drive('left', run_id)
+        elif error < -self.heading_tolerance:
+            self._drive('right', run_id)
+        else:
+            self._drive('forward', run_id)
+
+    def _drive(self, command, run_id):
+        with self.lock:
+            if command == self.command:
+                return
+        with self.control_lock:
+            # 取消后不再下发运动指令
+            if not self.active or self._run_id != run_id:
+                return
+            if command == 'forward':
+                self.robot.t_up(self.speed, 0)
+            elif command == 'left':
+                self.robot.turnLeft(self.turn_speed, 0)
+            elif command == 'right':
+                self.robot.turnRight(self.turn_speed, 0)
+            else:
+                self.robot.t_stop(0)
+            with self.lock:
+                self.command = command
+
+    def _cell(self, x, y):
+        """Planning cell (in global planning-cell coordinates) of a map position"""
+        return (int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size)))
+
+    def _center(self, local):
+        """Map position of the centre of a window cell"""
+        return ((self._window[0] + local[0] + 0.5) * self.cell_size,
+                (self._window[1] + local[1] + 0.5) * self.cell_size)
+
+    def _in_window(self, cell):
+        x0, y0, width, height = self._window
+        return x0 <= cell[0] < x0 + width and y0 <= cell[1] < y0 + height
+
+    def _local(self, cell):
+        return (cell[0] - self._window[0], cell[1] - self._window[1])
+
+    def _new_plan(self, start, goal):
+        """Fix a planning window around the start and goal and plan from scratch"""
+        goal = self._cell(*goal)
+        margin = int(math.ceil(self.margin / self.cell_size))
+        x0 = min(start[0], goal[0]) - margin
+        y0 = min(start[1], goal[1]) - margin
+        self._window = (x0, y0, abs(start[0] - goal[0]) + 2 * margin + 1,
+                        abs(start[1] - goal[1]) + 2 * margin + 1)
+        blocked = self._blocked_window()
+        self._planner = DStarLite(blocked, self._local(start), self._local(goal))
+        self.replans += 1
+
+    def _update_plan(self, start):
+        """Feed grid changes and the new start to the planner"""
+        if self.slam.grid.version != self._grid_version:
+            blocked = self._blocked_window()
+            changed = np.argwhere(blocked != self._planner.blocked)[:, ::-1]
+            if len(changed):
+                self._planner.update_cells(changed, blocked)
+        self._planner.move_start(self._local(start))
+
+    def _blocked_window(self):
+        """Inflated obstacles of the planning window as a (height, width) bool array"""
+        version, raster, origin = self.slam.grid.raster()
+        self._grid_version = version
+        f = self.cell_factor
+        x0, y0, width, height = self._window
+        blocked = np.zeros((height * f, width * f), dtype=bool)
+        if raster.size:
+            occupied = (raster >= self.occupied_threshold).astype(np.uint8)
+            radius = int(math.ceil(self.robot_radius / self.slam.grid.resolution))
+            if radius:
+                kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * radius + 1, 2 * radius + 1))
+                occupied = cv2.dilate(occupied, kernel)
+            # 栅格原点按瓦片对齐，换算成整数格坐标
+            gx = int(round(origin[0] / self.slam.grid.resolution)) - x0 * f
+            gy = int(round(origin[1] / self.slam.grid.resolution)) - y0 * f
+            sx, sy = max(gx, 0), max(gy, 0)
+            ex = min(gx + occupied.shape[1], width * f)
+            ey = min(gy + occupied.shape[0], height * f)
+            if sx < ex and sy < ey:
+                blocked[sy:ey, sx:ex] = occupied[sy - gy:ey - gy, sx - gx:ex - gx].astype(bool)
+        # 按最大值降采样：任一子格被占据则整个规划格被占据
+        return blocked.reshape(height, f, width, f).any(axis=(1, 3))
+
+    def get_status(self):
+        with self.lock:
+            return {
+                'state': self.state,
+                'goal': self.goal,
+                'command': self.command,
+                'path': self.path,
+                'replans': self.replans,
+                'plan_ms': round(self.plan_ms, 2),
+                'expansions': self.expansions,
+            }
@@ -0,0 +1,154 @@
+import struct
+import threading
+
+import numpy as np
+
+# Raster export (see OccupancyGrid.export_raster), little-endian:
+#   u16 version, u16 header length, u32 grid version, u32 width, u32 height,
+#   f32 origin x, f32 origin y, f32 resolution,
+# followed by height rows of width uint8 cells, row 0 at origin y. A cell
+# is round(254 * P(occupied)); 127 means unknown
+GRID_HEADER = struct.Struct('<HHIIIfff')
+GRID_HEADER_VERSION = 1
+UNKNOWN = 127
+
+# 格子坐标各占 32 位，打包成 int64 用于去重
+_CELL_OFFSET = 1 << 31
+
+
+def _pack(cells):
+    return ((cells[:, 0] + _CELL_OFFSET) << 32) | (cells[:, 1] + _CELL_OFFSET)
+
+
+def _unpack(keys):
+    return np.stack([((keys >> 32) & 0xFFFFFFFF) - _CELL_OFFSET, (keys & 0xFFFFFFFF) - _CELL_OFFSET], axis=1)
+
+
+class OccupancyGrid:
+    """2D log-odds occupancy grid in square tiles allocated on demand
+
+    Cells are resolution map units wide and hold the log-odds of being
+    occupied, clamped to [l_min, l_max] so they can change their mind.
+    update() casts a batch of rays at once: each ray is sampled every
+    half cell, the samples of all rays are turned into cell coordinates
+    and deduplicated, and every cell touched is updated once per batch
+    with a single fancy-indexed add per tile.
+
+    Tiles are tile_size cells square (a power of two) and created the
+    first time a ray reaches them, so the grid grows with the explored
+    area. version increments on every change.
+    """
+
+    def __init__(self, resolution=0.05, tile_size=64, l_occupied=0.85, l_free=-0.4,
+                 l_min=-4.0, l_max=4.0, max_range=4.0):
+        if tile_size & (tile_size - 1):
+            raise ValueError("tile_size must be a power of two")
+        self.resolution = resolution
+        self.tile_size = tile_size
+        self._tile_bits = tile_size.bit_length() - 1
+        self.l_occupied = l_occupied
+        self.l_free = l_free
+        self.l_min = l_min
+        self.l_max = l_max
+        self.max_range = max_range
+        self.tiles = {}
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.tiles)
+
+    @property
+    def nbytes(self):
+        return sum(tile.nbytes for tile in self.tiles.values())
+
+    def update(self, origin, endpoints, hit=True):
+        """Cast rays from origin (x, y) to each of an (n, 2) array of endpoints
+
+        Cells a ray passes through become more likely free. With hit, the
+        endpoint cells become more likely occupied; rays longer than
+        max_range are cut short and count as misses.
+        """
+        origin = np.asarray(origin, dtype=np.float64)[:2]
+        ends = np.asarray(endpoints, dtype=np.float64).reshape(-1, 2)
+        if not len(ends):
+            return
+        vectors = ends - origin
+        lengths = np.hypot(vectors[:, 0], vectors[:, 1])
+        hits = np.full(len(ends), hit)
+        too_long = lengths > self.max_range
+        if too_long.any():
+            vectors[too_long] *= (self.max_range / lengths[too_long])[:, None]
+            lengths[too_long] = self.max_range
+            hits[too_long] = False
+
+        # 每条射线按半格采样，所有射线一起计算
+        samples = int(np.ceil(lengths.max() / (0.5 * self.resolution))) + 1
+        t = np.arange(samples) / samples
+        points = origin + vectors[:, None, :] * t[None, :, None]
+        free = np.unique(_pack(np.floor(points.reshape(-1, 2) / self.resolution).astype(np.int64)))
+        ends = origin + vectors
+        occupied = np.unique(_pack(np.floor(ends[hits] / self.resolution).astype(np.int64)))
+        free = np.setdiff1d(free, occupied, assume_unique=True)
+
+        with self.lock:
+            self._add(_unpack(free), self.l_free)
+            self._add(_unpack(occupied), self.l_occupied)
+            self.version += 1
+
+    def _add(self, cells, delta):
+        """Add delta to the log-odds of unique (n, 2) cells, tile by tile"""
+        if not len(cells):
+            return
+        tile_coords = cells >> self._tile_bits
+        local = cells & (self.tile_size - 1)
+        tile_keys = _pack(tile_coords)
+        order = np.argsort(tile_keys, kind='stable')
+        tile_keys = tile_keys[order]
+        starts = np.flatnonzero(np.r_[True, tile_keys[1:] != tile_keys[:-1]])
+        for start, end in zip(starts, np.r_[starts[1:], len(order)]):
+            sel = order[start:end]
+            key = tuple(tile_coords[sel[0]].tolist())
+            tile = self.tiles.get(key)
+            if tile is None:
+                tile = self.tiles[key] = np.zeros((self.tile_size, self.tile_size), dtype=np.float32)
+            # 行为 y，列为 x
+            ly, lx = local[sel, 1], local[sel, 0]
+            tile[ly, lx] = np.clip(tile[ly, lx] + delta, self.l_min, self.l_max)
+
+    def clear(self):
+        with self.lock:
+            self.tiles = {}
+            self.version += 1
+
+    def raster(self):
+        """The explored area as uint8 cells
+
+        Returns (grid version, (height, width) uint8 array, (origin x,
+        origin y)); row r, column c covers the cell at origin +
+        (c, r) * resolution. See GRID_HEADER for the cell encoding.
+        """
+        with self.lock:
+            version = self.version
+            tiles = {key: tile.copy() for key, tile in self.tiles.items()}
+        if not tiles:
+            return version, np.empty((0, 0), dtype=np.uint8), (0.0, 0.0)
+        coords = np.array(list(tiles.keys()))
+        low = coords.min(axis=0)
+        shape = (coords.max(axis=0) - low + 1) * self.tile_size
+        raster = np.full((shape[1], shape[0]), UNKNOWN, dtype=np.uint8)
+        for (tx, ty), tile in tiles.items():
+            x0 = (tx - low[0]) * self.tile_size
+            y0 = (ty - low[1]) * self.tile_size
+            # P = 1 / (1 + exp(-l))
+            raster[y0:y0 + self.tile_size, x0:x0 + self.tile_size] = \
+                np.rint(254 / (1 + np.exp(-tile))).astype(np.uint8)
+        origin = tuple((low * self.tile_size * self.resolution).tolist())
+        return version, raster, origin
+
+    def export_raster(self):
+        """The raster as a GRID_HEADER plus uint8 cells, returns (version, bytes)"""
+        version, raster, origin = self.raster()
+        header = GRID_HEADER.pack(GRID_HEADER_VERSION, GRID_HEADER.size, version,
+                                  raster.shape[1], raster.shape[0], origin[0], origin[1], self.resolution)
+        return version, header + raster.tobytes()
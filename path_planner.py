@@ -0,0 +1,153 @@
+import heapq
+import math
+
+import numpy as np
+
+INF = float('inf')
+SQRT2 = math.sqrt(2)
+# 8 邻域及其步长
+NEIGHBOURS = [(dx, dy, SQRT2 if dx and dy else 1.0)
+              for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy]
+
+
+class DStarLite:
+    """Incremental shortest paths on an 8-connected grid (D* Lite)
+
+    blocked is a (height, width) bool array indexed [y, x]; cells are
+    (x, y) tuples. The search runs backwards from the goal, so when the
+    robot moves only the heuristic offset km changes, and when cells
+    change only the vertices whose distance to the goal is affected are
+    re-expanded, instead of searching the whole grid again.
+
+    Moving into a blocked cell costs infinity; moving out of one does
+    not, so a robot whose own cell is marked blocked can still leave it.
+    The open list is a heap with lazy deletion: a popped entry whose key
+    no longer matches the vertex's current key is skipped.
+    """
+
+    def __init__(self, blocked, start, goal):
+        self._set_blocked(blocked)
+        self.start = start
+        self.goal = goal
+        self.km = 0.0
+        self.g = {}
+        self.rhs = {goal: 0.0}
+        self._open = []
+        self._keys = {}
+        self.expansions = 0
+        self._push(goal)
+
+    def _set_blocked(self, blocked):
+        self.blocked = np.array(blocked, dtype=bool)
+        self.height, self.width = self.blocked.shape
+        # 逐格访问 Python 列表比 NumPy 标量索引快得多
+        self._blocked = self.blocked.ravel().tolist()
+
+    def _h(self, a, b):
+        # 八邻域距离，满足一致性
+        dx = abs(a[0] - b[0])
+        dy = abs(a[1] - b[1])
+        return max(dx, dy) + (SQRT2 - 1) * min(dx, dy)
+
+    def _key(self, s):
+        m = min(self.g.get(s, INF), self.rhs.get(s, INF))
+        # km 累加的浮点误差会让相等的键差一个 ulp，取整后再比较
+        return (round(m + self._h(self.start, s) + self.km, 9), round(m, 9))
+
+    def _push(self, s):
+        key = self._key(s)
+        self._keys[s] = key
+        heapq.heappush(self._open, (key, s))
+
+    def _neighbours(self, s):
+        x, y = s
+        for dx, dy, step in NEIGHBOURS:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < self.width and 0 <= ny < self.height:
+                yield (nx, ny), step
+
+    def _cost(self, step, target):
+        return INF if self._blocked[target[1] * self.width + target[0]] else step
+
+    def _update_vertex(self, u):
+        if u != self.goal:
+            self.rhs[u] = min((self._cost(step, s) + self.g.get(s, INF) for s, step in self._neighbours(u)),
+                              default=INF)
+        self._queue(u)
+
+    def _queue(self, u):
+        """Keep u in the open list exactly while it is inconsistent"""
+        if self.g.get(u, INF) != self.rhs.get(u, INF):
+            self._push(u)
+        else:
+            self._keys.pop(u, None)
+
+    def _top(self):
+        """Smallest live (key, vertex) in the open list, or None"""
+        while self._open:
+            key, s = self._open[0]
+            if self._keys.get(s) == key:
+                return key, s
+            heapq.heappop(self._open)
+        return None
+
+    def compute(self):
+        """Repair the shortest paths to the start; returns the path cost (inf if none)"""
+        while True:
+            top = self._top()
+            start_key = self._key(self.start)
+            if top is None or (top[0] >= start_key
+                               and self.rhs.get(self.start, INF) == self.g.get(self.start, INF)):
+                break
+            k_old, u = top
+            self.expansions += 1
+            k_new = self._key(u)
+            if k_old < k_new:
+                self._push(u)
+                continue
+            heapq.heappop(self._open)
+            del self._keys[u]
+            g_u = self.g.get(u, INF)
+            if g_u > self.rhs.get(u, INF):
+                # 局部过一致：确定 g 值，再传播给前驱
+                self.g[u] = self.rhs[u]
+                for s, step in self._neighbours(u):
+                    if s != self.goal:
+                        cost = self._cost(step, u) + self.g[u]
+                        if cost < self.rhs.get(s, INF):
+                            self.rhs[s] = cost
+                            self._queue(s)
+            else:
+                # 局部欠一致：g 置为无穷，重新计算自身及前驱
+                self.g[u] = INF
+                self._update_vertex(u)
+                for s, _ in self._neighbours(u):
+                    self._update_vertex(s)
+        return self.g.get(self.start, INF)
+
+    def move_start(self, start):
+        """The robot moved; keys stay valid through the km offset"""
+        if start != self.start:
+            self.km += self._h(self.start, start)
+            self.start = start
+
+    def update_cells(self, cells, blocked):
+        """Apply a new blocked array in which the given (x, y) cells changed"""
+        self._set_blocked(blocked)
+        for x, y in cells:
+            cell = (int(x), int(y))
+            # 只有进入该格的边代价改变，受影响的是它的邻居
+            for s, _ in self._neighbours(cell):
+                self._update_vertex(s)
+
+    def path(self, limit=None):
+        """Cells from the start to the goal along the current shortest path"""
+        if self.g.get(self.start, INF) == INF:
+            return []
+        path = [self.start]
+        s = self.start
+        limit = limit or self.width * self.height
+        while s != self.goal and len(path) < limit:
+            s = min(((self._cost(step, n) + self.g.get(n, INF), n) for n, step in self._neighbours(s)))[1]
+            path.append(s)
+        return path
@@ -0,0 +1,159 @@
+import numpy as np
+
+
+def wrap(angle):
+    """Wrap radians to [-pi, pi)"""
+    return (angle + np.pi) % (2 * np.pi) - np.pi
+
+
+def relative(a, b):
+    """Pose b in the frame of pose a; poses are (x, y, yaw radians)"""
+    c, s = np.cos(a[2]), np.sin(a[2])
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    return np.array([c * dx + s * dy, -s * dx + c * dy, wrap(b[2] - a[2])])
+
+
+def _linearize(poses, i, j, z):
+    """Edge errors (m, 3) and Jacobians with respect to pose i and pose j (m, 3, 3)"""
+    pi, pj = poses[i], poses[j]
+    c, s = np.cos(pi[:, 2]), np.sin(pi[:, 2])
+    dx, dy = pj[:, 0] - pi[:, 0], pj[:, 1] - pi[:, 1]
+    errors = np.stack([c * dx + s * dy - z[:, 0],
+                       -s * dx + c * dy - z[:, 1],
+                       wrap(pj[:, 2] - pi[:, 2] - z[:, 2])], axis=1)
+    m = len(i)
+    A = np.zeros((m, 3, 3))
+    A[:, 0, 0], A[:, 0, 1], A[:, 0, 2] = -c, -s, -s * dx + c * dy
+    A[:, 1, 0], A[:, 1, 1], A[:, 1, 2] = s, -c, -c * dx - s * dy
+    A[:, 2, 2] = -1
+    B = np.zeros((m, 3, 3))
+    B[:, 0, 0], B[:, 0, 1] = c, s
+    B[:, 1, 0], B[:, 1, 1] = -s, c
+    B[:, 2, 2] = 1
+    return errors, A, B
+
+
+def optimize(poses, i, j, z, weights=None, fixed=0, iterations=10, tolerance=1e-4):
+    """Gauss-Newton on a 2D pose graph, returns the optimized (n, 3) poses
+
+    poses are (x, y, yaw radians) rows; edge k says pose j[k] is z[k]
+    (see relative()) as seen from pose i[k], with weight weights[k] on
+    all three components. Pose fixed anchors the graph and is not moved.
+
+    The normal equations are never formed. Each step is solved with
+    conjugate gradients, using products with the edge Jacobians, and
+    preconditioned with the exact inverse of the part of the system that
+    links consecutive poses (odometry edges), a block tridiagonal matrix
+    factorized in O(n). What is left for the iterations are the loop
+    edges, so a keyframe chain with a few loops converges in a handful
+    of iterations and time and memory grow linearly with its length.
+    """
+    poses = np.array(poses, dtype=np.float64)
+    i = np.asarray(i, dtype=np.int64)
+    j = np.asarray(j, dtype=np.int64)
+    z = np.asarray(z, dtype=np.float64)
+    w = np.ones(len(i)) if weights is None else np.asarray(weights, dtype=np.float64)
+    n = len(poses)
+    if not len(i) or n < 2:
+        return poses
+    forward = j == i + 1
+    backward = i == j + 1
+
+    for _ in range(iterations):
+        errors, A, B = _linearize(poses, i, j, z)
+        we = w[:, None] * errors
+        gradient = np.zeros((n, 3))
+        np.add.at(gradient, i, np.einsum('mki,mk->mi', A, we))
+        np.add.at(gradient, j, np.einsum('mki,mk->mi', B, we))
+        gradient[fixed] = 0
+
+        # 预条件：只含相邻位姿之间的边的块三对角矩阵
+        diagonal = np.zeros((n, 3, 3))
+        np.add.at(diagonal, i, w[:, None, None] * np.einsum('mki,mkj->mij', A, A))
+        np.add.at(diagonal, j, w[:, None, None] * np.einsum('mki,mkj->mij', B, B))
+        upper = np.zeros((n - 1, 3, 3))
+        np.add.at(upper, i[forward], w[forward, None, None] * np.einsum('mki,mkj->mij', A[forward], B[forward]))
+        np.add.at(upper, j[backward], w[backward, None, None] * np.einsum('mki,mkj->mij', B[backward], A[backward]))
+        diagonal += 1e-9 * np.eye(3)
+        diagonal[fixed] = np.eye(3)
+        upper[max(fixed - 1, 0)] = 0
+        upper[min(fixed, n - 2)] = 0
+        solve = _block_tridiagonal(diagonal, upper)
+
+        def product(v):
+            Jv = np.einsum('mij,mj->mi', A, v[i]) + np.einsum('mij,mj->mi', B, v[j])
+            Jv *= w[:, None]
+            out = np.zeros((n, 3))
+            np.add.at(out, i, np.einsum('mki,mk->mi', A, Jv))
+            np.add.at(out, j, np.einsum('mki,mk->mi', B, Jv))
+            out[fixed] = 0
+            return out
+
+        step = _conjugate_gradient(product, -gradient, solve, 3 * len(i) + 10)
+        poses += step
+        poses[:, 2] = wrap(poses[:, 2])
+        if np.abs(step).max() < tolerance:
+            break
+    return poses
+
+
+def _block_tridiagonal(diagonal, upper):
+    """Factorize a symmetric block tridiagonal matrix, returns a function solving it for (n, 3)
+
+    diagonal holds the (n, 3, 3) diagonal blocks and upper the (n - 1,
+    3, 3) blocks right of them (block Thomas algorithm).
+    """
+    n = len(diagonal)
+    inverse = np.empty((n, 3, 3))
+    inverse[0] = np.linalg.inv(diagonal[0])
+    lower = np.empty((n, 3, 3))
+    for k in range(1, n):
+        lower[k] = upper[k - 1].T @ inverse[k - 1]
+        inverse[k] = np.linalg.inv(diagonal[k] - lower[k] @ upper[k - 1])
+    ahead = np.einsum('nij,njk->nik', inverse[:-1], upper)
+    # 代入过程是逐块的串行循环，用 Python 浮点数比 3x3 的 NumPy 运算快
+    inverse = inverse.reshape(n, 9).tolist()
+    lower = lower.reshape(n, 9).tolist()
+    ahead = ahead.reshape(n - 1, 9).tolist()
+
+    def solve(b):
+        y = b.tolist()
+        for k in range(1, n):
+            m, (p0, p1, p2), q = lower[k], y[k - 1], y[k]
+            y[k] = [q[0] - m[0] * p0 - m[1] * p1 - m[2] * p2,
+                    q[1] - m[3] * p0 - m[4] * p1 - m[5] * p2,
+                    q[2] - m[6] * p0 - m[7] * p1 - m[8] * p2]
+        x = [None] * n
+        m, (p0, p1, p2) = inverse[n - 1], y[n - 1]
+        x[n - 1] = [m[0] * p0 + m[1] * p1 + m[2] * p2,
+                    m[3] * p0 + m[4] * p1 + m[5] * p2,
+                    m[6] * p0 + m[7] * p1 + m[8] * p2]
+        for k in range(n - 2, -1, -1):
+            m, a, (p0, p1, p2), (q0, q1, q2) = inverse[k], ahead[k], y[k], x[k + 1]
+            x[k] = [m[0] * p0 + m[1] * p1 + m[2] * p2 - a[0] * q0 - a[1] * q1 - a[2] * q2,
+                    m[3] * p0 + m[4] * p1 + m[5] * p2 - a[3] * q0 - a[4] * q1 - a[5] * q2,
+                    m[6] * p0 + m[7] * p1 + m[8] * p2 - a[6] * q0 - a[7] * q1 - a[8] * q2]
+        return np.array(x)
+    return solve
+
+
+def _conjugate_gradient(product, b, precondition, iterations, tolerance=1e-10):
+    """Solve H x = b for (n, 3) b, with H given by product() and a preconditioner solve"""
+    x = np.zeros_like(b)
+    r = b.copy()
+    p_r = precondition(r)
+    d = p_r.copy()
+    rz = np.sum(r * p_r)
+    threshold = tolerance * max(np.sum(b * b), 1e-30)
+    for _ in range(iterations):
+        if np.sum(r * r) <= threshold:
+            break
+        Hd = product(d)
+        alpha = rz / np.sum(d * Hd)
+        x += alpha * d
+        r -= alpha * Hd
+        p_r = precondition(r)
+        rz_new = np.sum(r * p_r)
+        d = p_r + (rz_new / rz) * d
+        rz = rz_new
+    return x
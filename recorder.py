@@ -0,0 +1,181 @@
+import os
+import queue
+import threading
+import time
+
+import cv2
+
+
+class VideoRecorder:
+    """Records the camera stream to rolling segment files
+
+    Frames reach the recorder through a Camera frame listener and a bounded
+    queue, and are written by a dedicated writer thread, so the capture
+    loop never waits on the disk. When the queue is full a frame is dropped
+    according to drop_policy: 'oldest' discards the oldest queued frame to
+    make room, 'newest' discards the incoming one.
+
+    Every segment covers at most segment_minutes and has a CSV sidecar
+    listing frame_id and capture timestamp for each frame. BGR frames go to
+    MJPG .avi files; compressed frames from an MJPEG passthrough camera are
+    appended unchanged to a .mjpeg stream, and the sidecar also records
+    their byte offset and size.
+    """
+
+    DROP_POLICIES = ('oldest', 'newest')
+
+    def __init__(self, camera, output_dir='recordings', segment_minutes=5,
+                 queue_size=30, drop_policy='oldest', fps=15):
+        if drop_policy not in self.DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy: {drop_policy}")
+        self.camera = camera
+        self.output_dir = output_dir
+        self.segment_seconds = segment_minutes * 60
+        self.drop_policy = drop_policy
+        self.fps = fps
+        self.queue_size = queue_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.recording = False
+        self.thread = None
+
+        # 统计
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.segments = []
+
+        # 当前分段，仅写线程访问
+        self._writer = None
+        self._index_file = None
+        self._segment_start = None
+        self._segment_frames = 0
+        self._segment_shape = None
+
+    def start(self, segment_minutes=None):
+        """Start recording a new session"""
+        with self.lock:
+            if self.recording:
+                return False
+            if segment_minutes is not None:
+                self.segment_seconds = segment_minutes * 60
+            os.makedirs(self.output_dir, exist_ok=True)
+            self.frames_written = 0
+            self.frames_dropped = 0
+            self.segments = []
+            # 丢弃上一次会话停止时残留的帧
+            self.queue = queue.Queue(maxsize=self.queue_size)
+            self.recording = True
+            self.thread = threading.Thread(target=self._writer_loop)
+            self.thread.daemon = True
+            self.thread.start()
+        self.camera.add_frame_listener(self._on_frame)
+        print(f"Recording started in {self.output_dir}")
+        return True
+
+    def stop(self):
+        """Stop recording, flushing queued frames to disk"""
+        with self.lock:
+            if not self.recording:
+                return False
+            self.recording = False
+        self.camera.remove_frame_listener(self._on_frame)
+        # 写线程写完队列中剩余的帧后退出
+        self.thread.join()
+        print(f"Recording stopped, {self.frames_written} frames written")
+        return True
+
+    def status(self):
+        """Recorder state for the REST/Socket.IO API"""
+        return {
+            'recording': self.recording,
+            'frames_written': self.frames_written,
+            'frames_dropped': self.frames_dropped,
+            'queued': self.queue.qsize(),
+            'segments': list(self.segments),
+        }
+
+    def _on_frame(self, frame_id, frame, timestamp):
+        """Camera frame listener, runs on the capture thread and never blocks"""
+        if not self.recording:
+            return
+        # 帧缓冲会被相机复用，必须复制
+        item = (frame_id, timestamp, frame.copy())
+        try:
+            self.queue.put_nowait(item)
+            return
+        except queue.Full:
+            pass
+
+        self.frames_dropped += 1
+        if self.drop_policy == 'oldest':
+            try:
+                self.queue.get_nowait()
+                self.queue.put_nowait(item)
+            except (queue.Empty, queue.Full):
+                pass
+
+    def _writer_loop(self):
+        """Writer thread: drain the queue into segment files"""
+        try:
+            while self.recording or not self.queue.empty():
+                try:
+                    item = self.queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                try:
+                    self._write(*item)
+                except Exception as e:
+                    print(f"Recording write error: {e}")
+        finally:
+            self._close_segment()
+
+    def _write(self, frame_id, timestamp, frame):
+        compressed = frame.ndim == 1
+        shape = 'mjpeg' if compressed else frame.shape
+        if (self._segment_start is None or shape != self._segment_shape
+                or timestamp - self._segment_start >= self.segment_seconds):
+            self._open_segment(timestamp, shape)
+
+        if compressed:
+            offset = self._writer.tell()
+            self._writer.write(frame.tobytes())
+            self._index_file.write(f"{self._segment_frames},{frame_id},{timestamp:.6f},{offset},{frame.size}\n")
+        else:
+            self._writer.write(frame)
+            self._index_file.write(f"{self._segment_frames},{frame_id},{timestamp:.6f},,\n")
+        self._segment_frames += 1
+        self.frames_written += 1
+
+    def _open_segment(self, timestamp, shape):
+        self._close_segment()
+        base = os.path.join(self.output_dir, time.strftime('%Y%m%d-%H%M%S'))
+        # 同一秒内切换分段时避免文件名冲突
+        name, n = base, 1
+        while os.path.exists(name + '.csv'):
+            name = f"{base}-{n}"
+            n += 1
+
+        if shape == 'mjpeg':
+            path = name + '.mjpeg'
+            self._writer = open(path, 'wb')
+        else:
+            path = name + '.avi'
+            self._writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'),
+                                           self.fps, (shape[1], shape[0]))
+        self._index_file = open(name + '.csv', 'w')
+        self._index_file.write("index,frame_id,timestamp,offset,size\n")
+        self._segment_start = timestamp
+        self._segment_shape = shape
+        self._segment_frames = 0
+        self.segments.append(os.path.basename(path))
+
+    def _close_segment(self):
+        if self._writer is not None:
+            if isinstance(self._writer, cv2.VideoWriter):
+                self._writer.release()
+            else:
+                self._writer.close()
+            self._index_file.close()
+        self._writer = None
+        self._index_file = None
+        self._segment_start = None
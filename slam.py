@@ -3,33 +3,152 @@ import numpy as np
 import threading
 import time
 import os
-import json
+import bisect
+import struct
+from collections import deque, namedtuple
 from imu import MPU6050  # Import the MPU6050 class
+from slam_frontend import Frontend, FrontendProcess
+from slam_scheduler import SlamScheduler
+from map_store import ArrayStore, VoxelMap
+from occupancy_grid import OccupancyGrid
+from trajectory_lod import TrajectoryLOD, fit
+from map_journal import MapJournal, KeyframeRows, DESCRIPTOR_SIZE, empty_keyframes
+from keyframe_index import KeyframeIndex
+from vocabulary import Vocabulary
+from loop_closure import LoopCloser
+from feature_matcher import create_matcher, estimate_motion
+
+# A keyframe keeps the pose it was taken at plus its ORB keypoints and descriptors;
+# index is the frame it was taken at, -1 for keyframes loaded from a saved map
+Keyframe = namedtuple('Keyframe', ['index', 'pose', 'pts', 'des'])
+
+
+def _keyframe_rows(keyframes):
+    """Pack Keyframe tuples into KeyframeRows for the map journal"""
+    if not keyframes:
+        return empty_keyframes()
+    counts = np.array([0 if kf.des is None else len(kf.des) for kf in keyframes], dtype=np.uint32)
+    pts = [kf.pts[:n] for kf, n in zip(keyframes, counts) if n]
+    des = [kf.des for kf, n in zip(keyframes, counts) if n]
+    return KeyframeRows(np.array([kf.pose for kf in keyframes], dtype=np.float32).T, counts,
+                        np.concatenate(pts) if pts else np.empty((0, 2), dtype=np.float32),
+                        np.concatenate(des) if des else np.empty((0, DESCRIPTOR_SIZE), dtype=np.uint8))
+
+# Binary map export (see export_map_binary), little-endian:
+#   u16 version, u16 header length, u32 epoch, u32 trajectory epoch,
+#   u32 flags (bit 0: resync, bit 1: trajectory resync),
+#   u32 first point sequence number, u32 point count,
+#   u32 first trajectory sequence number, u32 trajectory count,
+#   u32 point revision, u32 updated point count,
+# followed by the points and then the trajectory as float32 (x, y, z) rows,
+# then the sequence numbers of the updated points as u32 and their new
+# values as float32 (x, y, z) rows
+MAP_HEADER = struct.Struct('<HHIIIIIIIII')
+MAP_HEADER_VERSION = 3
+MAP_FLAG_RESYNC = 1
+MAP_FLAG_TRAJECTORY_RESYNC = 2
+
+# Simplified trajectory export (see export_trajectory), little-endian:
+#   u16 version, u16 header length, u32 epoch, u32 trajectory epoch,
+#   u32 trajectory count, u32 point count,
+#   f32 tolerance (map units, 0 for the full trajectory),
+# followed by the kept poses as float32 (x, y, z) rows
+TRAJECTORY_HEADER = struct.Struct('<HHIIIIf')
+TRAJECTORY_HEADER_VERSION = 2
 
 class SLAM:
-    def __init__(self, camera=None, use_imu=True):
+    TRACKING_MODES = Frontend.TRACKING_MODES
+    FRONTEND_MODES = ('thread', 'process')
+    
+    def __init__(self, camera=None, use_imu=True, matcher='bf', tracking='orb', frontend='thread',
+                 target_fps=10, cpu_budget=0.5, map_dir='static/data/map',
+                 vocabulary='static/data/vocabulary.npz'):
+        if tracking not in self.TRACKING_MODES:
+            raise ValueError(f"Unknown tracking mode: {tracking}")
+        if frontend not in self.FRONTEND_MODES:
+            raise ValueError(f"Unknown frontend mode: {frontend}")
         self.camera = camera
         self.running = False
+        self.thread = None
         self.lock = threading.Lock()
-        self.map_data = {
-            'points': [],
-            'trajectory': []
-        }
+        # Map points merged per voxel (map units), bounded by evicting distant voxels
+        self.map_points = VoxelMap(voxel_size=0.05, capacity=100000)
+        # Map point and trajectory rows are only ever appended, so a row's
+        # index is its sequence number; reset() and point eviction start a
+        # new epoch and numbering restarts. Point merges refine rows in
+        # place: map_points.tick is the point revision and changed() lists
+        # the rows a client or the journal has to be sent again. Loop
+        # closure rewrites the trajectory alone and starts a new
+        # trajectory epoch; point cursors stay valid
+        self.map_epoch = 0
+        self.trajectory_epoch = 0
+        # 2D occupancy grid for navigation, fed from keyframe poses and map points
+        self.grid = OccupancyGrid(resolution=0.05)
         self.current_position = [0, 0, 0]  # x, y, z
         self.current_orientation = [0, 0, 0]  # roll, pitch, yaw
         
-        # Path to save map data
-        self.map_file = 'static/data/map_data.json'
-        os.makedirs(os.path.dirname(self.map_file), exist_ok=True)
+        # Map persistence: snapshot plus append-only journal in map_dir
+        # (None disables saving). The previous session's map is loaded at
+        # startup; (epoch, trajectory, points, keyframes, point revision,
+        # trajectory epoch) up to _journaled are saved.
+        self.journal = MapJournal(map_dir) if map_dir else None
+        self._journal_lock = threading.Lock()
+        self._journaled = (0, 0, 0, 0, 0, 0)
+        # Appends, fsyncs and compactions run on a writer thread, batched
+        # every persist_keyframes keyframes or persist_interval seconds
+        self.persist_interval = 2.0
+        self.persist_keyframes = 10
+        self._persist_event = threading.Event()
+        self.writer = None
+        
+        # After loading a map the pose is unknown until a frame matches one
+        # of its keyframes; the map is not extended until then
+        self._relocalizing = False
+        self.keyframe_index = None
+        self.reloc_matcher = create_matcher('bf')
+        self.reloc_attempts = 0
+        self.reloc_max_attempts = 30    # frames before giving up on the saved map
+        self.reloc_min_inliers = 25
+        self.reloc_candidates = 3
+        
+        # Visual frontend (motion estimation and keyframe selection, see
+        # slam_frontend.py), run in this thread or in its own process
+        self.tracking = tracking
+        self.frontend_mode = frontend
+        if frontend == 'process':
+            self.frontend = FrontendProcess(tracking, matcher)
+        else:
+            self.frontend = Frontend(tracking, matcher)
+        self._reset_frontend = False
+        
+        # Paces the processing loop and degrades the frontend under load
+        self.scheduler = SlamScheduler(target_fps, cpu_budget)
+        self.scale = self.scheduler.settings.scale
+        self.frontend.set_max_features(self.scheduler.settings.features)
+        
+        self.features_detected = 0
+        self.last_inliers = 0
+        self.frames_skipped = 0
         
-        # Initialize ORB feature detector (as a simplified stand-in for ORB-SLAM3)
-        self.orb = cv2.ORB_create()
-        self.prev_frame = None
-        self.prev_kp = None
-        self.prev_des = None
+        # Only keyframes extend the trajectory and keep their descriptors;
+        # the frontend also asks for one once the pose moved kf_min_translation
+        self.keyframes = []
+        self.kf_min_translation = 0.2   # map units
+        # Map units per pixel of image motion (adjust based on your environment)
+        self.motion_scale = 0.01
         
-        # For trajectory tracking
-        self.trajectory = []
+        # For trajectory tracking: one row per keyframe, t is seconds since
+        # the session started (float32 keeps ms precision for hours)
+        self.trajectory = ArrayStore(('t', 'x', 'y', 'z'))
+        # Douglas-Peucker tiers of the trajectory for clients that can't
+        # draw every pose, extended as keyframes arrive
+        self.trajectory_lod = TrajectoryLOD(tolerances=(0.05, 0.2, 1.0))
+        self.t0 = time.monotonic()
+        self.frames_processed = 0
+        
+        # Recent poses keyed by the capture time of the frame they came from,
+        # so video frames can be tagged with the pose at capture time
+        self.pose_history = deque(maxlen=256)
         
         # Initialize IMU if available and requested
         self.use_imu = use_imu
@@ -53,6 +172,21 @@ class SLAM:
                 print("IMU hardware not detected, falling back to camera-only SLAM")
         else:
             print("IMU usage disabled by configuration, using camera-only SLAM")
+        # IMU yaw minus map yaw
+        self.imu_yaw_offset = 0.0
+        
+        # Loop closure needs a vocabulary trained offline (train_vocabulary.py)
+        self.loop_closer = None
+        if vocabulary and os.path.exists(vocabulary):
+            try:
+                self.loop_closer = LoopCloser(self, Vocabulary.load(vocabulary))
+                print(f"Loaded vocabulary: {len(self.loop_closer.vocabulary)} words")
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Error loading vocabulary: {e}")
+        elif vocabulary:
+            print(f"No vocabulary at {vocabulary}, loop closure disabled")
+        
+        self._load_map()
     
     def start(self):
         """Start the SLAM processing thread"""
@@ -74,10 +208,17 @@ class SLAM:
                 self.imu_available = False
                 print("Falling back to camera-only SLAM")
         
+        if self.loop_closer is not None:
+            self.loop_closer.start()
+        
         self.running = True
         self.thread = threading.Thread(target=self._process_loop)
         self.thread.daemon = True
         self.thread.start()
+        if self.journal is not None:
+            self.writer = threading.Thread(target=self._writer_loop)
+            self.writer.daemon = True
+            self.writer.start()
     
     def stop(self):
         """Stop the SLAM processing thread"""
@@ -93,22 +234,46 @@ class SLAM:
             except Exception as e:
                 print(f"Error stopping IMU: {e}")
         
+        if self.frontend_mode == 'process':
+            self.frontend.close()
+        if self.loop_closer is not None:
+            self.loop_closer.stop()
+        
         # Save the final map data
-        self._save_map_data()
+        if self.writer:
+            self._persist_event.set()
+            self.writer.join()
+            self.writer = None
+        self._persist_map()
+        if self.journal is not None:
+            self.journal.close()
     
     def _process_loop(self):
         """SLAM processing loop running in a separate thread"""
+        last_frame_id = 0
         while self.running:
-            # Get the current frame from the camera
-            with self.camera.lock:
-                if self.camera.frame is None:
-                    time.sleep(0.01)
-                    continue
-                
-                frame = self.camera.frame.copy()
+            cost = None
+            # Block until the camera publishes a frame we haven't processed yet.
+            # With gray=True it arrives converted (decoded straight to gray in
+            # MJPEG mode) out of the ring buffer, so the ring slot is given
+            # back at once rather than held while the frame is processed
+            frame_id, frame = self.camera.acquire_frame(last_frame_id, timeout=0.5, gray=True)
+            if frame is None:
+                continue
+            self.camera.release_frame(frame_id)
+            gap = frame_id - last_frame_id - 1 if last_frame_id else 0
+            last_frame_id = frame_id
+            capture_time = self.camera.get_capture_time(frame_id)
+            # Frames that waited too long are dropped, never queued
+            if not self.scheduler.frame_arrived(gap, capture_time):
+                continue
             
             # Process the frame with ORB-SLAM (simplified version)
-            self._process_frame(frame)
+            start = time.perf_counter()
+            self._process_frame(frame, capture_time)
+            cost = time.perf_counter() - start
+            self.frames_processed += 1
+            self._record_pose(capture_time)
             
             # Update orientation from IMU if available
             if self.imu_available:
@@ -121,117 +286,354 @@ class SLAM:
                     self.imu_available = False
                     print("IMU disconnected, falling back to camera-only SLAM")
             
-            # Sleep to reduce CPU usage
-            time.sleep(0.05)
+            if cost is None:
+                continue
+            if self.scheduler.record(cost):
+                self._apply_level()
+            # Rest long enough to hold the target rate and the CPU budget
+            time.sleep(self.scheduler.delay(cost))
+    
+    def _apply_level(self):
+        """Switch the frontend to the scheduler's current degradation level"""
+        level = self.scheduler.settings
+        print(f"SLAM level: {level.name} ({level.features} features, scale {level.scale})")
+        self.frontend.set_max_features(level.features)
+        if level.scale != self.scale:
+            # 分辨率变化后旧的跟踪点坐标失效，重新开始跟踪
+            self.scale = level.scale
+            self._reset_frontend = True
     
-    def _process_frame(self, frame):
-        """Process a frame with ORB features (simplified SLAM)"""
+    def _process_frame(self, frame, capture_time=None):
+        """Process a frame with ORB features (simplified SLAM)
+        
+        Returns True if the frame became a keyframe.
+        """
         # Convert to grayscale
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self.scale != 1.0:
+            gray = cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
         
-        # Detect ORB features
-        kp, des = self.orb.detectAndCompute(gray, None)
+        if self._reset_frontend:
+            # 前端只在 SLAM 线程中访问（进程模式下管道只能有一个写者）
+            self._reset_frontend = False
+            self.frontend.reset()
         
-        if self.prev_frame is not None and self.prev_kp is not None and self.prev_des is not None:
-            # Match features
-            bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-            matches = bf.match(self.prev_des, des)
+        # 重定位期间每帧都计算 ORB 描述子
+        force_keyframe = self._relocalizing or self._moved_since_keyframe()
+        result = self.frontend.process(gray, self._turn_rate(), force_keyframe)
+        self.features_detected = result.detections
+        self.last_inliers = result.inliers
+        if result.skipped:
+            self.frames_skipped += 1
+            return False
+        
+        if self._relocalizing:
+            if not (result.keyframe and self._relocalize(result.pts, result.des)):
+                return False
+            self._add_keyframe(result.pts, result.des, capture_time)
+            self._request_persist()
+            return True
+        
+        if result.motion is not None:
+            dx, dy, da = result.motion
+            # Motion is measured on the possibly downscaled frame
+            self._apply_motion(dx / self.scale, dy / self.scale, da)
+        if result.keyframe:
+            self._add_keyframe(result.pts, result.des, capture_time)
+            # The map only changes on keyframes; journal the new rows
+            self._request_persist()
+        return result.keyframe
+    
+    def _turn_rate(self):
+        """Absolute yaw rate from the IMU gyro in deg/s, 0 without an IMU"""
+        if not self.imu_available:
+            return 0.0
+        try:
+            return abs(self.imu.get_angular_velocity()[2])
+        except Exception as e:
+            print(f"Error getting IMU angular velocity: {e}")
+            self.imu_available = False
+            return 0.0
+    
+    def _moved_since_keyframe(self):
+        """Has the pose moved far enough from the last keyframe to need a new one?"""
+        # 回环线程会在锁内替换关键帧位姿和当前位姿，两者要在同一次加锁中读取
+        with self.lock:
+            if not self.keyframes:
+                return False
+            x, y, _, _ = self.keyframes[-1].pose
+            return np.hypot(self.current_position[0] - x,
+                            self.current_position[1] - y) >= self.kf_min_translation
+    
+    def _add_keyframe(self, pts, des, capture_time=None):
+        """Store a keyframe and extend the trajectory and map from it"""
+        if capture_time is None:
+            capture_time = time.monotonic()
+        points = None
+        with self.lock:
+            pose = (*self.current_position, self.current_orientation[2])
+            previous = self.keyframes[-1].pose if self.keyframes else pose
+            keyframe = Keyframe(self.frames_processed, pose, pts, des)
+            self.keyframes.append(keyframe)
+            if self.loop_closer is not None:
+                self.loop_closer.add_keyframe(len(self.keyframes) - 1,
+                                              previous if len(self.keyframes) > 1 else None, keyframe)
             
-            # Sort matches by distance
-            matches = sorted(matches, key=lambda x: x.distance)
+            # Add to trajectory
+            self.trajectory.append(capture_time - self.t0, *self.current_position)
+            self.trajectory_lod.update(self.trajectory.view()[1:])
             
-            # Use top matches to estimate motion
-            if len(matches) > 10:
-                # Extract matched keypoints
-                prev_pts = np.float32([self.prev_kp[m.queryIdx].pt for m in matches[:10]])
-                curr_pts = np.float32([kp[m.trainIdx].pt for m in matches[:10]])
+            # Add some random 3D points (in a real system, these would be actual 3D points)
+            if np.random.random() < 0.1:
+                points = np.random.normal(0, 1, (5, 3)) * (0.5, 0.5, 0.2)
+                points[:, :2] += self.current_position[:2]
+                generation = self.map_points.generation
+                self.map_points.extend(points)
+                if self.map_points.generation != generation:
+                    # 淘汰远处体素后点的序号重排，客户端需要重新同步
+                    self.map_epoch += 1
+        
+        # The path driven since the last keyframe is free space; rays to
+        # the new points mark free space up to an obstacle
+        self.grid.update(previous[:2], [pose[:2]], hit=False)
+        if points is not None:
+            self.grid.update(pose[:2], points[:, :2])
+    
+    def _apply_motion(self, dx, dy, da):
+        """Integrate an image-space motion estimate into the current pose"""
+        # Get IMU data if available
+        imu_orientation = None
+        if self.imu_available:
+            try:
+                imu_orientation = self.imu.get_orientation()
+            except Exception as e:
+                print(f"Error getting IMU orientation during motion estimation: {e}")
+                self.imu_available = False
+        
+        # Update position (simplified)
+        with self.lock:
+            # If IMU is available, use it to improve motion estimation
+            if imu_orientation:
+                roll, pitch, yaw = imu_orientation
                 
-                # Estimate rigid transformation
-                if len(prev_pts) >= 4 and len(curr_pts) >= 4:
-                    # This is a simplified motion estimation
-                    # In a real ORB-SLAM3 implementation, this would be much more sophisticated
-                    M, _ = cv2.estimateAffinePartial2D(prev_pts, curr_pts)
-                    
-                    if M is not None:
-                        # Extract translation
-                        dx = M[0, 2]
-                        dy = M[1, 2]
-                        
-                        # Extract rotation (simplified)
-                        da = np.arctan2(M[1, 0], M[0, 0])
-                        
-                        # Get IMU data if available
-                        imu_orientation = None
-                        if self.imu_available:
-                            try:
-                                imu_orientation = self.imu.get_orientation()
-                            except Exception as e:
-                                print(f"Error getting IMU orientation during motion estimation: {e}")
-                                self.imu_available = False
-                        
-                        # Update position (simplified)
-                        with self.lock:
-                            # If IMU is available, use it to improve motion estimation
-                            if imu_orientation:
-                                roll, pitch, yaw = imu_orientation
-                                
-                                # Use IMU yaw to improve rotation estimation
-                                # This is a simplified fusion - a real implementation would use a Kalman filter
-                                da = 0.7 * da + 0.3 * (np.radians(yaw) - np.radians(self.current_orientation[2]))
-                                
-                                # Update orientation
-                                self.current_orientation = [roll, pitch, np.degrees(np.radians(self.current_orientation[2]) + da)]
-                            else:
-                                # Without IMU, just use visual estimation
-                                self.current_orientation[2] += np.degrees(da)
-                            
-                            # Calculate movement in world coordinates based on current orientation
-                            angle_rad = np.radians(self.current_orientation[2])
-                            dx_world = dx * np.cos(angle_rad) - dy * np.sin(angle_rad)
-                            dy_world = dx * np.sin(angle_rad) + dy * np.cos(angle_rad)
-                            
-                            # Scale factor (adjust based on your environment)
-                            scale = 0.01
-                            
-                            self.current_position[0] += dx_world * scale
-                            self.current_position[1] += dy_world * scale
-                            
-                            # Add to trajectory
-                            self.trajectory.append(self.current_position.copy())
-                            
-                            # Update map data
-                            self.map_data['trajectory'] = self.trajectory
-                            
-                            # Add some random 3D points (in a real system, these would be actual 3D points)
-                            if len(self.map_data['points']) < 1000 and np.random.random() < 0.1:
-                                for _ in range(5):
-                                    point = [
-                                        self.current_position[0] + np.random.normal(0, 0.5),
-                                        self.current_position[1] + np.random.normal(0, 0.5),
-                                        np.random.normal(0, 0.2)
-                                    ]
-                                    self.map_data['points'].append(point)
-        
-        # Save current frame and keypoints for next iteration
-        self.prev_frame = gray
-        self.prev_kp = kp
-        self.prev_des = des
-        
-        # Periodically save map data
-        if np.random.random() < 0.05:  # Save roughly every 20 frames
-            self._save_map_data()
+                # Use IMU yaw to improve rotation estimation
+                # This is a simplified fusion - a real implementation would use a Kalman filter
+                da = 0.7 * da + 0.3 * (np.radians(yaw - self.imu_yaw_offset) - np.radians(self.current_orientation[2]))
+                
+                # Update orientation
+                self.current_orientation = [roll, pitch, np.degrees(np.radians(self.current_orientation[2]) + da)]
+            else:
+                # Without IMU, just use visual estimation
+                self.current_orientation[2] += np.degrees(da)
+            
+            # Calculate movement in world coordinates based on current orientation
+            angle_rad = np.radians(self.current_orientation[2])
+            dx_world = dx * np.cos(angle_rad) - dy * np.sin(angle_rad)
+            dy_world = dx * np.sin(angle_rad) + dy * np.cos(angle_rad)
+            
+            self.current_position[0] += dx_world * self.motion_scale
+            self.current_position[1] += dy_world * self.motion_scale
     
-    def _save_map_data(self):
-        """Save the current map data to a JSON file"""
+    def _map_snapshot(self):
+        """O(1) read-only views of the map points (3, N) and trajectory (4, M)"""
         with self.lock:
-            # Convert numpy arrays to lists for JSON serialization
-            data = {
-                'points': [[float(x), float(y), float(z)] for x, y, z in self.map_data['points']],
-                'trajectory': [[float(x), float(y), float(z)] for x, y, z in self.map_data['trajectory']]
-            }
+            return self.map_points.view(), self.trajectory.view()
+    
+    def _load_map(self):
+        """Resume the map saved by the previous session, if any"""
+        if self.journal is None:
+            return
+        try:
+            epoch, trajectory, points, keyframes = self.journal.load()
+        except (OSError, ValueError) as e:
+            print(f"Error loading map data: {e}")
+            self.reset()
+            return
+        
+        self.map_epoch = epoch
+        self.trajectory.extend(trajectory.T)
+        self.trajectory_lod.update(self.trajectory.view()[1:])
+        self.map_points.extend(points.T)
+        for rows in keyframes:
+            ends = np.cumsum(rows.counts)
+            for i, end in enumerate(ends):
+                start = end - rows.counts[i]
+                # 描述子仍是快照文件的内存映射视图，不复制到内存
+                self.keyframes.append(Keyframe(-1, tuple(rows.poses[:, i].tolist()),
+                                               rows.pts[start:end], rows.des[start:end]))
+        self._journaled = (epoch, len(self.trajectory), len(self.map_points), len(self.keyframes),
+                           self.map_points.tick, self.trajectory_epoch)
+        if self.loop_closer is not None:
+            # 已保存的关键帧只建索引，不再互相检测回环
+            for i, kf in enumerate(self.keyframes):
+                self.loop_closer.add_keyframe(i, self.keyframes[i - 1].pose if i else None, kf, detect=False)
+        if len(self.map_points) != points.shape[1]:
+            # 体素参数变化导致点被合并，下次保存时写完整快照
+            self.map_epoch += 1
+        if not self.keyframes:
+            if len(self.trajectory) or len(self.map_points):
+                # 没有关键帧无法重定位，从新地图开始
+                self.reset()
+            return
+        
+        if trajectory.shape[1]:
+            # Trajectory timestamps carry on from the previous session
+            self.t0 -= float(trajectory[0, -1])
+        self.keyframe_index = KeyframeIndex(self.keyframes)
+        self._relocalizing = True
+        print(f"Loaded map: {len(self.keyframes)} keyframes, {len(self.map_points)} points, relocalizing")
+    
+    def _relocalize(self, pts, des):
+        """Match a frame against the loaded keyframes and take up the pose it implies
+        
+        Returns True once relocalized. After reloc_max_attempts frames
+        without a match the saved map is abandoned and a new one started.
+        """
+        self.reloc_attempts += 1
+        best = None
+        for i, _ in self.keyframe_index.query(des, self.reloc_candidates):
+            kf = self.keyframes[i]
+            kf_idx, idx = self.reloc_matcher.match(kf.des, des)
+            if len(kf_idx) <= 10:
+                continue
+            M, inlier_mask = estimate_motion(kf.pts[kf_idx], pts[idx])
+            inliers = int(inlier_mask.sum())
+            if M is not None and inliers >= self.reloc_min_inliers and (best is None or inliers > best[0]):
+                best = (inliers, i, M)
+        
+        if best is None:
+            if self.reloc_attempts >= self.reloc_max_attempts:
+                print(f"Relocalization failed after {self.reloc_attempts} frames, starting a new map")
+                self.reset()
+            return False
+        
+        # The keyframe pose advanced by the image motion from the keyframe to this frame
+        inliers, i, M = best
+        x, y, z, yaw = self.keyframes[i].pose
+        dx, dy = M[0, 2] / self.scale, M[1, 2] / self.scale
+        yaw += np.degrees(np.arctan2(M[1, 0], M[0, 0]))
+        angle_rad = np.radians(yaw)
+        with self.lock:
+            self.current_position = [x + (dx * np.cos(angle_rad) - dy * np.sin(angle_rad)) * self.motion_scale,
+                                     y + (dx * np.sin(angle_rad) + dy * np.cos(angle_rad)) * self.motion_scale,
+                                     z]
+            self.current_orientation[2] = yaw
+            self._relocalizing = False
+            self.keyframe_index = None
+        if self.imu_available:
+            try:
+                # 之后的 IMU 航向以地图坐标系为准
+                self.imu_yaw_offset = self.imu.get_orientation()[2] - yaw
+            except Exception as e:
+                print(f"Error getting IMU orientation: {e}")
+                self.imu_available = False
+        print(f"Relocalized against keyframe {i} ({inliers} inliers) after {self.reloc_attempts} frames")
+        return True
+    
+    def _request_persist(self):
+        """Wake the writer thread once persist_keyframes keyframes are unsaved"""
+        if len(self.keyframes) - self._journaled[3] >= self.persist_keyframes:
+            self._persist_event.set()
+    
+    def _writer_loop(self):
+        """Journal the map in batches, off the SLAM thread"""
+        while self.running:
+            self._persist_event.wait(self.persist_interval)
+            self._persist_event.clear()
+            self._persist_map()
+    
+    def _persist_map(self):
+        """Append the map rows added or refined since the last call to the journal"""
+        if self.journal is None:
+            return
+        # 锁顺序：先 _journal_lock 再 lock
+        with self._journal_lock:
+            journaled_epoch, t_start, p_start, k_start, revision, trajectory_epoch = self._journaled
+            with self.lock:
+                epoch = self.map_epoch
+                # 回环校正改写了已写入日志的位姿，随本批一起重写
+                rewritten = self.trajectory_epoch != trajectory_epoch
+                trajectory_epoch = self.trajectory_epoch
+                trajectory = self.trajectory.view()
+                points = self.map_points.view()
+                keyframes = list(self.keyframes)
+                current_revision = self.map_points.tick
+                # 已写入日志的点被合并细化后要重写；合并是原地修改，在锁内复制
+                updated = self.map_points.changed(revision, p_start)
+                updated_points = points[:, updated].copy()
+            if (epoch == journaled_epoch and trajectory.shape[1] == t_start and points.shape[1] == p_start
+                    and len(keyframes) == k_start and not len(updated) and not rewritten):
+                return
+            earlier_trajectory = earlier_poses = None
+            if rewritten:
+                earlier_trajectory = trajectory[:, :t_start]
+                earlier_poses = np.array([kf.pose for kf in keyframes[:k_start]],
+                                         dtype=np.float32).reshape(-1, 4).T
+            try:
+                # 序号重排后日志无法续写，直接写完整快照
+                if epoch != journaled_epoch or self.journal.append(
+                        epoch, t_start, trajectory[:, t_start:], p_start, points[:, p_start:],
+                        k_start, _keyframe_rows(keyframes[k_start:]), updated, updated_points,
+                        earlier_trajectory, earlier_poses):
+                    self.journal.compact(epoch, trajectory, points, _keyframe_rows(keyframes))
+                self._journaled = (epoch, trajectory.shape[1], points.shape[1], len(keyframes),
+                                   current_revision, trajectory_epoch)
+            except OSError as e:
+                print(f"Error saving map data: {e}")
+    
+    def correct_poses(self, poses, generation):
+        """Take up loop-corrected poses for the first len(poses) keyframes
+        
+        poses are (x, y, yaw radians) rows from the loop closer, computed
+        for keyframe generation generation. Keyframes added since, and the
+        current pose, move rigidly with the last corrected keyframe. The
+        trajectory is rewritten from the keyframe poses, so a new
+        trajectory epoch starts: clients fetch the trajectory again and
+        the journal rewrites the saved poses. Map points and the occupancy
+        grid are not tied to keyframes and stay where they are. Returns
+        False if SLAM was reset in the meantime.
+        """
+        with self.lock:
+            if self.loop_closer is None or generation != self.loop_closer.generation \
+                    or len(poses) > len(self.keyframes):
+                return False
+            n = len(poses)
+            x, y, z, yaw = self.keyframes[n - 1].pose
+            nx, ny, nyaw = poses[n - 1]
+            turn = nyaw - np.radians(yaw)
+            c, s = np.cos(turn), np.sin(turn)
+            
+            def move(px, py, pyaw):
+                # 以最后一个被优化的关键帧为基准刚体变换
+                return (nx + c * (px - x) - s * (py - y), ny + s * (px - x) + c * (py - y),
+                        pyaw + np.degrees(turn))
             
-            with open(self.map_file, 'w') as f:
-                json.dump(data, f)
+            for k, kf in enumerate(self.keyframes):
+                if k < n:
+                    pose = (float(poses[k][0]), float(poses[k][1]), kf.pose[2], float(np.degrees(poses[k][2])))
+                else:
+                    px, py, pyaw = move(kf.pose[0], kf.pose[1], kf.pose[3])
+                    pose = (float(px), float(py), kf.pose[2], float(pyaw))
+                self.keyframes[k] = kf._replace(pose=pose)
+            px, py, pyaw = move(self.current_position[0], self.current_position[1], self.current_orientation[2])
+            self.current_position = [float(px), float(py), self.current_position[2]]
+            self.current_orientation[2] = float(pyaw)
+            self.imu_yaw_offset -= np.degrees(turn)
+            
+            # 每个关键帧对应一行轨迹（加载的旧地图可能有多出的早期行）
+            rows = self.trajectory.view().copy()
+            offset = rows.shape[1] - len(self.keyframes)
+            if offset >= 0:
+                rows[1, offset:] = [kf.pose[0] for kf in self.keyframes]
+                rows[2, offset:] = [kf.pose[1] for kf in self.keyframes]
+                self.trajectory.clear()
+                self.trajectory.extend(rows.T)
+                self.trajectory_lod.clear()
+                self.trajectory_lod.update(self.trajectory.view()[1:])
+            self.trajectory_epoch += 1
+        # 改写后的位姿交给写入线程追加
+        self._persist_event.set()
+        return True
     
     def get_position(self):
         """Get the current position and orientation"""
@@ -241,24 +643,208 @@ class SLAM:
                 'orientation': self.current_orientation.copy()
             }
     
-    def get_map_data(self):
-        """Get the current map data"""
+    def _record_pose(self, capture_time):
+        """Remember the pose estimated for a frame captured at capture_time"""
+        if capture_time is None:
+            return
         with self.lock:
-            return self.map_data.copy()
+            self.pose_history.append((capture_time, self.current_position[0],
+                                      self.current_position[1], self.current_position[2],
+                                      self.current_orientation[2]))
+    
+    def pose_at(self, capture_time):
+        """Get (x, y, z, yaw) as estimated for the newest frame captured at or before capture_time"""
+        with self.lock:
+            history = list(self.pose_history)
+            current = (*self.current_position, self.current_orientation[2])
+        if capture_time is None or not history:
+            return current
+        i = bisect.bisect_right([h[0] for h in history], capture_time)
+        # Frames SLAM hasn't processed yet get the latest known pose
+        return history[i - 1][1:] if i > 0 else history[0][1:]
+    
+    def get_stats(self):
+        """Processing statistics for the REST API"""
+        stats = self.scheduler.snapshot()
+        stats.update({
+            'tracking': self.tracking,
+            'frontend': self.frontend_mode,
+            'frames_processed': self.frames_processed,
+            'frames_skipped': self.frames_skipped,
+            'keyframes': len(self.keyframes),
+            'map_points': len(self.map_points),
+            'grid_tiles': len(self.grid),
+            'relocalizing': self._relocalizing,
+            'loop_closures': self.loop_closer.loops if self.loop_closer is not None else None,
+            'loop_corrections': self.loop_closer.corrections if self.loop_closer is not None else None,
+            'orb_runs': self.features_detected,
+            'inliers': self.last_inliers,
+        })
+        return stats
+    
+    def _delta_snapshot(self, epoch, points_from, trajectory_from, revision=0, trajectory_epoch=0):
+        """The map rows past a client cursor, falling back to a full resync
+        
+        Returns (epoch, trajectory epoch, resync, trajectory resync,
+        points_from, new points, trajectory_from, new trajectory rows,
+        point revision, updated rows, their points). New rows are views;
+        points below points_from refined since the client's revision are
+        listed as updated, copied under the lock as merges write them in
+        place. A trajectory from another trajectory epoch is sent again
+        from row 0 while the points carry on. A trajectory_from of None
+        skips the trajectory rows; the cursor then points at the end of
+        the trajectory.
+        """
+        revision = revision or 0
+        skip_trajectory = trajectory_from is None
+        with self.lock:
+            points = self.map_points.view()
+            trajectory = self.trajectory.view()
+            current_epoch = self.map_epoch
+            current_trajectory_epoch = self.trajectory_epoch
+            current_revision = self.map_points.tick
+            resync = (epoch != current_epoch or not 0 <= points_from <= points.shape[1]
+                      or not 0 <= revision <= current_revision)
+            trajectory_resync = not skip_trajectory and (
+                resync or trajectory_epoch != current_trajectory_epoch
+                or not 0 <= trajectory_from <= trajectory.shape[1])
+            if resync:
+                points_from = 0
+            if trajectory_resync:
+                trajectory_from = 0
+            updated = self.map_points.changed(revision, points_from)
+            updated_points = points[:, updated].copy()
+        if skip_trajectory:
+            # 轨迹由 export_trajectory 按精度分级提供
+            trajectory_from = trajectory.shape[1]
+        return (current_epoch, current_trajectory_epoch, resync, trajectory_resync,
+                points_from, points[:, points_from:], trajectory_from, trajectory[1:, trajectory_from:],
+                current_revision, updated, updated_points)
+    
+    def map_version(self):
+        """(epoch, trajectory epoch, point revision, point count, trajectory count)
+        
+        Changes whenever the map does.
+        """
+        with self.lock:
+            return (self.map_epoch, self.trajectory_epoch, self.map_points.tick,
+                    len(self.map_points), len(self.trajectory))
+    
+    def get_map_delta(self, epoch=None, points_from=0, trajectory_from=0, revision=0, trajectory_epoch=0):
+        """Map rows added or refined since a client cursor, plus the current pose
+        
+        The cursor is (epoch, number of points seen, number of trajectory
+        rows seen, point revision, trajectory epoch) as returned in the
+        previous response. Points the client already has that merges
+        refined since come back under 'updated' by sequence number. If the
+        epoch changed (the map was reset) or the cursor is unknown, the
+        response has resync set and carries the whole map from sequence
+        number 0. If only the trajectory epoch changed (a loop closure),
+        trajectory_resync is set and only the trajectory starts over.
+        """
+        (epoch, trajectory_epoch, resync, trajectory_resync, points_from, points,
+         trajectory_from, trajectory, revision, updated, updated_points) = \
+            self._delta_snapshot(epoch, points_from, trajectory_from, revision, trajectory_epoch)
+        position = self.get_position()
+        return {
+            'epoch': epoch,
+            'resync': resync,
+            'trajectory_resync': trajectory_resync,
+            'points': {'start': points_from, 'data': points.T.tolist()},
+            'trajectory': {'start': trajectory_from, 'data': trajectory.T.tolist()},
+            'updated': {'rows': updated.tolist(), 'data': updated_points.T.tolist()},
+            'cursor': {'epoch': epoch, 'points': points_from + points.shape[1],
+                       'trajectory': trajectory_from + trajectory.shape[1], 'revision': revision,
+                       'trajectory_epoch': trajectory_epoch},
+            'position': position['position'],
+            'orientation': position['orientation'],
+        }
+    
+    def export_map_binary(self, epoch=None, points_from=0, trajectory_from=0, revision=0, trajectory_epoch=0):
+        """Map rows past a client cursor as a MAP_HEADER plus float32 (x, y, z) rows
+        
+        Same cursor and resync rules as get_map_delta(); trajectory_from
+        None leaves out the trajectory (see export_trajectory). Returns
+        (map version, bytes) where the version is that of map_version().
+        """
+        (epoch, trajectory_epoch, resync, trajectory_resync, points_from, points,
+         trajectory_from, trajectory, revision, updated, updated_points) = \
+            self._delta_snapshot(epoch, points_from, trajectory_from, revision, trajectory_epoch)
+        flags = (MAP_FLAG_RESYNC if resync else 0) | (MAP_FLAG_TRAJECTORY_RESYNC if trajectory_resync else 0)
+        header = MAP_HEADER.pack(MAP_HEADER_VERSION, MAP_HEADER.size, epoch, trajectory_epoch, flags,
+                                 points_from, points.shape[1], trajectory_from, trajectory.shape[1],
+                                 revision, len(updated))
+        # 转置视图按行序输出即为交错的 xyz
+        body = (points.T.astype('<f4', copy=False).tobytes() + trajectory.T.astype('<f4', copy=False).tobytes()
+                + updated.astype('<u4').tobytes() + updated_points.T.astype('<f4').tobytes())
+        version = (epoch, trajectory_epoch, revision, points_from + points.shape[1],
+                   trajectory_from + trajectory.shape[1])
+        return version, header + body
+    
+    def trajectory_version(self):
+        """(epoch, trajectory epoch, trajectory count); changes whenever the trajectory does"""
+        with self.lock:
+            return self.map_epoch, self.trajectory_epoch, len(self.trajectory)
+    
+    def export_trajectory(self, tolerance=None, budget=None):
+        """The trajectory simplified for a client, as a TRAJECTORY_HEADER plus float32 (x, y, z) rows
+        
+        tolerance is the largest deviation from the full trajectory the
+        client accepts (map units) and budget the most poses it wants;
+        see TrajectoryLOD.select(). When even the coarsest tier is over
+        budget it is simplified further on the spot. Returns
+        (trajectory version, bytes).
+        """
+        with self.lock:
+            epoch = self.map_epoch
+            trajectory_epoch = self.trajectory_epoch
+            trajectory = self.trajectory.view()
+            tolerance, indices = self.trajectory_lod.select(tolerance, budget)
+        poses = trajectory[1:, indices].T
+        if budget is not None and len(poses) > budget:
+            tolerance, keep = fit(poses, tolerance, max(budget, 2))
+            poses = poses[keep]
+        header = TRAJECTORY_HEADER.pack(TRAJECTORY_HEADER_VERSION, TRAJECTORY_HEADER.size, epoch,
+                                        trajectory_epoch, trajectory.shape[1], len(poses), tolerance)
+        return (epoch, trajectory_epoch, trajectory.shape[1]), header + poses.astype('<f4', copy=False).tobytes()
+    
+    def get_map_data(self):
+        """Get the current map data as lists of [x, y, z]"""
+        points, trajectory = self._map_snapshot()
+        return {
+            'points': points.T.tolist(),
+            'trajectory': trajectory[1:].T.tolist(),
+        }
     
     def reset(self):
-        """Reset the SLAM system"""
+        """Reset the SLAM system
+        
+        The new epoch is saved as an empty snapshot, by the writer thread
+        while it runs.
+        """
+        self._reset_state()
+        if self.writer:
+            self._persist_event.set()
+        else:
+            self._persist_map()
+    
+    def _reset_state(self):
         with self.lock:
-            self.map_data = {
-                'points': [],
-                'trajectory': []
-            }
+            self.map_points.clear()
             self.current_position = [0, 0, 0]
             self.current_orientation = [0, 0, 0]
-            self.trajectory = []
-            self.prev_frame = None
-            self.prev_kp = None
-            self.prev_des = None
+            self.trajectory.clear()
+            self.trajectory_lod.clear()
+            self.t0 = time.monotonic()
+            self.map_epoch += 1
+            self.pose_history.clear()
+            self.keyframes = []
+            self.grid.clear()
+            self._reset_frontend = True
+            self._relocalizing = False
+            self.keyframe_index = None
+            if self.loop_closer is not None:
+                self.loop_closer.reset()
             
             # Reset IMU yaw if available
             if self.imu_available:
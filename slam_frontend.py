@@ -0,0 +1,310 @@
+import multiprocessing
+from collections import namedtuple
+from multiprocessing import resource_tracker, shared_memory
+
+import cv2
+import numpy as np
+
+from feature_matcher import create_matcher, estimate_motion, keypoint_coords
+
+# Outcome of one frame:
+#   motion      image motion (dx, dy, da) since the last processed frame, or None
+#   keyframe    whether the frame became a keyframe; pts/des are its ORB
+#               keypoints and descriptors (None otherwise)
+#   skipped     frame was redundant and not processed at all
+#   inliers     RANSAC inliers of the motion fit
+#   detections  running count of ORB detections
+FrontendResult = namedtuple('FrontendResult', ['motion', 'keyframe', 'pts', 'des', 'skipped',
+                                               'inliers', 'detections'])
+
+
+class Frontend:
+    """Visual SLAM frontend: frame-to-frame motion and keyframe selection
+
+    Holds only image-side state, so it can run inside the SLAM thread or,
+    wrapped in FrontendProcess, in a process of its own. Pose, IMU fusion
+    and the map stay in SLAM.
+
+    tracking='orb' matches ORB features on every frame; 'klt' runs ORB only
+    on keyframes and tracks the points with optical flow between them.
+    """
+
+    TRACKING_MODES = ('orb', 'klt')
+    # 冗余帧检测用的缩略图尺寸
+    THUMB_SIZE = (32, 24)
+
+    def __init__(self, tracking='orb', matcher='bf'):
+        if tracking not in self.TRACKING_MODES:
+            raise ValueError(f"Unknown tracking mode: {tracking}")
+        self.tracking = tracking
+        # Initialize ORB feature detector (as a simplified stand-in for ORB-SLAM3)
+        self.orb = cv2.ORB_create()
+        # Persistent descriptor matcher: 'bf', 'flann' or 'grid' (see bench_slam.py)
+        self.matcher = create_matcher(matcher)
+
+        # 只跟踪响应最强的 max_tracked 个点，少于 min_tracked 时重新检测
+        self.max_tracked = 200
+        self.min_tracked = 80
+        self.min_track_quality = 0.6
+        self.lk_win_size = (15, 15)
+        self.lk_max_level = 2
+        self.lk_criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03)
+
+        # Keyframe selection: a frame becomes a keyframe once the view moved
+        # far enough from the last keyframe or the gyro reports a fast turn.
+        # Frames that barely differ from the last processed one while the
+        # gyro is still are skipped outright.
+        self.kf_min_parallax = 20.0     # pixels of image motion
+        self.kf_min_rotation = 5.0      # degrees
+        self.kf_turn_rate = 30.0        # deg/s
+        self.idle_diff = 2.0            # mean grey-level change of the thumbnail
+        self.idle_turn_rate = 2.0       # deg/s
+
+        self.features_detected = 0
+        self.last_inliers = 0
+        self.reset()
+
+    def set_max_features(self, count):
+        self.orb.setMaxFeatures(count)
+
+    def reset(self):
+        self.prev_frame = None
+        self.prev_thumb = None
+        self.prev_pts = None
+        self.prev_des = None
+        self.has_keyframe = False
+        self._kf_motion = [0.0, 0.0, 0.0]
+
+    def process(self, gray, turn_rate=0.0, force_keyframe=False):
+        """Process one grayscale frame, returns a FrontendResult
+
+        turn_rate is the gyro yaw rate in deg/s; force_keyframe lets the
+        caller request a keyframe, e.g. when the pose moved far enough.
+        """
+        # Cheap redundancy check before any feature work: while the car idles
+        # the view and the gyro barely change, so the pose simply carries over
+        thumb = cv2.resize(gray, self.THUMB_SIZE, interpolation=cv2.INTER_AREA)
+        if (self.prev_thumb is not None and not force_keyframe and turn_rate < self.idle_turn_rate
+                and cv2.norm(thumb, self.prev_thumb, cv2.NORM_L1) / thumb.size < self.idle_diff):
+            return FrontendResult(None, False, None, None, True, self.last_inliers, self.features_detected)
+
+        if self.tracking == 'klt':
+            motion, lost = self._track_klt(gray)
+        else:
+            motion, lost = self._track_orb(gray)
+        if motion is not None:
+            # Image motion since the last keyframe, for keyframe selection
+            self._kf_motion[0] += motion[0]
+            self._kf_motion[1] += motion[1]
+            self._kf_motion[2] += motion[2]
+
+        keyframe = lost or force_keyframe or self._needs_keyframe(turn_rate)
+        pts = des = None
+        if keyframe:
+            if self.tracking == 'klt':
+                # KLT 模式下关键帧才计算 ORB 描述子，并以其重新播种跟踪点
+                pts, des = self._detect_features(gray)
+                self.prev_pts = pts[:self.max_tracked]
+                self.prev_des = des
+            else:
+                pts, des = self.prev_pts, self.prev_des
+            self.has_keyframe = True
+            self._kf_motion = [0.0, 0.0, 0.0]
+
+        # Save current frame for next iteration
+        self.prev_frame = gray
+        self.prev_thumb = thumb
+        return FrontendResult(motion, keyframe, pts, des, False, self.last_inliers, self.features_detected)
+
+    def _detect_features(self, gray):
+        """ORB keypoints (strongest first) and descriptors"""
+        kp, des = self.orb.detectAndCompute(gray, None)
+        self.features_detected += 1
+        if des is None:
+            return keypoint_coords(()), None
+        order = np.argsort([-k.response for k in kp], kind='stable')
+        return keypoint_coords(kp)[order], des[order]
+
+    def _track_orb(self, gray):
+        """Estimate motion by matching ORB features against the previous frame
+
+        Returns ((dx, dy, da) or None, lost).
+        """
+        # Detect ORB features
+        pts, des = self._detect_features(gray)
+        motion = None
+
+        if self.prev_frame is not None and self.prev_pts is not None and self.prev_des is not None:
+            # Match features with the persistent matcher (ratio-tested index arrays)
+            prev_idx, curr_idx = self.matcher.match(self.prev_des, des, self.prev_pts, pts)
+
+            if len(prev_idx) > 10:
+                # This is a simplified motion estimation
+                # In a real ORB-SLAM3 implementation, this would be much more sophisticated
+                M, inlier_mask = estimate_motion(self.prev_pts[prev_idx], pts[curr_idx])
+                self.last_inliers = int(inlier_mask.sum())
+
+                if M is not None:
+                    # Extract translation
+                    dx = M[0, 2]
+                    dy = M[1, 2]
+
+                    # Extract rotation (simplified)
+                    da = np.arctan2(M[1, 0], M[0, 0])
+
+                    motion = (dx, dy, da)
+
+        # Save keypoints for next iteration
+        self.prev_pts = pts
+        self.prev_des = des
+        return motion, motion is None
+
+    def _track_klt(self, gray):
+        """Track the last keyframe's ORB features with pyramidal Lucas-Kanade flow
+
+        ORB is only run on keyframes, which are forced when too few points
+        survive tracking or the motion fit gets poor; every other frame
+        costs only a sparse flow solve. Returns ((dx, dy, da) or None, lost).
+        """
+        if (self.prev_frame is None or self.prev_frame.shape != gray.shape
+                or self.prev_pts is None or len(self.prev_pts) <= 10):
+            return None, True
+
+        curr, status, _ = cv2.calcOpticalFlowPyrLK(
+            self.prev_frame, gray, self.prev_pts.reshape(-1, 1, 2), None,
+            winSize=self.lk_win_size, maxLevel=self.lk_max_level, criteria=self.lk_criteria)
+        tracked = status.ravel() == 1
+        prev_pts = self.prev_pts[tracked]
+        curr_pts = curr.reshape(-1, 2)[tracked]
+
+        M, inlier_mask = estimate_motion(prev_pts, curr_pts)
+        self.last_inliers = int(inlier_mask.sum())
+        motion = None
+        if M is not None:
+            motion = (M[0, 2], M[1, 2], np.arctan2(M[1, 0], M[0, 0]))
+
+        # Keep only points that agree with the motion model
+        self.prev_pts = curr_pts[inlier_mask]
+        quality = self.last_inliers / max(len(inlier_mask), 1)
+        lost = len(self.prev_pts) < self.min_tracked or quality < self.min_track_quality
+        return motion, lost
+
+    def _needs_keyframe(self, turn_rate):
+        """Has the view moved far enough from the last keyframe?"""
+        if not self.has_keyframe:
+            return True
+        dx, dy, da = self._kf_motion
+        return (np.hypot(dx, dy) >= self.kf_min_parallax
+                or abs(np.degrees(da)) >= self.kf_min_rotation
+                # 快速转弯时跟踪容易丢失，提前插入关键帧
+                or turn_rate >= self.kf_turn_rate)
+
+
+def _frontend_main(conn, tracking, matcher):
+    """Child process: serve frames from shared memory until told to stop"""
+    # 父进程的采集、编码线程已占满其余核心，子进程的 OpenCV 改为单线程执行
+    cv2.setNumThreads(0)
+    frontend = Frontend(tracking, matcher)
+    slots = []
+    gray = None
+    try:
+        while True:
+            msg = conn.recv()
+            if msg is None:
+                break
+            kind = msg[0]
+            if kind == 'frame':
+                _, slot, shape, turn_rate, force_keyframe = msg
+                gray = np.ndarray(shape, dtype=np.uint8, buffer=slots[slot].buf)
+                conn.send(frontend.process(gray, turn_rate, force_keyframe))
+            elif kind == 'slots':
+                # 旧分段上的帧视图必须先释放，才能关闭共享内存
+                frontend.reset()
+                gray = None
+                for shm in slots:
+                    shm.close()
+                slots = [shared_memory.SharedMemory(name=name) for name in msg[1]]
+            elif kind == 'reset':
+                frontend.reset()
+            elif kind == 'features':
+                frontend.set_max_features(msg[1])
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        # Frontend 仍可能引用共享内存中的帧，先释放再关闭
+        frontend = gray = None
+        for shm in slots:
+            shm.close()
+
+
+class FrontendProcess:
+    """Runs a Frontend in a child process, off the main interpreter's GIL
+
+    Frames are handed over through two shared-memory slots. The child
+    keeps a view of the last frame it processed (KLT tracks from it), so
+    the next frame goes to the other slot only once that one was kept;
+    a frame skipped as redundant leaves the slots as they were and its
+    slot is reused. Requests and
+    results travel over a multiprocessing Pipe: each end has a single
+    reader and a single writer, so no lock is taken. One frame is in
+    flight at a time and the caller blocks in recv() with the GIL
+    released while the child works.
+    """
+
+    def __init__(self, tracking='orb', matcher='bf'):
+        if tracking not in Frontend.TRACKING_MODES:
+            raise ValueError(f"Unknown tracking mode: {tracking}")
+        # 先启动资源跟踪进程，子进程继承它，共享内存的注册才不会被重复清理
+        resource_tracker.ensure_running()
+        # 父进程已有采集、编码和 SLAM 线程，fork 可能继承被占用的锁，用 spawn 启动
+        context = multiprocessing.get_context('spawn')
+        self.conn, child_conn = context.Pipe()
+        self.worker = context.Process(target=_frontend_main, args=(child_conn, tracking, matcher))
+        self.worker.daemon = True
+        self.worker.start()
+        child_conn.close()
+        self.slots = []
+        self.next_slot = 0
+
+    def process(self, gray, turn_rate=0.0, force_keyframe=False):
+        """Same as Frontend.process(), computed in the child process"""
+        if not self.slots or self.slots[0].size < gray.nbytes:
+            self._allocate(gray.nbytes)
+        slot = self.next_slot
+        view = np.ndarray(gray.shape, dtype=np.uint8, buffer=self.slots[slot].buf)
+        view[...] = gray
+        self.conn.send(('frame', slot, gray.shape, turn_rate, force_keyframe))
+        result = self.conn.recv()
+        if not result.skipped:
+            # 子进程保留了这一帧作为 prev_frame，下一帧写入另一个槽
+            self.next_slot = 1 - slot
+        return result
+
+    def set_max_features(self, count):
+        self.conn.send(('features', count))
+
+    def reset(self):
+        self.conn.send(('reset',))
+
+    def _allocate(self, nbytes):
+        old = self.slots
+        self.slots = [shared_memory.SharedMemory(create=True, size=nbytes) for _ in range(2)]
+        # 子进程按顺序处理消息，收到新分段时会丢弃旧帧
+        self.conn.send(('slots', [shm.name for shm in self.slots]))
+        for shm in old:
+            shm.close()
+            shm.unlink()
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.worker.join(timeout=2)
+        if self.worker.is_alive():
+            self.worker.terminate()
+        self.conn.close()
+        for shm in self.slots:
+            shm.close()
+            shm.unlink()
+        self.slots = []
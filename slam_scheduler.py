@@ -0,0 +1,122 @@
+import time
+from collections import namedtuple
+
+# One rung of the SLAM degradation ladder: ORB feature count and the scale
+# frames are downsized by before they reach the frontend
+SlamLevel = namedtuple('SlamLevel', ['name', 'features', 'scale'])
+
+# 负载过高时先减少特征点，再降低分辨率
+SLAM_LEVELS = [
+    SlamLevel('full', 500, 1.0),
+    SlamLevel('reduced', 300, 1.0),
+    SlamLevel('low', 300, 0.75),
+    SlamLevel('minimal', 200, 0.5),
+]
+
+
+class SlamScheduler:
+    """Paces the SLAM loop to a target rate within a CPU budget
+
+    budget is the share of one core SLAM may use. After each frame the
+    loop sleeps for whichever is longer: the rest of the target frame
+    interval, or long enough to keep cost / (cost + sleep) within the
+    budget, so a slow frame is followed by a longer rest instead of SLAM
+    crowding out the control path. Frames older than max_age are dropped
+    rather than processed late.
+
+    When the average frame cost keeps exceeding budget * interval the
+    frontend moves down the ladder; when frames are consistently cheap it
+    moves back up after a cool-down.
+    """
+
+    def __init__(self, target_fps=10, budget=0.5, levels=SLAM_LEVELS,
+                 max_age=None, fast_ratio=0.5, window=10):
+        self.target_fps = target_fps
+        self.interval = 1 / target_fps
+        self.budget = budget
+        self.levels = levels
+        self.level = 0
+        # 帧采集后超过 max_age 仍未处理则直接丢弃
+        self.max_age = max_age if max_age is not None else 2 * self.interval
+        self.fast_ratio = fast_ratio
+        self.window = window
+
+        self.avg_cost = None
+        self.achieved_fps = 0.0
+        self.frames = 0
+        self.stale = 0
+        self.missed = 0
+        self._slow_count = 0
+        self._fast_count = 0
+        self._last_done = None
+
+    @property
+    def settings(self):
+        return self.levels[self.level]
+
+    def frame_arrived(self, gap, capture_time):
+        """Note a new camera frame; returns False if it is too old to process
+
+        gap is how many camera frames were skipped since the previous one.
+        """
+        self.missed += max(gap, 0)
+        if capture_time is not None and time.monotonic() - capture_time > self.max_age:
+            self.stale += 1
+            return False
+        return True
+
+    def record(self, cost):
+        """Feed the processing time of one frame; returns True if the level changed"""
+        now = time.monotonic()
+        self.frames += 1
+        if self._last_done is not None and now > self._last_done:
+            self.achieved_fps = 0.9 * self.achieved_fps + 0.1 / (now - self._last_done)
+        self._last_done = now
+
+        # 指数滑动平均，平滑单帧的耗时波动
+        self.avg_cost = cost if self.avg_cost is None else 0.8 * self.avg_cost + 0.2 * cost
+        allowed = self.budget * self.interval
+
+        if self.avg_cost > allowed:
+            self._slow_count += 1
+            self._fast_count = 0
+        elif self.avg_cost < self.fast_ratio * allowed:
+            self._fast_count += 1
+            self._slow_count = 0
+        else:
+            self._slow_count = 0
+            self._fast_count = 0
+
+        if self._slow_count >= self.window and self.level < len(self.levels) - 1:
+            return self._switch(self.level + 1)
+        # 升档比降档更保守，避免在两档之间来回振荡
+        if self._fast_count >= 3 * self.window and self.level > 0:
+            return self._switch(self.level - 1)
+        return False
+
+    def delay(self, cost):
+        """Seconds to rest after a frame that took cost seconds"""
+        return max(self.interval - cost, cost * (1 / self.budget - 1), 0.0)
+
+    def _switch(self, level):
+        self.level = level
+        self._slow_count = 0
+        self._fast_count = 0
+        return True
+
+    def snapshot(self):
+        cost = self.avg_cost or 0.0
+        return {
+            'target_fps': self.target_fps,
+            'achieved_fps': round(self.achieved_fps, 2),
+            'budget': self.budget,
+            # 实际占用的单核 CPU 比例
+            'budget_used': round(cost * self.achieved_fps, 3),
+            'cost_ms': round(cost * 1000, 2),
+            'level': self.settings.name,
+            'features': self.settings.features,
+            'scale': self.settings.scale,
+            'frames': self.frames,
+            'stale': self.stale,
+            'missed': self.missed,
+        }
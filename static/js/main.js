@@ -10,6 +10,9 @@ document.addEventListener('DOMContentLoaded', function() {
         timeout: 20000             // 连接超时时间
     });
     
+    // 二进制视频通道：URL 带 ?video=ws 时通过 Socket.IO 接收视频帧，代替 MJPEG
+    const useSocketVideo = new URLSearchParams(window.location.search).get('video') === 'ws';
+    
     // Connection status handling
     const connectionStatus = document.getElementById('connection-status');
     let heartbeatTimer = null;
@@ -48,6 +51,11 @@ document.addEventListener('DOMContentLoaded', function() {
         startHeartbeat(); // 连接成功后启动心跳检测
         console.log('已连接到服务器');
         
+        // 每次（重新）连接后重新订阅视频帧
+        if (useSocketVideo) {
+            socket.emit('video_subscribe', { credits: 2 });
+        }
+        
         // 连接成功后立即请求电池状态
         fetch('/battery_status')
             .then(response => response.json())
@@ -82,7 +90,10 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // 视频流错误处理
     const videoFeed = document.getElementById('video-feed');
-    if (videoFeed) {
+    if (videoFeed && useSocketVideo) {
+        videoFeed.removeAttribute('src');
+        startSocketVideo(socket, videoFeed);
+    } else if (videoFeed) {
         videoFeed.onerror = function() {
             console.error('视频流加载失败，尝试重新加载');
             setTimeout(() => {
@@ -249,6 +260,20 @@ document.addEventListener('DOMContentLoaded', function() {
             .then(data => console.log('Gimbal reset:', data));
     });
     
+    // Record button
+    const recordBtn = document.getElementById('record-btn');
+    let recording = false;
+    
+    recordBtn.addEventListener('click', function() {
+        socket.emit('recording_control', { action: recording ? 'stop' : 'start' });
+    });
+    
+    socket.on('recording_status', function(data) {
+        recording = data.recording;
+        recordBtn.textContent = recording ? 'Stop Recording' : 'Record';
+        recordBtn.classList.toggle('recording', recording);
+    });
+    
     // Reset map button
     document.getElementById('reset-map-btn').addEventListener('click', function() {
         fetch('/reset_slam', { method: 'POST' })
@@ -273,6 +298,65 @@ document.addEventListener('DOMContentLoaded', function() {
     initMap();
 });
 
+// Receive video frames over the binary Socket.IO channel
+function startSocketVideo(socket, img) {
+    // 帧头格式见 video_channel.py: u16 版本, u16 帧头长度, u32 帧号,
+    // f64 采集时间, f32 x, y, z, yaw（采集时的SLAM位姿）
+    const poseOverlay = document.createElement('div');
+    poseOverlay.className = 'video-pose';
+    img.parentNode.appendChild(poseOverlay);
+    // 正在解码的帧，以及当前显示的帧的对象URL
+    let pending = null;
+    let shownUrl = null;
+    
+    socket.on('video_frame', function(data) {
+        const view = new DataView(data);
+        const headerLength = view.getUint16(2, true);
+        const frameId = view.getUint32(4, true);
+        const pose = {
+            x: view.getFloat32(16, true),
+            y: view.getFloat32(20, true),
+            z: view.getFloat32(24, true),
+            yaw: view.getFloat32(28, true)
+        };
+        
+        const frame = {
+            id: frameId,
+            url: URL.createObjectURL(new Blob([new Uint8Array(data, headerLength)], { type: 'image/jpeg' })),
+            image: new Image()
+        };
+        // 还没解码完的上一帧被新帧取代：立即确认并释放，否则它的信用永远不会归还
+        if (pending) {
+            settle(pending);
+            URL.revokeObjectURL(pending.url);
+        }
+        pending = frame;
+        
+        // 每帧用自己的 Image 解码，显示后再确认，服务器据此归还信用，慢客户端自然会跳帧
+        frame.image.onload = function() {
+            pending = null;
+            settle(frame);
+            img.src = frame.url;
+            if (shownUrl) {
+                URL.revokeObjectURL(shownUrl);
+            }
+            shownUrl = frame.url;
+            poseOverlay.textContent = `#${frameId}  x ${pose.x.toFixed(2)}  y ${pose.y.toFixed(2)}  yaw ${Math.round(pose.yaw)}°`;
+        };
+        frame.image.onerror = function() {
+            pending = null;
+            settle(frame);
+            URL.revokeObjectURL(frame.url);
+        };
+        frame.image.src = frame.url;
+    });
+    
+    function settle(frame) {
+        frame.image.onload = frame.image.onerror = null;
+        socket.emit('video_ack', { frame_id: frame.id });
+    }
+}
+
 // Initialize 3D map with Three.js
 function initMap() {
     const container = document.getElementById('map-3d');
@@ -310,17 +394,33 @@ function initMap() {
     const car = new THREE.Mesh(carGeometry, carMaterial);
     scene.add(car);
     
+    // Map geometry holds raw SLAM (x, y, z) floats straight from /map_binary;
+    // this group swaps y and z so Y is up in Three.js
+    const mapGroup = new THREE.Group();
+    mapGroup.matrixAutoUpdate = false;
+    mapGroup.matrix.set(1, 0, 0, 0,
+                        0, 0, 1, 0,
+                        0, 1, 0, 0,
+                        0, 0, 0, 1);
+    scene.add(mapGroup);
+    
     // Points for the map
     const pointsGeometry = new THREE.BufferGeometry();
     const pointsMaterial = new THREE.PointsMaterial({ color: 0xff0000, size: 0.1 });
     const points = new THREE.Points(pointsGeometry, pointsMaterial);
-    scene.add(points);
+    // The buffers grow in place, so skip culling against a stale bounding sphere
+    points.frustumCulled = false;
+    mapGroup.add(points);
     
-    // Trajectory line
+    // Trajectory line, a simplified copy from /trajectory replaced as the path grows
     const trajectoryGeometry = new THREE.BufferGeometry();
     const trajectoryMaterial = new THREE.LineBasicMaterial({ color: 0x0000ff });
     const trajectory = new THREE.Line(trajectoryGeometry, trajectoryMaterial);
-    scene.add(trajectory);
+    trajectory.frustumCulled = false;
+    mapGroup.add(trajectory);
+    
+    const pointBuffer = new PositionBuffer(pointsGeometry);
+    const trajectoryBuffer = new PositionBuffer(trajectoryGeometry);
     
     // Handle window resize
     window.addEventListener('resize', function() {
@@ -334,7 +434,7 @@ function initMap() {
         requestAnimationFrame(animate);
         
         // Update map data
-        updateMapData(points, trajectory, car);
+        updateMapData(pointBuffer, trajectoryBuffer, car);
         
         // Render scene
         renderer.render(scene, camera);
@@ -343,55 +443,180 @@ function initMap() {
     animate();
 }
 
+// Growable Float32Array of positions backing a BufferGeometry; rows are
+// appended, matching the server's append-only map, refined in place by
+// sequence number or replaced wholesale
+class PositionBuffer {
+    constructor(geometry) {
+        this.geometry = geometry;
+        this.count = 0;
+        this.array = null;
+        this.allocate(1024);
+    }
+    
+    allocate(capacity) {
+        const array = new Float32Array(capacity * 3);
+        if (this.array) {
+            array.set(this.array.subarray(0, this.count * 3));
+        }
+        this.array = array;
+        this.geometry.setAttribute('position', new THREE.BufferAttribute(array, 3));
+        this.geometry.setDrawRange(0, this.count);
+    }
+    
+    clear() {
+        this.count = 0;
+        this.geometry.setDrawRange(0, 0);
+    }
+    
+    // floats is a Float32Array of interleaved x, y, z in SLAM coordinates
+    append(floats) {
+        if (floats.length === 0) {
+            return;
+        }
+        const needed = this.count + floats.length / 3;
+        if (needed * 3 > this.array.length) {
+            this.allocate(Math.max(needed, this.array.length / 3 * 2));
+        }
+        this.array.set(floats, this.count * 3);
+        this.count = needed;
+        this.geometry.attributes.position.needsUpdate = true;
+        this.geometry.setDrawRange(0, this.count);
+    }
+    
+    // rows is a Uint32Array of sequence numbers, floats their new x, y, z
+    update(rows, floats) {
+        if (rows.length === 0) {
+            return;
+        }
+        for (let i = 0; i < rows.length; i++) {
+            if (rows[i] < this.count) {
+                this.array.set(floats.subarray(i * 3, i * 3 + 3), rows[i] * 3);
+            }
+        }
+        this.geometry.attributes.position.needsUpdate = true;
+    }
+}
+
+// Map polling state: the cursor from the last /map_binary response is sent
+// back so the server only returns points added or refined since then. The trajectory
+// is left out of /map_binary and fetched from /trajectory, simplified to at
+// most TRAJECTORY_BUDGET poses, whenever the header shows it grew
+const MAP_POLL_INTERVAL = 200;  // ms
+const MAP_HEADER_SIZE = 40;
+const MAP_FLAG_RESYNC = 1;
+const TRAJECTORY_HEADER_SIZE = 24;
+const TRAJECTORY_BUDGET = 2000;
+let mapCursor = null;
+let mapRequestPending = false;
+let lastMapPoll = 0;
+let trajectoryVersion = null;
+let trajectoryRequestPending = false;
+
+// Replace the trajectory line with the server's simplified trajectory
+function updateTrajectory(trajectory) {
+    if (trajectoryRequestPending) {
+        return;
+    }
+    trajectoryRequestPending = true;
+    fetch(`/trajectory?budget=${TRAJECTORY_BUDGET}`)
+        .then(response => response.arrayBuffer())
+        .then(buffer => {
+            // Header layout: see TRAJECTORY_HEADER in slam.py
+            const view = new DataView(buffer);
+            if (buffer.byteLength < TRAJECTORY_HEADER_SIZE || view.getUint16(0, true) !== 2) {
+                return;
+            }
+            const headerLength = view.getUint16(2, true);
+            const epoch = view.getUint32(4, true);
+            const trajectoryEpoch = view.getUint32(8, true);
+            const length = view.getUint32(12, true);
+            const count = view.getUint32(16, true);
+            trajectory.clear();
+            trajectory.append(new Float32Array(buffer, headerLength, count * 3));
+            trajectoryVersion = `${epoch}.${trajectoryEpoch}.${length}`;
+        })
+        .catch(error => console.error('Error fetching trajectory:', error))
+        .finally(() => {
+            trajectoryRequestPending = false;
+        });
+}
+
 // Update map data from server
 function updateMapData(points, trajectory, car) {
-    fetch('/map_data')
-        .then(response => response.json())
-        .then(data => {
-            // Update points
-            if (data.points && data.points.length > 0) {
-                const positions = new Float32Array(data.points.length * 3);
-                
-                for (let i = 0; i < data.points.length; i++) {
-                    positions[i * 3] = data.points[i][0];
-                    positions[i * 3 + 1] = data.points[i][2];  // Y is up in Three.js
-                    positions[i * 3 + 2] = data.points[i][1];
-                }
-                
-                points.geometry.setAttribute('position', new THREE.BufferAttribute(positions, 3));
-                points.geometry.attributes.position.needsUpdate = true;
+    const now = Date.now();
+    if (mapRequestPending || now - lastMapPoll < MAP_POLL_INTERVAL) {
+        return;
+    }
+    mapRequestPending = true;
+    lastMapPoll = now;
+    
+    const query = mapCursor
+        ? `?points_only=1&epoch=${mapCursor.epoch}&points=${mapCursor.points}&revision=${mapCursor.revision}`
+        : '?points_only=1';
+    // Unchanged maps are answered with 304 (ETag is the map version)
+    const mapRequest = fetch('/map_binary' + query)
+        .then(response => response.arrayBuffer())
+        .then(buffer => {
+            // Header layout: see MAP_HEADER in slam.py
+            const view = new DataView(buffer);
+            if (buffer.byteLength < MAP_HEADER_SIZE || view.getUint16(0, true) !== 3) {
+                return;
             }
+            const headerLength = view.getUint16(2, true);
+            const epoch = view.getUint32(4, true);
+            const trajectoryEpoch = view.getUint32(8, true);
+            const flags = view.getUint32(12, true);
+            const pointStart = view.getUint32(16, true);
+            const pointCount = view.getUint32(20, true);
+            const trajectoryStart = view.getUint32(24, true);
+            const trajectoryCount = view.getUint32(28, true);
+            const revision = view.getUint32(32, true);
+            const updatedCount = view.getUint32(36, true);
             
-            // Update trajectory
-            if (data.trajectory && data.trajectory.length > 0) {
-                const positions = new Float32Array(data.trajectory.length * 3);
-                
-                for (let i = 0; i < data.trajectory.length; i++) {
-                    positions[i * 3] = data.trajectory[i][0];
-                    positions[i * 3 + 1] = data.trajectory[i][2];  // Y is up in Three.js
-                    positions[i * 3 + 2] = data.trajectory[i][1];
-                }
-                
-                trajectory.geometry.setAttribute('position', new THREE.BufferAttribute(positions, 3));
-                trajectory.geometry.attributes.position.needsUpdate = true;
-                
-                // Update car position to the last trajectory point
-                const lastPoint = data.trajectory[data.trajectory.length - 1];
-                car.position.set(lastPoint[0], lastPoint[2], lastPoint[1]);
+            if (flags & MAP_FLAG_RESYNC) {
+                // Map was reset (or this is the first poll): rebuild from scratch
+                points.clear();
+            } else if (pointStart !== points.count) {
+                // Out of step with the server, ask for a full resync
+                mapCursor = null;
+                return;
+            }
+            // Float32Array views straight over the response, copied into place with set()
+            points.append(new Float32Array(buffer, headerLength, pointCount * 3));
+            // Points merged into since the last poll, after the new rows and the trajectory
+            const updatedOffset = headerLength + (pointCount + trajectoryCount) * 12;
+            points.update(new Uint32Array(buffer, updatedOffset, updatedCount),
+                          new Float32Array(buffer, updatedOffset + updatedCount * 4, updatedCount * 3));
+            mapCursor = {
+                epoch: epoch,
+                points: pointStart + pointCount,
+                revision: revision
+            };
+            // With points_only the trajectory start is its current length; a loop
+            // closure rewrites it under a new trajectory epoch
+            const version = `${epoch}.${trajectoryEpoch}.${trajectoryStart + trajectoryCount}`;
+            if (version !== trajectoryVersion) {
+                updateTrajectory(trajectory);
             }
         })
         .catch(error => console.error('Error fetching map data:', error));
     
     // Also update position and orientation
-    fetch('/position')
+    const positionRequest = fetch('/position')
         .then(response => response.json())
         .then(data => {
+            car.position.set(data.position[0], data.position[2], data.position[1]);
             if (data.orientation) {
                 // Update car rotation based on yaw
                 car.rotation.y = data.orientation[2];
             }
         })
         .catch(error => console.error('Error fetching position data:', error));
+    
+    Promise.all([mapRequest, positionRequest]).finally(() => {
+        mapRequestPending = false;
+    });
 }
 
 // Function to update the 3D map orientation based on IMU data
@@ -0,0 +1,74 @@
+from collections import namedtuple
+
+# One rung of the video quality ladder. size is the (width, height) frames are
+# downscaled to (never upscaled), quality the JPEG quality and fps the maximum
+# rate sent to a viewer on this rung.
+StreamTier = namedtuple('StreamTier', ['name', 'size', 'quality', 'fps'])
+
+# 所有观看者共享同一组档位，Camera 的编码缓存按 (quality, size) 缓存，
+# 因此同一帧每档最多编码一次
+QUALITY_TIERS = [
+    StreamTier('low', (160, 120), 40, 5),
+    StreamTier('medium', (320, 240), 60, 10),
+    StreamTier('high', (640, 480), 70, 15),
+]
+
+
+class AdaptiveStream:
+    """Per-connection quality controller for the MJPEG stream
+
+    The caller reports how long each yield took to drain to the socket.
+    When sending regularly eats a large part of the frame interval the
+    viewer moves down the ladder; when sends are consistently quick it
+    moves up again after a cool-down.
+    """
+
+    def __init__(self, tiers=QUALITY_TIERS, start=1,
+                 slow_ratio=0.5, fast_ratio=0.15, window=10):
+        self.tiers = tiers
+        self.level = min(start, len(tiers) - 1)
+        # 发送耗时占帧间隔的比例阈值
+        self.slow_ratio = slow_ratio
+        self.fast_ratio = fast_ratio
+        # 连续多少帧满足条件才切换档位
+        self.window = window
+        self.avg_send_time = 0.0
+        self._slow_count = 0
+        self._fast_count = 0
+
+    @property
+    def tier(self):
+        return self.tiers[self.level]
+
+    @property
+    def interval(self):
+        return 1 / self.tier.fps
+
+    def record_send(self, seconds):
+        """Feed the time one frame took to drain; returns True if the tier changed"""
+        # 指数滑动平均，平滑偶发的网络抖动
+        self.avg_send_time = 0.8 * self.avg_send_time + 0.2 * seconds
+        ratio = self.avg_send_time / self.interval
+
+        if ratio > self.slow_ratio:
+            self._slow_count += 1
+            self._fast_count = 0
+        elif ratio < self.fast_ratio:
+            self._fast_count += 1
+            self._slow_count = 0
+        else:
+            self._slow_count = 0
+            self._fast_count = 0
+
+        if self._slow_count >= self.window and self.level > 0:
+            return self._switch(self.level - 1)
+        # 升档比降档更保守，避免在两档之间来回振荡
+        if self._fast_count >= 3 * self.window and self.level < len(self.tiers) - 1:
+            return self._switch(self.level + 1)
+        return False
+
+    def _switch(self, level):
+        self.level = level
+        self._slow_count = 0
+        self._fast_count = 0
+        return True
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Map Journal Test Script
+
+This script checks that map_journal.MapJournal reloads exactly what was
+saved: batches appended to the journal on top of a snapshot, records
+already contained in the snapshot (a crash between the rename and the
+truncate), a torn or corrupt record at the end of the journal, records
+from another epoch, and point updates and loop-closure poses that only
+apply after the snapshot.
+
+Usage: python test_map_journal.py (or python -m pytest test_map_journal.py)
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from map_journal import MapJournal, KeyframeRows, DESCRIPTOR_SIZE, RECORD_HEADER
+
+
+def random_keyframes(rng, count):
+    counts = rng.integers(0, 5, count).astype(np.uint32)
+    features = int(counts.sum())
+    return KeyframeRows(rng.random((4, count), dtype=np.float32), counts,
+                        rng.random((features, 2), dtype=np.float32),
+                        rng.integers(0, 256, (features, DESCRIPTOR_SIZE), dtype=np.uint8))
+
+
+def concat_keyframes(pieces):
+    return KeyframeRows(np.concatenate([k.poses for k in pieces], axis=1),
+                        np.concatenate([k.counts for k in pieces]),
+                        np.concatenate([k.pts for k in pieces]),
+                        np.concatenate([k.des for k in pieces]))
+
+
+class Map:
+    """The map as SLAM keeps it, journaled in batches like SLAM._persist_map"""
+
+    def __init__(self, directory, seed=0):
+        self.rng = np.random.default_rng(seed)
+        self.journal = MapJournal(directory)
+        self.epoch = 0
+        self.trajectory = np.empty((4, 0), dtype=np.float32)
+        self.points = np.empty((3, 0), dtype=np.float32)
+        self.keyframes = random_keyframes(self.rng, 0)
+
+    def grow(self, n_traj=3, n_points=20, n_keyframes=2, n_updated=0, rewrite=False):
+        """Add rows, refine n_updated existing points and append them as one batch
+
+        With rewrite, the saved poses are moved first, as a loop closure
+        does, and journaled with the batch.
+        """
+        t_start, p_start, k_start = self.trajectory.shape[1], self.points.shape[1], len(self.keyframes.counts)
+        earlier_trajectory = earlier_poses = None
+        if rewrite:
+            self.trajectory[1:3] += self.rng.random((2, t_start), dtype=np.float32)
+            self.keyframes.poses[:2] += self.rng.random((2, k_start), dtype=np.float32)
+            earlier_trajectory, earlier_poses = self.trajectory, self.keyframes.poses
+        trajectory = self.rng.random((4, n_traj), dtype=np.float32)
+        points = self.rng.random((3, n_points), dtype=np.float32)
+        keyframes = random_keyframes(self.rng, n_keyframes)
+        updated = np.sort(self.rng.choice(p_start, min(n_updated, p_start), replace=False)).astype(np.uint32)
+        self.points[:, updated] = self.rng.random((3, len(updated)), dtype=np.float32)
+        # earlier_* 在追加之前已取出，这里生成新数组
+        self.trajectory = np.concatenate([self.trajectory, trajectory], axis=1)
+        self.points = np.concatenate([self.points, points], axis=1)
+        self.keyframes = concat_keyframes([self.keyframes, keyframes])
+        self.journal.append(self.epoch, t_start, trajectory, p_start, points,
+                            k_start, keyframes, updated, self.points[:, updated],
+                            earlier_trajectory, earlier_poses)
+
+    def compact(self):
+        self.journal.compact(self.epoch, self.trajectory, self.points, self.keyframes)
+
+    def check(self, directory):
+        """Load the map from directory with a new journal and compare"""
+        journal = MapJournal(directory)
+        try:
+            epoch, trajectory, points, keyframes = journal.load()
+        finally:
+            journal.close()
+        assert epoch == self.epoch
+        assert np.array_equal(trajectory, self.trajectory)
+        assert np.array_equal(points, self.points)
+        keyframes = concat_keyframes(keyframes) if keyframes else random_keyframes(self.rng, 0)
+        for loaded, saved in zip(keyframes, self.keyframes):
+            assert np.array_equal(loaded, saved)
+
+
+def journal_path(directory):
+    return os.path.join(directory, 'map.journal')
+
+
+def test_round_trip():
+    with tempfile.TemporaryDirectory() as directory:
+        m = Map(directory)
+        m.grow()
+        m.grow(n_updated=5)
+        m.check(directory)
+        m.compact()
+        m.grow(n_updated=8)
+        m.check(directory)
+        m.journal.close()
+
+
+def test_records_in_snapshot_are_trimmed():
+    with tempfile.TemporaryDirectory() as directory:
+        m = Map(directory)
+        m.grow()
+        m.grow(n_updated=5)
+        # 模拟在替换快照之后、截断日志之前崩溃
+        stale = journal_path(directory) + '.stale'
+        shutil.copy(journal_path(directory), stale)
+        m.compact()
+        shutil.copy(stale, journal_path(directory))
+        m.journal.close()
+        m.journal = MapJournal(directory)
+        m.grow(n_updated=5)
+        m.check(directory)
+        m.journal.close()
+
+
+def test_torn_tail_is_dropped():
+    with tempfile.TemporaryDirectory() as directory:
+        m = Map(directory)
+        m.grow()
+        m.journal.close()
+        size = os.path.getsize(journal_path(directory))
+        expected = Map(directory)
+        expected.trajectory, expected.points, expected.keyframes = m.trajectory, m.points, m.keyframes
+
+        m.journal = MapJournal(directory)
+        m.grow()
+        m.journal.close()
+        with open(journal_path(directory), 'r+b') as f:
+            f.truncate(os.path.getsize(journal_path(directory)) - 7)
+        expected.check(directory)
+        # 损坏的尾部被截掉，之后的追加从完整记录之后开始
+        assert os.path.getsize(journal_path(directory)) == size
+        expected.journal.close()
+
+
+def test_corrupt_tail_is_dropped():
+    with tempfile.TemporaryDirectory() as directory:
+        m = Map(directory)
+        m.grow()
+        m.journal.close()
+        size = os.path.getsize(journal_path(directory))
+        expected = Map(directory)
+        expected.trajectory, expected.points, expected.keyframes = m.trajectory, m.points, m.keyframes
+
+        m.journal = MapJournal(directory)
+        m.grow()
+        m.journal.close()
+        with open(journal_path(directory), 'r+b') as f:
+            f.seek(size + RECORD_HEADER.size + 10)
+            byte = f.read(1)
+            f.seek(-1, os.SEEK_CUR)
+            f.write(bytes([byte[0] ^ 0xff]))
+        expected.check(directory)
+        assert os.path.getsize(journal_path(directory)) == size
+        expected.journal.close()
+
+
+def test_other_epoch_is_discarded():
+    with tempfile.TemporaryDirectory() as directory:
+        m = Map(directory)
+        m.grow()
+        m.compact()
+        m.grow()
+        # 上一个纪元留下的记录（例如重置前写入）不属于当前快照
+        m.journal.append(m.epoch + 1, m.trajectory.shape[1], np.ones((4, 2), dtype=np.float32),
+                         m.points.shape[1], np.ones((3, 4), dtype=np.float32))
+        m.check(directory)
+        m.journal.close()
+
+
+def test_updates_replayed_after_snapshot_only():
+    with tempfile.TemporaryDirectory() as directory:
+        m = Map(directory)
+        m.grow(n_points=30)
+        m.grow(n_updated=10)
+        stale = journal_path(directory) + '.stale'
+        shutil.copy(journal_path(directory), stale)
+        # 快照之后再次细化同一批点，旧记录中的更新不能覆盖它们
+        m.points[:, :30] = m.rng.random((3, 30), dtype=np.float32)
+        m.compact()
+        shutil.copy(stale, journal_path(directory))
+        m.journal.close()
+        m.check(directory)
+
+        m.journal = MapJournal(directory)
+        m.journal.compact(m.epoch, m.trajectory, m.points, m.keyframes)
+        m.grow(n_updated=15)
+        m.grow(n_updated=15)
+        m.check(directory)
+        m.journal.close()
+
+
+def test_pose_rewrites_replayed_after_snapshot_only():
+    with tempfile.TemporaryDirectory() as directory:
+        m = Map(directory)
+        m.grow()
+        m.grow(rewrite=True)
+        m.grow(n_traj=0, n_points=0, n_keyframes=0, rewrite=True)
+        m.grow()
+        m.check(directory)
+
+        stale = journal_path(directory) + '.stale'
+        shutil.copy(journal_path(directory), stale)
+        # 快照中的位姿更新，旧记录中的位姿不能覆盖它们
+        m.trajectory[1:3] += 1
+        m.keyframes.poses[:2] += 1
+        m.compact()
+        shutil.copy(stale, journal_path(directory))
+        m.journal.close()
+        m.journal = MapJournal(directory)
+        m.grow()
+        m.check(directory)
+        m.grow(rewrite=True)
+        m.check(directory)
+        m.journal.close()
+
+
+def main():
+    test_round_trip()
+    test_records_in_snapshot_are_trimmed()
+    test_torn_tail_is_dropped()
+    test_corrupt_tail_is_dropped()
+    test_other_epoch_is_discarded()
+    test_updates_replayed_after_snapshot_only()
+    test_pose_rewrites_replayed_after_snapshot_only()
+    print("Map journal reloads what was saved")
+
+
+if __name__ == '__main__':
+    main()
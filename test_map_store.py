@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Map Store Test Script
+
+This script checks map_store.VoxelMap against brute force: nearest() and
+radius() must find what a scan over all points finds, eviction must keep
+every remaining voxel reachable under its new row number (and bump
+generation), and changed() must list exactly the rows refined in place
+by merges since a given tick.
+
+Usage: python test_map_store.py (or python -m pytest test_map_store.py)
+"""
+
+import numpy as np
+
+from map_store import VoxelMap
+
+
+def random_map(seed, count=3000, voxel_size=0.05):
+    rng = np.random.default_rng(seed)
+    voxels = VoxelMap(voxel_size=voxel_size, capacity=10 * count)
+    # 分批插入，批内和批间都有落在同一体素的点
+    for batch in np.array_split(rng.random((count, 3)).astype(np.float32), 10):
+        voxels.extend(batch)
+    return rng, voxels
+
+
+def test_nearest_matches_brute_force():
+    for seed in range(5):
+        rng, voxels = random_map(seed)
+        points = voxels.view()
+        queries = (rng.random((200, 3)) * 1.2 - 0.1).astype(np.float32)
+        max_distance = 0.12
+        rows, dist = voxels.nearest(queries, max_distance)
+        # (queries, points) 距离矩阵
+        all_dist = np.linalg.norm(queries.T[:, :, None] - points[:, None, :], axis=0)
+        expected = all_dist.min(axis=1)
+        found = expected <= max_distance
+        assert np.array_equal(rows >= 0, found)
+        assert np.allclose(dist[found], expected[found], atol=1e-6)
+        assert np.allclose(all_dist[np.flatnonzero(found), rows[found]], expected[found], atol=1e-6)
+        assert np.all(np.isinf(dist[~found]))
+
+
+def test_radius_matches_brute_force():
+    for seed in range(5):
+        rng, voxels = random_map(seed)
+        points = voxels.view()
+        for query in rng.random((50, 3)).astype(np.float32):
+            radius = float(rng.uniform(0.01, 0.2))
+            rows = voxels.radius(query, radius)
+            dist = np.linalg.norm(points - query[:, None], axis=0)
+            assert set(rows.tolist()) == set(np.flatnonzero(dist <= radius).tolist())
+            # 结果按距离从近到远排列
+            assert np.all(np.diff(dist[rows]) >= 0)
+
+
+def test_eviction_renumbers_rows():
+    rng = np.random.default_rng(0)
+    voxels = VoxelMap(voxel_size=0.05, capacity=500, evict_to=0.8)
+    generation = voxels.generation
+    before = None
+    while voxels.generation == generation:
+        before = voxels.view()
+        voxels.extend(rng.random((100, 3)).astype(np.float32) * 2)
+    assert voxels.generation == generation + 1
+    assert len(voxels) == 400
+    # 淘汰前发出的视图不受影响
+    assert not before.flags.writeable and before.shape[1] > 400
+
+    # 每个保留的体素都能按新行号找到自己
+    points = voxels.view()
+    rows, dist = voxels.nearest(points.T, 0.01)
+    assert np.array_equal(rows, np.arange(len(voxels)))
+    assert np.all(dist == 0)
+    assert np.array_equal(voxels._lookup(voxels._voxel_keys(points.T)), np.arange(len(voxels)))
+
+    # 淘汰后继续插入，新体素接在重新编号的行之后
+    voxels.extend(np.array([[5.0, 5.0, 5.0]], dtype=np.float32))
+    assert voxels.nearest([[5.0, 5.0, 5.0]], 0.01)[0][0] == len(voxels) - 1
+
+    voxels.clear()
+    assert voxels.generation == generation + 2 and len(voxels) == 0
+
+
+def test_changed_after_merges():
+    rng = np.random.default_rng(1)
+    voxels = VoxelMap(voxel_size=0.1, capacity=100000)
+    voxels.extend(rng.random((200, 3)).astype(np.float32))
+    tick, count = voxels.tick, len(voxels)
+    before = voxels.view().copy()
+    assert len(voxels.changed(tick)) == 0
+
+    # 落在已有体素中的点只细化原有的行
+    refined = np.sort(rng.choice(count, 20, replace=False))
+    centres = (np.floor(voxels.view()[:, refined].T / 0.1) + 0.5) * 0.1
+    voxels.extend(centres)
+    assert len(voxels) == count
+    assert np.array_equal(voxels.changed(tick), refined)
+    moved = np.flatnonzero(np.any(voxels.view() != before, axis=0))
+    assert set(moved.tolist()) <= set(refined.tolist())
+
+    # 新体素也算变化；end 之后的行由调用方按追加处理
+    voxels.extend(np.array([[3.0, 3.0, 3.0]], dtype=np.float32))
+    assert np.array_equal(voxels.changed(tick), np.append(refined, count))
+    assert np.array_equal(voxels.changed(tick, count), refined)
+    assert len(voxels.changed(voxels.tick)) == 0
+
+
+def main():
+    test_nearest_matches_brute_force()
+    test_radius_matches_brute_force()
+    test_eviction_renumbers_rows()
+    test_changed_after_merges()
+    print("Voxel map matches brute force")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+D* Lite Test Script
+
+This script checks path_planner.DStarLite against a plain Dijkstra search
+from scratch. On small random grids a robot follows the planned path
+while obstacles appear and disappear; after every step the incremental
+path cost must equal Dijkstra's, and the extracted path must be a free,
+8-connected walk from the start to the goal of that cost.
+
+Usage: python test_path_planner.py (or python -m pytest test_path_planner.py)
+"""
+
+import heapq
+import math
+
+import numpy as np
+
+from path_planner import DStarLite, INF, NEIGHBOURS
+
+
+def dijkstra(blocked, start, goal):
+    """Cost of the cheapest path from start to goal, with the same edge costs as DStarLite"""
+    height, width = blocked.shape
+    dist = {start: 0.0}
+    heap = [(0.0, start)]
+    while heap:
+        d, (x, y) = heapq.heappop(heap)
+        if (x, y) == goal:
+            return d
+        if d > dist[(x, y)]:
+            continue
+        for dx, dy, step in NEIGHBOURS:
+            nx, ny = x + dx, y + dy
+            # 与 DStarLite 相同：进入障碍格代价无穷，离开不受限
+            if 0 <= nx < width and 0 <= ny < height and not blocked[ny, nx]:
+                if d + step < dist.get((nx, ny), INF):
+                    dist[(nx, ny)] = d + step
+                    heapq.heappush(heap, (d + step, (nx, ny)))
+    return INF
+
+
+def path_cost(blocked, path):
+    cost = 0.0
+    for (ax, ay), (bx, by) in zip(path, path[1:]):
+        assert max(abs(ax - bx), abs(ay - by)) == 1, "path cells are not neighbours"
+        assert not blocked[by, bx], "path enters a blocked cell"
+        cost += math.sqrt(2) if ax != bx and ay != by else 1.0
+    return cost
+
+
+def check_random_steps(seed, size=20, steps=60, density=0.25, changes=4):
+    rng = np.random.default_rng(seed)
+    blocked = rng.random((size, size)) < density
+    start, goal = (0, 0), (size - 1, size - 1)
+    blocked[start[1], start[0]] = blocked[goal[1], goal[0]] = False
+    planner = DStarLite(blocked, start, goal)
+    for _ in range(steps):
+        cost = planner.compute()
+        expected = dijkstra(blocked, start, goal)
+        assert math.isclose(cost, expected, abs_tol=1e-6) or cost == expected == INF, \
+            f"D* Lite cost {cost}, Dijkstra {expected}"
+        path = planner.path()
+        if cost == INF:
+            assert path == []
+        else:
+            assert path[0] == start and path[-1] == goal
+            assert math.isclose(path_cost(blocked, path), expected, abs_tol=1e-6)
+            if len(path) > 2:
+                # 沿路径前进一格
+                start = path[1]
+                planner.move_start(start)
+
+        # 随机翻转若干格，目标格保持空闲
+        cells = rng.integers(0, size, (changes, 2))
+        new = blocked.copy()
+        for x, y in cells:
+            if (x, y) != goal:
+                new[y, x] = not new[y, x]
+        changed = np.argwhere(new != blocked)[:, ::-1]
+        blocked = new
+        planner.update_cells(changed, blocked)
+
+
+def test_matches_dijkstra_on_random_steps():
+    for seed in range(20):
+        check_random_steps(seed)
+
+
+def test_unreachable_goal():
+    blocked = np.zeros((5, 5), dtype=bool)
+    blocked[:, 2] = True
+    planner = DStarLite(blocked, (0, 0), (4, 4))
+    assert planner.compute() == INF
+    assert planner.path() == []
+
+    # 打开一个缺口后路径修复
+    blocked[2, 2] = False
+    planner.update_cells([(2, 2)], blocked)
+    assert math.isclose(planner.compute(), dijkstra(blocked, (0, 0), (4, 4)))
+
+
+def main():
+    test_matches_dijkstra_on_random_steps()
+    test_unreachable_goal()
+    print("D* Lite matches Dijkstra")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Pose Graph Test Script
+
+This script checks pose_graph.optimize and how SLAM.correct_poses takes
+up its result. A square loop driven with drifting odometry must close up
+once the loop edge is added, and a graph whose edges agree must come back
+unchanged from any starting guess. SLAM then gets corrected poses for the
+keyframes the graph was built from: keyframes added since must move
+rigidly with the last corrected one, only the trajectory epoch may
+change, and the journal must reload the corrected poses.
+
+Usage: python test_pose_graph.py (or python -m pytest test_pose_graph.py)
+"""
+
+import os
+import tempfile
+
+import numpy as np
+
+from map_journal import MapJournal
+from pose_graph import optimize, relative, wrap
+from slam import SLAM
+from vocabulary import Vocabulary
+
+
+def square_loop(side=10):
+    """Poses (x, y, yaw radians) driving round a square, one per unit"""
+    poses = []
+    for edge in range(4):
+        yaw = edge * np.pi / 2
+        corner = [(0, 0), (side, 0), (side, side), (0, side)][edge]
+        for step in range(side):
+            poses.append((corner[0] + step * np.cos(yaw), corner[1] + step * np.sin(yaw), wrap(yaw)))
+    return np.array(poses)
+
+
+def chain(start, steps):
+    """Compose relative steps (see relative()) from a start pose"""
+    poses = [np.asarray(start, dtype=np.float64)]
+    for dx, dy, da in steps:
+        x, y, a = poses[-1]
+        poses.append(np.array([x + dx * np.cos(a) - dy * np.sin(a), y + dx * np.sin(a) + dy * np.cos(a),
+                               wrap(a + da)]))
+    return np.array(poses)
+
+
+def test_consistent_graph_is_recovered():
+    truth = square_loop()
+    n = len(truth)
+    i = np.arange(n)
+    j = (i + 1) % n
+    z = np.array([relative(truth[a], truth[b]) for a, b in zip(i, j)])
+    rng = np.random.default_rng(0)
+    guess = truth + rng.normal(0, [0.3, 0.3, 0.05], truth.shape)
+    guess[0] = truth[0]
+    result = optimize(guess, i, j, z)
+    assert np.allclose(result[:, :2], truth[:, :2], atol=1e-4)
+    assert np.allclose(wrap(result[:, 2] - truth[:, 2]), 0, atol=1e-5)
+
+
+def test_loop_edge_removes_drift():
+    truth = square_loop()
+    n = len(truth)
+    rng = np.random.default_rng(1)
+    steps = np.array([relative(truth[k], truth[k + 1]) for k in range(n - 1)])
+    # 里程计每步都带一点偏差，绕一圈后误差累积
+    odometry = steps + rng.normal(0, [0.02, 0.02, 0.01], steps.shape) + [0, 0, 0.004]
+    drifted = chain(truth[0], odometry)
+    i = np.append(np.arange(n - 1), n - 1)
+    j = np.append(np.arange(1, n), 0)
+    z = np.vstack([odometry, relative(truth[n - 1], truth[0])])
+    weights = np.append(np.ones(n - 1), 10.0)
+    result = optimize(drifted, i, j, z, weights)
+
+    def error(poses):
+        return np.hypot(*(poses[:, :2] - truth[:, :2]).T).max()
+
+    assert np.array_equal(result[0], drifted[0])
+    assert error(result) < 0.25 * error(drifted)
+    assert np.hypot(*relative(result[n - 1], result[0])[:2] - z[-1][:2]) < 0.05
+
+
+def make_slam(directory):
+    # 用随机描述子训练一个极小的词典，只为创建 LoopCloser；它的线程不启动
+    rng = np.random.default_rng(0)
+    path = os.path.join(directory, 'vocabulary.npz')
+    Vocabulary.train([rng.integers(0, 256, (50, 32), dtype=np.uint8)], branching=2, depth=2).save(path)
+    return SLAM(use_imu=False, map_dir=os.path.join(directory, 'map'), vocabulary=path)
+
+
+def add_keyframes(slam, poses):
+    rng = np.random.default_rng(len(slam.keyframes))
+    for x, y, yaw in poses:
+        with slam.lock:
+            slam.current_position = [float(x), float(y), 0.0]
+            slam.current_orientation[2] = float(np.degrees(yaw))
+        slam._add_keyframe(rng.random((10, 2), dtype=np.float32),
+                           rng.integers(0, 256, (10, 32), dtype=np.uint8))
+
+
+def radians(pose):
+    return np.array([pose[0], pose[1], np.radians(pose[3])])
+
+
+def test_correct_poses_reanchors_later_keyframes():
+    with tempfile.TemporaryDirectory() as directory:
+        slam = make_slam(directory)
+        add_keyframes(slam, square_loop(4)[:10])
+        slam._persist_map()
+        generation = slam.loop_closer.generation
+        # 优化期间 SLAM 又加入了几个关键帧
+        optimized = np.array([radians(kf.pose) for kf in slam.keyframes])
+        add_keyframes(slam, square_loop(4)[10:14])
+        with slam.lock:
+            slam.current_position = [0.5, 3.5, 0.0]
+            slam.current_orientation[2] = 200.0
+        later = [radians(kf.pose) for kf in slam.keyframes[9:]] + [np.array([0.5, 3.5, np.radians(200.0)])]
+        cursor = slam.get_map_delta()['cursor']
+        times = slam.trajectory.column('t').copy()
+
+        # 校正：整体绕原点转 5 度并平移
+        turn = np.radians(5.0)
+        c, s = np.cos(turn), np.sin(turn)
+        corrected = np.column_stack([c * optimized[:, 0] - s * optimized[:, 1] + 0.3,
+                                     s * optimized[:, 0] + c * optimized[:, 1] - 0.2,
+                                     wrap(optimized[:, 2] + turn)])
+        assert not slam.correct_poses(corrected, generation + 1)
+        assert slam.correct_poses(corrected, generation)
+
+        poses = np.array([radians(kf.pose) for kf in slam.keyframes])
+        assert np.allclose(poses[:10, :2], corrected[:, :2], atol=1e-5)
+        assert np.allclose(wrap(poses[:10, 2] - corrected[:, 2]), 0, atol=1e-5)
+        # 之后的关键帧和当前位姿相对最后一个被优化的关键帧保持不变
+        position = slam.get_position()
+        current = np.array([position['position'][0], position['position'][1],
+                            np.radians(position['orientation'][2])])
+        for before, after in zip(later[1:], list(poses[10:]) + [current]):
+            assert np.allclose(relative(later[0], before), relative(poses[9], after), atol=1e-5)
+
+        # 轨迹按关键帧位姿重写，时间不变；只有轨迹纪元变化
+        trajectory = slam.trajectory.view()
+        assert np.allclose(trajectory[1:3].T, poses[:, :2], atol=1e-5)
+        assert np.array_equal(trajectory[0], times)
+        delta = slam.get_map_delta(cursor['epoch'], cursor['points'], cursor['trajectory'],
+                                   cursor['revision'], cursor['trajectory_epoch'])
+        assert not delta['resync'] and delta['trajectory_resync']
+        assert delta['trajectory']['start'] == 0 and delta['points']['start'] == cursor['points']
+
+        # 日志只追加改写后的位姿，重新加载得到校正后的地图
+        add_keyframes(slam, square_loop(4)[14:])
+        slam._persist_map()
+        slam.journal.close()
+        journal = MapJournal(os.path.join(directory, 'map'))
+        epoch, trajectory, points, keyframes = journal.load()
+        journal.close()
+        assert epoch == slam.map_epoch
+        assert np.array_equal(trajectory, slam.trajectory.view())
+        assert np.array_equal(np.concatenate([k.poses for k in keyframes], axis=1),
+                              np.array([kf.pose for kf in slam.keyframes], dtype=np.float32).T)
+
+
+def main():
+    test_consistent_graph_is_recovered()
+    test_loop_edge_removes_drift()
+    test_correct_poses_reanchors_later_keyframes()
+    print("Pose graph and loop correction checks passed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Vocabulary Training
+
+This script trains the bag-of-words vocabulary SLAM uses to find loop
+closure candidates (vocabulary.Vocabulary, see loop_closure.py). It
+reads a recording (video file, image directory or .raw frame file),
+extracts ORB descriptors from every step-th frame the way the SLAM
+frontend does, clusters them into a vocabulary tree of the given
+branching and depth (branching ** depth words) and saves it where SLAM
+loads it at startup. Record the places the car will drive through:
+words learnt from similar scenes separate them best.
+
+Usage: python train_vocabulary.py <recording> [output] [branching] [depth] [step]
+"""
+
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from video_source import open_source
+from vocabulary import Vocabulary
+
+
+def extract(path, step, features=500):
+    """ORB descriptors of every step-th frame, one array per frame"""
+    source = open_source(path, pacing='fast', loop=False)
+    orb = cv2.ORB_create(features)
+    images = []
+    index = 0
+    while True:
+        ret, frame = source.read()
+        if not ret:
+            break
+        if index % step == 0:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            _, des = orb.detectAndCompute(gray, None)
+            if des is not None:
+                images.append(des)
+        index += 1
+    source.release()
+    return images
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    path = sys.argv[1]
+    output = sys.argv[2] if len(sys.argv) > 2 else 'static/data/vocabulary.npz'
+    branching = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    depth = int(sys.argv[4]) if len(sys.argv) > 4 else 4
+    step = int(sys.argv[5]) if len(sys.argv) > 5 else 5
+
+    images = extract(path, step)
+    count = sum(len(des) for des in images)
+    print(f"{len(images)} frames, {count} descriptors")
+    if not images:
+        sys.exit(1)
+
+    start = time.perf_counter()
+    vocabulary = Vocabulary.train(images, branching=branching, depth=depth)
+    used = np.count_nonzero(vocabulary.valid[vocabulary.offsets[-1]:])
+    print(f"Trained {branching}^{depth} vocabulary in {time.perf_counter() - start:.1f}s, "
+          f"{used} of {len(vocabulary)} words used")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    vocabulary.save(output)
+    print(f"Saved {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import numpy as np
+
+
+def simplify(points, tolerance):
+    """Douglas-Peucker: indices of the (n, d) points to keep
+
+    Every dropped point lies within tolerance of the segment between the
+    kept points around it. The first and last points are always kept.
+    """
+    n = len(points)
+    if n < 3:
+        return np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        distances = _segment_distances(points[a + 1:b], points[a], points[b])
+        i = int(np.argmax(distances))
+        if distances[i] > tolerance:
+            i += a + 1
+            keep[i] = True
+            stack.append((a, i))
+            stack.append((i, b))
+    return np.flatnonzero(keep)
+
+
+def _segment_distances(points, a, b):
+    """Distances of (n, d) points to the segment a-b"""
+    ab = b - a
+    length2 = float(ab @ ab)
+    if length2 == 0:
+        return np.linalg.norm(points - a, axis=1)
+    t = np.clip((points - a) @ ab / length2, 0, 1)
+    return np.linalg.norm(points - (a + t[:, None] * ab), axis=1)
+
+
+def fit(points, tolerance, budget):
+    """Simplify (n, d) points with a doubling tolerance until at most budget remain
+
+    Returns (tolerance used, indices kept); budget must be at least 2.
+    """
+    indices = np.arange(len(points))
+    tolerance = tolerance or 0.01
+    while len(indices) > budget:
+        tolerance *= 2
+        indices = indices[simplify(points[indices], tolerance)]
+    return tolerance, indices
+
+
+class _Tier:
+    def __init__(self, tolerance):
+        self.tolerance = tolerance
+        self.frozen = []
+        self.anchor = 0
+
+
+class TrajectoryLOD:
+    """Douglas-Peucker simplifications of a growing trajectory at fixed tolerances
+
+    Each tier keeps the indices of the poses it retains. Rows are only
+    ever appended to the trajectory, so a tier does not simplify the
+    whole path again: update() runs Douglas-Peucker on the tail from the
+    tier's anchor (the last kept pose that may still be dropped) to the
+    newest pose, freezes every kept pose but the last two, and moves the
+    anchor to the one before the newest. Frozen segments stay within
+    tolerance of the poses they replace, so each tier is a valid
+    simplification, if not always the smallest one. A tail that grows
+    past max_tail poses without a kept pose (a long straight run) is
+    frozen as is, which bounds the work per update.
+    """
+
+    def __init__(self, tolerances=(0.05, 0.2, 1.0), max_tail=256):
+        self.tiers = [_Tier(tolerance) for tolerance in sorted(tolerances)]
+        self.max_tail = max_tail
+        self.count = 0
+
+    def update(self, points):
+        """Take in the rows of a (d, n) trajectory view added since the last call"""
+        n = points.shape[1]
+        if n <= self.count:
+            return
+        for tier in self.tiers:
+            keep = simplify(points[:, tier.anchor:n].T, tier.tolerance) + tier.anchor
+            if len(keep) > 2:
+                tier.frozen.extend(keep[:-2].tolist())
+                tier.anchor = int(keep[-2])
+            if n - 1 - tier.anchor > self.max_tail:
+                tier.frozen.append(tier.anchor)
+                tier.anchor = n - 1
+        self.count = n
+
+    def clear(self):
+        for tier in self.tiers:
+            tier.frozen = []
+            tier.anchor = 0
+        self.count = 0
+
+    def _indices(self, tier):
+        if not self.count:
+            return np.empty(0, dtype=np.int64)
+        indices = tier.frozen + [tier.anchor]
+        if self.count - 1 > tier.anchor:
+            indices.append(self.count - 1)
+        return np.array(indices, dtype=np.int64)
+
+    def _size(self, tier):
+        if not self.count:
+            return 0
+        return len(tier.frozen) + 1 + (self.count - 1 > tier.anchor)
+
+    def sizes(self):
+        """{tolerance: kept poses} per tier"""
+        return {tier.tolerance: self._size(tier) for tier in self.tiers}
+
+    def select(self, tolerance=None, budget=None):
+        """Pick a tier for a client's tolerance and/or point budget
+
+        Takes the coarsest tier within tolerance (the full trajectory,
+        tolerance 0, when none is), then coarser tiers until one fits the
+        budget. Returns (tolerance, indices); the coarsest tier can still
+        exceed the budget, see fit().
+        """
+        candidates = [(0.0, None)] + [(tier.tolerance, tier) for tier in self.tiers]
+        sizes = [self.count] + [self._size(tier) for tier in self.tiers]
+        chosen = 0
+        if tolerance is not None:
+            chosen = max((i for i, (t, _) in enumerate(candidates) if t <= tolerance), default=0)
+        if budget is not None:
+            while chosen < len(candidates) - 1 and sizes[chosen] > budget:
+                chosen += 1
+        level, tier = candidates[chosen]
+        if tier is None:
+            return level, np.arange(self.count)
+        return level, self._indices(tier)
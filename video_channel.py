@@ -0,0 +1,119 @@
+import struct
+import time
+
+import eventlet
+import eventlet.tpool
+from eventlet.semaphore import Semaphore
+
+from stream_quality import AdaptiveStream, QUALITY_TIERS
+
+# Binary frame header sent in front of every JPEG on the 'video_frame' event,
+# little-endian:
+#   u16 version, u16 header length, u32 frame_id,
+#   f64 capture timestamp (seconds, camera clock),
+#   f32 x, y, z, yaw (SLAM pose when the frame was captured)
+FRAME_HEADER = struct.Struct('<HHId4f')
+FRAME_HEADER_VERSION = 1
+
+
+class VideoSubscriber:
+    """One Socket.IO client receiving video over the binary channel"""
+
+    def __init__(self, sid, credits, stream, client):
+        self.sid = sid
+        self.max_credits = credits
+        # 每个未确认的帧占用一个信用，客户端确认后归还
+        self.credits = Semaphore(credits)
+        self.stream = stream
+        self.client = client
+        self.active = True
+        self.sent_at = {}
+
+
+class VideoChannel:
+    """Pushes encoded frames to Socket.IO clients with credit-based flow control
+
+    A subscriber starts with a few credits; each frame sent uses one and
+    each 'video_ack' returns it. A client that stops acking stops receiving
+    frames instead of building up a backlog, and when it catches up it is
+    sent the newest frame, so slow links skip frames rather than lag. The
+    ack round trip also drives the subscriber's AdaptiveStream tier.
+    """
+
+    def __init__(self, socketio, camera, slam=None, default_credits=2, max_credits=8):
+        self.socketio = socketio
+        self.camera = camera
+        self.slam = slam
+        self.default_credits = default_credits
+        self.max_credits = max_credits
+        self.subscribers = {}
+
+    def subscribe(self, sid, credits=None, tier=None):
+        """Start streaming to sid, replacing any existing subscription"""
+        self.unsubscribe(sid)
+        try:
+            credits = int(credits)
+        except (TypeError, ValueError):
+            credits = self.default_credits
+        credits = max(1, min(self.max_credits, credits))
+        names = [t.name for t in QUALITY_TIERS]
+        stream = AdaptiveStream(start=names.index(tier) if tier in names else 1)
+        client = self.camera.metrics.open_client('socketio', sid)
+        subscriber = VideoSubscriber(sid, credits, stream, client)
+        self.subscribers[sid] = subscriber
+        self.socketio.start_background_task(self._stream, subscriber)
+
+    def unsubscribe(self, sid):
+        subscriber = self.subscribers.pop(sid, None)
+        if subscriber is not None:
+            subscriber.active = False
+            # 唤醒可能在等待信用的发送任务，让它退出
+            subscriber.credits.release()
+            self.camera.metrics.close_client(subscriber.client)
+
+    def ack(self, sid, frame_id):
+        """Return the credit held by frame_id"""
+        subscriber = self.subscribers.get(sid)
+        if subscriber is None:
+            return
+        sent_at = subscriber.sent_at.pop(frame_id, None)
+        if sent_at is None:
+            return  # 重复或过期的确认，不归还信用
+        subscriber.stream.record_send(time.monotonic() - sent_at)
+        subscriber.credits.release()
+
+    def _stream(self, subscriber):
+        last_frame_id = 0
+        while subscriber.active:
+            # 没有信用时在这里等待，期间产生的帧被跳过
+            if not subscriber.credits.acquire(timeout=5):
+                # 长时间无确认，视为确认丢失，归还全部信用
+                subscriber.sent_at.clear()
+                subscriber.credits = Semaphore(subscriber.max_credits)
+                continue
+            if not subscriber.active:
+                break
+
+            tier = subscriber.stream.tier
+            started = time.monotonic()
+            frame_id, jpeg = eventlet.tpool.execute(
+                self.camera.wait_for_jpeg, last_frame_id, tier.quality, 1.0, tier.size)
+            if jpeg is None:
+                subscriber.credits.release()
+                continue
+            last_frame_id = frame_id
+
+            capture_time = self.camera.get_capture_time(frame_id)
+            x, y, z, yaw = self.slam.pose_at(capture_time) if self.slam is not None else (0, 0, 0, 0)
+            header = FRAME_HEADER.pack(FRAME_HEADER_VERSION, FRAME_HEADER.size, frame_id,
+                                       capture_time or 0.0, x, y, z, yaw)
+            subscriber.sent_at[frame_id] = time.monotonic()
+            self.socketio.emit('video_frame', header + jpeg, to=subscriber.sid)
+            subscriber.client.frame_sent(frame_id, tier.name)
+            if capture_time is not None:
+                self.camera.metrics.record('end_to_end', time.monotonic() - capture_time)
+
+            # 按档位限制帧率
+            remaining = subscriber.stream.interval - (time.monotonic() - started)
+            if remaining > 0:
+                eventlet.sleep(remaining)
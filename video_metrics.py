@@ -0,0 +1,136 @@
+import itertools
+import threading
+import time
+
+
+class LatencyHistogram:
+    """Latency histogram with fixed, roughly logarithmic buckets
+
+    Recording is O(1) and memory is constant, so it can stay on for the
+    whole session. Percentiles are reported as the upper bound of the
+    bucket they fall in.
+    """
+
+    BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, seconds):
+        ms = seconds * 1000
+        i = 0
+        while i < len(self.BOUNDS_MS) and ms > self.BOUNDS_MS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def percentile(self, p):
+        if self.count == 0:
+            return None
+        target = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return self.BOUNDS_MS[i] if i < len(self.BOUNDS_MS) else self.max_ms
+        return self.max_ms
+
+    def snapshot(self):
+        labels = [f"<={b}ms" for b in self.BOUNDS_MS] + [f">{self.BOUNDS_MS[-1]}ms"]
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total_ms / self.count, 2) if self.count else None,
+            'max_ms': round(self.max_ms, 2),
+            'p50_ms': self.percentile(50),
+            'p90_ms': self.percentile(90),
+            'p99_ms': self.percentile(99),
+            'buckets': dict(zip(labels, self.counts)),
+        }
+
+
+class ClientStats:
+    """Delivery counters for one video connection"""
+
+    def __init__(self, client_id, kind, address):
+        self.client_id = client_id
+        self.kind = kind
+        self.address = address
+        self.connected_at = time.monotonic()
+        self.delivered = 0
+        # 两次发送之间跳过的帧数（客户端从未收到的帧）
+        self.dropped = 0
+        self.fps = 0.0
+        self.tier = None
+        self._last_frame_id = None
+        self._last_sent = None
+
+    def frame_sent(self, frame_id, tier=None):
+        now = time.monotonic()
+        if self._last_frame_id is not None and frame_id > self._last_frame_id + 1:
+            self.dropped += frame_id - self._last_frame_id - 1
+        if self._last_sent is not None and now > self._last_sent:
+            # 指数滑动平均的实际送达帧率
+            self.fps = 0.9 * self.fps + 0.1 / (now - self._last_sent)
+        self._last_frame_id = frame_id
+        self._last_sent = now
+        self.delivered += 1
+        self.tier = tier
+
+    def snapshot(self):
+        return {
+            'id': self.client_id,
+            'kind': self.kind,
+            'address': self.address,
+            'connected_s': round(time.monotonic() - self.connected_at, 1),
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+            'fps': round(self.fps, 2),
+            'tier': self.tier,
+        }
+
+
+class VideoMetrics:
+    """Per-stage latency histograms and per-client counters for the video path
+
+    Stages:
+      resize      time spent downscaling a frame in the capture loop
+      encode_wait time an encode job waited for a free encoder
+      encode      JPEG encode (or MJPEG transcode) time
+      send        time a frame took to drain to the client socket
+      end_to_end  capture timestamp to socket write completed
+    """
+
+    STAGES = ('resize', 'encode_wait', 'encode', 'send', 'end_to_end')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {stage: LatencyHistogram() for stage in self.STAGES}
+        self.clients = {}
+        self._ids = itertools.count(1)
+
+    def record(self, stage, seconds):
+        with self.lock:
+            self.histograms[stage].record(seconds)
+
+    def open_client(self, kind, address=None):
+        client = ClientStats(next(self._ids), kind, address)
+        with self.lock:
+            self.clients[client.client_id] = client
+        return client
+
+    def close_client(self, client):
+        with self.lock:
+            self.clients.pop(client.client_id, None)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'stages': {stage: h.snapshot() for stage, h in self.histograms.items()},
+                'clients': [c.snapshot() for c in self.clients.values()],
+            }
@@ -0,0 +1,222 @@
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+
+import cv2
+import numpy as np
+
+
+class ReplaySource(ABC):
+    """Base class for file-backed frame sources
+
+    Subclasses replay recorded frames through the part of the
+    cv2.VideoCapture interface Camera uses, so any of them can be passed as
+    Camera(source=...). Frame timestamps are deterministic: frame n is
+    stamped n / fps seconds, however fast it is actually delivered.
+
+    pacing='realtime' delivers frames at fps, like a live camera.
+    pacing='fast' delivers them as fast as the consumer reads, for
+    measuring pipeline throughput.
+    """
+
+    PACINGS = ('realtime', 'fast')
+    # Camera skips its own frame rate throttle for sources that pace themselves
+    paces_itself = True
+
+    def __init__(self, fps=15, pacing='realtime', loop=True):
+        if pacing not in self.PACINGS:
+            raise ValueError(f"Unknown pacing: {pacing}")
+        self.fps = fps
+        self.pacing = pacing
+        self.loop = loop
+        self.convert_rgb = True
+        self.props = {}
+        self.opened = True
+        # 已输出的帧数和最近一帧的时间戳（秒）
+        self.frame_index = 0
+        self.timestamp = 0.0
+        self._start_time = None
+
+    @abstractmethod
+    def _read_frame(self, image):
+        """Return the next frame, or None at the end of the recording"""
+
+    @abstractmethod
+    def _rewind(self):
+        """Go back to the first frame"""
+
+    def isOpened(self):
+        return self.opened
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_CONVERT_RGB:
+            self.convert_rgb = bool(value)
+        self.props[prop] = value
+        return True
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return self.timestamp * 1000
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return self.frame_index
+        return self.props.get(prop, 0)
+
+    def grab(self):
+        return self.read()[0]
+
+    def read(self, image=None):
+        if not self.opened:
+            return False, None
+
+        frame = self._read_frame(image)
+        if frame is None and self.loop:
+            self._rewind()
+            frame = self._read_frame(image)
+        if frame is None:
+            return False, None
+
+        if self.pacing == 'realtime':
+            if self._start_time is None:
+                self._start_time = time.monotonic()
+            delay = self._start_time + self.frame_index / self.fps - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        self.timestamp = self.frame_index / self.fps
+        self.frame_index += 1
+        return True, frame
+
+    def release(self):
+        self.opened = False
+
+
+def _copy_into(image, frame):
+    """Reuse the caller's buffer like VideoCapture.read(image) does"""
+    if image is not None and image.shape == frame.shape and image.dtype == frame.dtype:
+        np.copyto(image, frame)
+        return image
+    return frame
+
+
+class ImageDirectorySource(ReplaySource):
+    """Replays a directory of image files in name order
+
+    With CAP_PROP_CONVERT_RGB set to 0, read() returns the file contents as
+    a 1-D uint8 array, exactly like a V4L2 device in MJPEG mode; otherwise
+    frames are decoded to BGR.
+    """
+
+    EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+    def __init__(self, directory, **kwargs):
+        super().__init__(**kwargs)
+        self.files = sorted(
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if name.lower().endswith(self.EXTENSIONS))
+        self.index = 0
+        self.opened = bool(self.files)
+
+    def _read_frame(self, image):
+        if self.index >= len(self.files):
+            return None
+        data = np.fromfile(self.files[self.index], dtype=np.uint8)
+        self.index += 1
+        if not self.convert_rgb:
+            return data
+        frame = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        if frame is None:
+            return None
+        return _copy_into(image, frame)
+
+    def _rewind(self):
+        self.index = 0
+
+
+class JpegDirectorySource(ImageDirectorySource):
+    """Stand-in for a USB camera in MJPEG mode, replays a directory of JPEG files"""
+
+    EXTENSIONS = ('.jpg', '.jpeg')
+
+
+class VideoFileSource(ReplaySource):
+    """Replays a video file decoded by OpenCV, always as BGR frames"""
+
+    def __init__(self, path, fps=None, **kwargs):
+        capture = cv2.VideoCapture(path)
+        if fps is None:
+            fps = capture.get(cv2.CAP_PROP_FPS) or 15
+        super().__init__(fps=fps, **kwargs)
+        self.capture = capture
+        self.opened = capture.isOpened()
+
+    def _read_frame(self, image):
+        ret, frame = self.capture.read(image)
+        return frame if ret else None
+
+    def _rewind(self):
+        self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def release(self):
+        super().release()
+        self.capture.release()
+
+
+class RawFrameSource(ReplaySource):
+    """Replays a memory-mapped file of fixed-size raw uint8 frames
+
+    The frame geometry is read from a JSON sidecar next to the file (see
+    write_raw_frames), so frames are paged in by the OS on demand and the
+    whole recording never has to fit in memory.
+    """
+
+    def __init__(self, path, **kwargs):
+        with open(path + '.json') as f:
+            meta = json.load(f)
+        kwargs.setdefault('fps', meta.get('fps', 15))
+        super().__init__(**kwargs)
+        shape = (meta['height'], meta['width'], meta.get('channels', 3))
+        count = os.path.getsize(path) // int(np.prod(shape))
+        self.frames = np.memmap(path, dtype=np.uint8, mode='r', shape=(count,) + shape)
+        self.index = 0
+        self.opened = count > 0
+
+    def _read_frame(self, image):
+        if self.index >= len(self.frames):
+            return None
+        frame = self.frames[self.index]
+        self.index += 1
+        # 总是复制出映射区，Camera 会复用返回的缓冲作为写入目标
+        if image is None or image.shape != frame.shape:
+            image = np.empty(frame.shape, dtype=np.uint8)
+        np.copyto(image, frame)
+        return image
+
+    def _rewind(self):
+        self.index = 0
+
+
+def write_raw_frames(path, frames, fps=15):
+    """Write frames (an iterable of equally sized uint8 images) for RawFrameSource"""
+    shape = None
+    with open(path, 'wb') as f:
+        for frame in frames:
+            if shape is None:
+                shape = frame.shape
+            f.write(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+    if shape is None:
+        raise ValueError("No frames to write")
+    with open(path + '.json', 'w') as f:
+        json.dump({'width': shape[1], 'height': shape[0],
+                   'channels': shape[2] if len(shape) > 2 else 1, 'fps': fps}, f)
+
+
+def open_source(path, **kwargs):
+    """Pick a replay source for path: an image directory, a .raw file or a video file"""
+    if os.path.isdir(path):
+        return ImageDirectorySource(path, **kwargs)
+    if path.endswith('.raw'):
+        return RawFrameSource(path, **kwargs)
+    return VideoFileSource(path, **kwargs)
@@ -0,0 +1,151 @@
+import numpy as np
+
+# 每个字节中置位的个数，用于计算汉明距离
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+# 大于任何 256 位描述子的汉明距离，用于屏蔽空节点
+_FAR = 1 << 16
+
+
+def hamming(a, b):
+    """Hamming distances between broadcastable uint8 descriptor arrays (last axis: bytes)"""
+    return _POPCOUNT[np.bitwise_xor(a, b)].sum(axis=-1, dtype=np.int32)
+
+
+def _majority(des):
+    """Bitwise majority of (n, 32) descriptors, the centroid of a binary cluster"""
+    bits = np.unpackbits(des, axis=1)
+    return np.packbits(bits.sum(axis=0) * 2 >= len(des))
+
+
+def _kmajority(des, k, iterations, rng):
+    """Cluster (n, 32) descriptors into at most k groups
+
+    k-means++ seeding and Lloyd iterations with Hamming distance and
+    majority-bit centroids. Returns (centroids (c, 32), labels (n,)).
+    """
+    if len(des) <= k:
+        return des.copy(), np.arange(len(des))
+    centroids = [des[rng.integers(len(des))]]
+    nearest = hamming(des, centroids[0]).astype(np.float64)
+    for _ in range(1, k):
+        weights = nearest ** 2
+        if not weights.sum():
+            break
+        centroids.append(des[rng.choice(len(des), p=weights / weights.sum())])
+        nearest = np.minimum(nearest, hamming(des, centroids[-1]))
+    centroids = np.array(centroids)
+    labels = None
+    for _ in range(iterations):
+        new_labels = np.argmin(hamming(des[:, None, :], centroids[None, :, :]), axis=1)
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        centroids = np.array([_majority(des[labels == c]) if np.any(labels == c) else centroids[c]
+                              for c in range(len(centroids))])
+    return centroids, labels
+
+
+class Vocabulary:
+    """Bag-of-words vocabulary tree for binary (ORB) descriptors
+
+    A complete tree of the given branching and depth whose nodes are
+    binary centroids: a descriptor descends from the root to the closest
+    child at each level, and the leaf it reaches is its word. Descent
+    costs branching * depth Hamming distances instead of one per word,
+    and runs for all of a frame's descriptors at once.
+
+    Nodes are stored level by level, node p of level l at offsets[l] + p
+    with children p * branching + c; clusters with fewer descriptors than
+    branching leave the remaining children empty (valid False). idf
+    weights each word by log(training images / images containing it), so
+    words seen everywhere count for little.
+
+    Vocabularies are trained offline (see train_vocabulary.py) and
+    stored with save() as an .npz file.
+    """
+
+    def __init__(self, centroids, valid, idf, branching, depth):
+        self.centroids = np.asarray(centroids, dtype=np.uint8)
+        self.valid = np.asarray(valid, dtype=bool)
+        self.idf = np.asarray(idf, dtype=np.float32)
+        self.branching = int(branching)
+        self.depth = int(depth)
+        sizes = [branching ** level for level in range(1, depth + 1)]
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+        if len(self.centroids) != sum(sizes) or len(self.idf) != sizes[-1]:
+            raise ValueError("Vocabulary arrays do not match branching and depth")
+
+    def __len__(self):
+        return len(self.idf)
+
+    @classmethod
+    def train(cls, images, branching=10, depth=4, iterations=10, seed=0):
+        """Train on a list of per-image (n, 32) uint8 descriptor arrays"""
+        rng = np.random.default_rng(seed)
+        images = [np.asarray(des, dtype=np.uint8) for des in images if des is not None and len(des)]
+        if not images:
+            raise ValueError("No descriptors to train on")
+        des = np.concatenate(images)
+        total = sum(branching ** level for level in range(1, depth + 1))
+        centroids = np.zeros((total, des.shape[1]), dtype=np.uint8)
+        valid = np.zeros(total, dtype=bool)
+        offsets = np.cumsum([0] + [branching ** level for level in range(1, depth + 1)])
+
+        # 逐层聚类：(层, 节点序号, 该节点下的描述子)
+        stack = [(0, 0, des)]
+        while stack:
+            level, parent, members = stack.pop()
+            children, labels = _kmajority(members, branching, iterations, rng)
+            for c, centroid in enumerate(children):
+                if not np.any(labels == c):
+                    # 迭代后失去所有成员的中心不作为节点
+                    continue
+                node = parent * branching + c
+                centroids[offsets[level] + node] = centroid
+                valid[offsets[level] + node] = True
+                if level + 1 < depth:
+                    stack.append((level + 1, node, members[labels == c]))
+
+        vocabulary = cls(centroids, valid, np.zeros(branching ** depth, dtype=np.float32),
+                         branching, depth)
+        containing = np.zeros(len(vocabulary), dtype=np.int64)
+        for image in images:
+            containing[np.unique(vocabulary.transform(image))] += 1
+        vocabulary.idf = np.log(len(images) / np.maximum(containing, 1)).astype(np.float32)
+        return vocabulary
+
+    def transform(self, des):
+        """Word ids of (n, 32) uint8 descriptors"""
+        des = np.asarray(des, dtype=np.uint8)
+        node = np.zeros(len(des), dtype=np.int64)
+        children = np.arange(self.branching)
+        for level in range(self.depth):
+            candidates = node[:, None] * self.branching + children
+            nodes = self.offsets[level] + candidates
+            distances = hamming(des[:, None, :], self.centroids[nodes])
+            distances[~self.valid[nodes]] = _FAR
+            node = candidates[np.arange(len(des)), np.argmin(distances, axis=1)]
+        return node
+
+    def bow(self, des):
+        """L1-normalized tf-idf bag of words, as (word ids, weights)"""
+        if des is None or len(des) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        words, counts = np.unique(self.transform(des), return_counts=True)
+        weights = counts * self.idf[words]
+        total = weights.sum()
+        if total > 0:
+            weights /= total
+        keep = weights > 0
+        return words[keep], weights[keep].astype(np.float32)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            np.savez(f, centroids=self.centroids, valid=self.valid, idf=self.idf,
+                     branching=self.branching, depth=self.depth)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['centroids'], data['valid'], data['idf'],
+                       int(data['branching']), int(data['depth']))